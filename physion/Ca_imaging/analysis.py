@@ -1,8 +1,11 @@
-import os
+import os, sys, pathlib
 import numpy as np
 
 from scipy.ndimage.filters import gaussian_filter1d # for gaussian smoothing
 
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+from Ca_imaging.tools import sliding_percentile
+
 def load_data_from_folder(folder,
                           soft_prefix='suite2p',
                           plane_prefix='plane0'):
@@ -15,27 +18,6 @@ def load_data_from_folder(folder,
 
 
 
-# numpy code for ~efficiently evaluating the distrib percentile over a sliding window
-def strided_app(a, L, S ):  # Window len = L, Stride len/stepsize = S
-    nrows = ((a.size-L)//S)+1
-    n = a.strides[0]
-    return np.lib.stride_tricks.as_strided(a, shape=(nrows,L), strides=(S*n,n))
-
-
-def sliding_percentile(array, percentile, Window):
-
-    x = np.zeros(len(array))
-    y0 = strided_app(array, Window, 1)
-
-    y = np.percentile(y0, percentile, axis=-1)
-    
-    x[:int(Window/2)] = y[0]
-    x[-int(Window/2):] = y[-1]
-    x[int(Window/2)-1:-int(Window/2)] = y
-    
-    return x
-
-
 def from_raw_data_to_deltaFoverF(folder,
                                  freq_acq=30.,
                                  fraction_of_substracted_neuropil=0.7,
@@ -68,13 +50,9 @@ def from_raw_data_to_deltaFoverF(folder,
         print(' 3) [...] calculating sliding baseline per cell')
     Twidth = int(sliding_window_for_baseline*freq_acq) # window in sample units 
     # sliding minimum using the max filter of scipy, followed by gaussian smoothing
-    data['sliding_min'] = 0*data['fluo_valid_cells']
-    Twidth = int(sliding_window_for_baseline*freq_acq)
-    for icell in range(data['fluo_valid_cells'].shape[0]):
-        data['sliding_min'][icell,:] = gaussian_filter1d(\
-                   sliding_percentile(data['fluo_valid_cells'][icell,:],
-                                      percentile_threshold_for_baseline,
-                                      Twidth), Twidth)
+    data['sliding_min'] = gaussian_filter1d(sliding_percentile(data['fluo_valid_cells'],
+                                                               percentile_threshold_for_baseline,
+                                                               Twidth), Twidth, axis=-1)
         
     if verbose:
         print(' 4) [...] performing DeltaF/F normalization')
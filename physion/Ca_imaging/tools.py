@@ -1,5 +1,11 @@
+import os, sys, pathlib, hashlib
 import numpy as np
 from scipy.ndimage.filters import gaussian_filter1d # for gaussian smoothing
+from scipy.ndimage import rank_filter
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+from misc.folders import CACHE_FOLDER, CACHE_MAX_SIZE
+from misc.cache import FileCache
 
 #########################
 #########################
@@ -12,57 +18,109 @@ def strided_app(a, L, S ):  # Window len = L, Stride len/stepsize = S
 
 
 def sliding_percentile(array, percentile, Window):
+    """
+    percentile over a sliding window of "Window" samples, along the last axis
+    -> works on a single trace or on a (ROIs, time) matrix
 
-    x = np.zeros(len(array))
-    y0 = strided_app(array, Window, 1)
-    
-    y = np.percentile(y0, percentile, axis=-1)
-    
-    x[:int(Window/2)] = y[0]
-    x[int(Window/2):int(Window/2)+len(y)] = y
-    x[-int(Window/2):] = y[-1]
+    uses running rank filters (scipy.ndimage.rank_filter, ~O(N log(Window)) in recent scipy)
+    of the two order statistics surrounding the percentile, linearly interpolated as
+    in np.percentile. It matches the former strided "np.percentile" implementation
+    up to floating point precision (relative error <1e-12), including at the edges
+    (first/last values repeated over half a window).
+    """
+    array = np.asarray(array, dtype=np.float64)
+    Window = min([Window, array.shape[-1]])
+    rank = percentile/100.*(Window-1)
+    k, f = int(np.floor(rank)), rank-np.floor(rank)
+
+    x = np.empty(array.shape)
+    for x_row, row in zip(x.reshape(-1, array.shape[-1]), array.reshape(-1, array.shape[-1])):
+        # centered windows: x_row[i] is the percentile of row[i-Window//2:i-Window//2+Window]
+        x_row[:] = rank_filter(row, k, size=Window, mode='nearest')
+        if (f>0) and (k+1<Window):
+            x_row[:] = (1-f)*x_row+f*rank_filter(row, k+1, size=Window, mode='nearest')
+        # edges
+        x_row[:int(Window/2)] = x_row[int(Window/2)]
+        x_row[array.shape[-1]-Window+int(Window/2)+1:] = x_row[array.shape[-1]-Window+int(Window/2)]
     return x
 
+class TraceCache(FileCache):
+    """
+    on-disk cache of the derived Ca-Imaging traces (dF/F, F-Fneu, ...), see misc/cache.py
+
+    one ".npy" file per request, keyed by the NWB file identity (path, size, modification time),
+    the set of ROIs, the sub-quantity and the baseline parameters (Tsliding, percentile),
+    cached traces are read back as memory-maps (copy-on-write)
+    """
+    def __init__(self, folder=os.path.join(CACHE_FOLDER, 'CaImaging-traces'),
+                 max_size=CACHE_MAX_SIZE['CaImaging-traces']):
+        super().__init__(folder, max_size, mmap_mode='c', name='trace cache')
+
+    def key(self, filename, ROIs, CaImaging_key, Tsliding, percentile):
+        stat = os.stat(filename)
+        identity = '%s-%i-%i' % (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        request = '%s-%s-%s-%s' % (np.array(ROIs, dtype=int).tobytes().hex(), CaImaging_key, Tsliding, percentile)
+        return hashlib.sha1((identity+request).encode()).hexdigest()
+
+TRACE_CACHE = TraceCache()
+
+
+def read_rows(dataset, indices):
+    """
+    reads the rows of a (ROIs, time) dataset in a single (sorted) read
+    -> h5py requires increasing indices for fancy indexing
+    """
+    unique, inverse = np.unique(indices, return_inverse=True)
+    return np.asarray(dataset[unique,:])[inverse,:]
+
+
 def compute_CaImaging_trace(cls, CaImaging_key, roiIndices,
                             Tsliding=60, percentile=5.,
                             with_sliding_mean = False,
-                            sum=False):
+                            sum=False,
+                            cache=TRACE_CACHE):
     """
     # /!\ the validROI_indices are used here  /!\ (DEPRECATED NOW STORING ONLY THE VALID ROIS)
 
+    the derived traces (dF/F, F-Fneu, ...) are stored in the on-disk "cache" (see TraceCache), "cache=None" to disable
     """
     if CaImaging_key in ['Fluorescence', 'Neuropil', 'Deconvolved']:
         return getattr(cls, CaImaging_key).data[cls.validROI_indices[roiIndices], :]
+
+    ROIs = np.array(cls.validROI_indices[roiIndices], dtype=int).flatten() # /!\ validROI_indices here /!\
+
+    key = None
+    if (cache is not None) and hasattr(cls, 'io') and (cls.io.source is not None):
+        key = cache.key(cls.io.source, ROIs, CaImaging_key, Tsliding, percentile)
+        traces = cache.get(key)
+        if traces is not None:
+            return traces
         
-    elif CaImaging_key in ['dF/F', 'dFoF']:
+    if CaImaging_key in ['dF/F', 'dFoF']:
         """
         computes dF/F with a smotthed sliding percentile
         """
         iTsm = int(Tsliding/cls.CaImaging_dt)
 
-        DFoF = []
-        for ROI in cls.validROI_indices[roiIndices]:
-            Fmin = sliding_percentile(cls.Fluorescence.data[ROI,:], percentile, iTsm) # sliding percentile
-            Fmin = gaussian_filter1d(Fmin, Tsliding) # + smoothing
-            DFoF.append((cls.Fluorescence.data[ROI,:]-Fmin)/Fmin)
-        return np.array(DFoF)
+        F = read_rows(cls.Fluorescence.data, ROIs)
+        Fmin = sliding_percentile(F, percentile, iTsm) # sliding percentile, all ROIs at once
+        Fmin = gaussian_filter1d(Fmin, Tsliding, axis=-1) # + smoothing
+        traces = (F-Fmin)/Fmin
 
     elif CaImaging_key in ['F-Fneu', 'dF']:
-        DF = []
-        for ROI in cls.validROI_indices[roiIndices]: # /!\ validROI_indices here /!\
-            DF.append(cls.Fluorescence.data[ROI,:]-cls.Neuropil.data[ROI,:])
-        return np.array(DF)
+        traces = read_rows(cls.Fluorescence.data, ROIs)-read_rows(cls.Neuropil.data, ROIs)
     
     elif 'F-' in CaImaging_key: # key of the form "F-0.85*Fneu"
         coef = float(CaImaging_key.replace('F-', '').replace('*Fneu', ''))
-        DF = []
-        for ROI in cls.validROI_indices[roiIndices]: # /!\ validROI_indices here /!\
-            DF.append(cls.Fluorescence.data[ROI,:]-coef*cls.Neuropil.data[ROI,:])
-        return np.array(DF)
+        traces = read_rows(cls.Fluorescence.data, ROIs)-coef*read_rows(cls.Neuropil.data, ROIs)
     else:
         print(20*'--')
         print(' /!\ "%s" not recognized to process the CaImaging signal /!\ ')
         print(20*'--')
         return None
 
+    if key is not None:
+        cache.set(key, traces)
+    return traces
+
               
@@ -1,4 +1,5 @@
-import sys, pathlib, os, subprocess
+import sys, pathlib, os, subprocess, time, importlib, importlib.util
+tstart_launcher = time.time()
 from PyQt5 import QtGui, QtCore, QtWidgets
 
 sys.path.append(str(pathlib.Path(__file__).resolve().parent))
@@ -6,14 +7,26 @@ from misc.style import set_dark_style, set_app_icon
 from misc.colors import build_dark_palette
 
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
-try:
-    from psychopy import visual, core, event, clock, monitors # some libraries from PsychoPy
-    no_psychopy = False
-except ModuleNotFoundError:
+# psychopy is only looked up here, it is imported with the experiment module
+no_psychopy = (importlib.util.find_spec('psychopy') is None)
+if no_psychopy:
     print('Experiment & Visual-Stim modules disabled !')
-    no_psychopy = True
 
 CHILDREN_PROCESSES = []
+IMPORT_TIMES = {} # import time (s) of the subsystems, see "load_module"
+
+def load_module(name):
+    """
+    the subsystems (GUIs and their dependencies) are imported only when first opened,
+    the import time is reported and stored in IMPORT_TIMES
+    """
+    if name not in IMPORT_TIMES:
+        tstart = time.time()
+        importlib.import_module(name)
+        IMPORT_TIMES[name] = time.time()-tstart
+        print('"%s" module loaded in %.2fs' % (name, IMPORT_TIMES[name]))
+    return sys.modules[name]
+
 class MainWindow(QtWidgets.QMainWindow):
     
     def __init__(self, app,
@@ -82,49 +95,48 @@ class MainWindow(QtWidgets.QMainWindow):
             
         self.show()
 
+    def launch(self, name, **kwargs):
+        """ imports the subsystem "name" (on first use) and opens its window """
+        self.statusBar.showMessage('Loading "%s" [...]' % name)
+        self.app.processEvents()
+        try:
+            module = load_module(name)
+        except BaseException as be:
+            print(be)
+            self.statusBar.showMessage(' /!\ "%s" module cant be loaded /!\ ' % name)
+            return None
+        child = module.run(self.app, self.args, **kwargs)
+        self.statusBar.showMessage('"%s" loaded in %.2fs' % (name, IMPORT_TIMES[name]))
+        CHILDREN_PROCESSES.append(child)
+        return child
+
     def launch_exp(self):
         if not no_psychopy:
-            from physion.exp.gui import run as RunExp
-            child = RunExp(self.app, self.args)
-            CHILDREN_PROCESSES.append(child)
+            self.launch('physion.exp.gui')
         else:
             self.statusBar.showMessage('Module cant be launched, PsychoPy is missing !')
             
         
     def launch_facemotion(self):
-        from physion.facemotion.gui import run as RunFacemotion
-        child = RunFacemotion(self.app, self.args)
-        CHILDREN_PROCESSES.append(child)
+        self.launch('physion.facemotion.gui')
         
     def launch_visual_stim(self):
-        from physion.visual_stim.gui import run as RunVisualStim
-        child = RunVisualStim(self.app, self.args)
-        CHILDREN_PROCESSES.append(child)
+        self.launch('physion.visual_stim.gui')
         
     def launch_assembling(self):
-        from physion.assembling.gui import run as RunAssembling
-        child = RunAssembling(self.app, self.args)
-        CHILDREN_PROCESSES.append(child)
+        self.launch('physion.assembling.gui')
         
     def launch_transfer(self):
-        from physion.transfer.gui import run as RunTransfer
-        child = RunTransfer(self.app, self.args)
-        CHILDREN_PROCESSES.append(child)
+        self.launch('physion.transfer.gui')
         
     def launch_pupil(self):
-        from physion.pupil.gui import run as RunPupilGui
-        child = RunPupilGui(self.app, self.args)
-        CHILDREN_PROCESSES.append(child)
+        self.launch('physion.pupil.gui')
         
     def launch_CaProprocessing(self):
-        from physion.Ca_imaging.guiPP import run as RunCaPreprocessing
-        child = RunCaPreprocessing(self.app, self.args)
-        CHILDREN_PROCESSES.append(child)
+        self.launch('physion.Ca_imaging.guiPP')
 
     def launch_CaAddition(self):
-        from physion.Ca_imaging.guiAdd import run as RunCaAddition
-        child = RunCaAddition(self.app, self.args)
-        CHILDREN_PROCESSES.append(child)
+        self.launch('physion.Ca_imaging.guiAdd')
         
     def launch_electrophy(self):
         self.statusBar.showMessage('Electrophy module not implemented yet')
@@ -149,14 +161,11 @@ class MainWindow(QtWidgets.QMainWindow):
 
         
     def launch_visualization(self):
-        self.statusBar.showMessage('Loading Visualization Module [...]')
-        from physion.dataviz.gui import run as RunAnalysisGui
-        self.child = RunAnalysisGui(self.app, self.args,
-                                    raw_data_visualization=True)
+        self.child = self.launch('physion.dataviz.gui',
+                                 raw_data_visualization=True)
         
     def summary_pdf(self):
-        from physion.misc.notebook import run as RunNotebook
-        self.child = RunNotebook(self.app, self.args)
+        self.child = self.launch('physion.misc.notebook')
 
     def launch_notebook(self):
         import subprocess
@@ -176,4 +185,5 @@ def run(args):
     # set_dark_style(app)
     set_app_icon(app)
     GUI = MainWindow(app, args=args)
+    print('launcher ready in %.2fs' % (time.time()-tstart_launcher))
     sys.exit(app.exec_())
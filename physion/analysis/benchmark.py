@@ -0,0 +1,274 @@
+import os, sys, pathlib, time, json, datetime, platform, tempfile, tracemalloc, resource, multiprocessing
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+from assembling.synthetic_NWB import build_synthetic_NWB, SYNTHETIC_MODALITIES
+
+# synthetic session sizes (duration in s)
+SESSIONS = {'small':dict(duration=300., Nrois=50, Nepisodes=40),
+            'medium':dict(duration=1200., Nrois=200, Nepisodes=160),
+            'large':dict(duration=3600., Nrois=1000, Nepisodes=480)}
+
+
+def measure(func, repeat=3):
+    """
+    timing of "func()" over "repeat" runs, then one more run under tracemalloc for the memory
+
+    returns: {'times':[...], 'time':min(times), 'peak_memory':bytes allocated at peak (python+numpy)}
+    """
+    times = []
+    for i in range(repeat):
+        tstart = time.perf_counter()
+        func()
+        times.append(time.perf_counter()-tstart)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'times':times, 'time':float(np.min(times)), 'peak_memory':int(peak)}
+
+
+######################################
+####     the benchmarked paths    ####
+######################################
+
+def bench_read(filename):
+    from analysis.read_NWB import Data
+    def func():
+        data = Data(filename)
+        data.io.close()
+    return func
+
+
+def bench_CaImaging_trace(filename, CaImaging_key='dF/F', cached=False):
+    """ always computed, or read back from the trace cache after the first call with "cached" """
+    from analysis.read_NWB import Data
+    from Ca_imaging.tools import compute_CaImaging_trace, TRACE_CACHE
+    cache = (TRACE_CACHE if cached else None)
+    data = Data(filename)
+    roiIndices = np.arange(len(data.validROI_indices))
+    def func():
+        compute_CaImaging_trace(data, CaImaging_key, roiIndices, cache=cache)
+    return func
+
+
+def bench_build_episodes(filename, quantity='CaImaging', CaImaging_key='dF/F'):
+    """ all ROIs, the dF/F traces come from the trace cache after the first call """
+    from analysis.read_NWB import Data
+    from analysis.trial_averaging import build_episodes
+    data = Data(filename)
+    data.CaImaging_key, data.roiIndices = CaImaging_key, np.arange(len(data.validROI_indices))
+    def func():
+        build_episodes(data, quantity=quantity, protocol_id=0, dt_sampling=10,
+                       multi_ROI=True, verbose=False)
+    return func
+
+
+def bench_summary_pdf(filename, Nmax=10, Nworkers=multiprocessing.cpu_count()):
+    from analysis.summary_pdf import make_sumary_pdf
+    def func():
+        make_sumary_pdf(filename, Nmax=Nmax, Nworkers=Nworkers)
+    return func
+
+
+def bench_RF_maps(filename, Nrois=20):
+    """ receptive fields of the first "Nrois" ROIs at the screen resolution, all ROIs at once """
+    from analysis.read_NWB import Data
+    from analysis.receptive_field_mapping import CellResponse
+    data = Data(filename, with_visual_stim=True)
+    cell = CellResponse(data, protocol_id=0)
+    roiIndices = np.arange(min([Nrois, np.sum(data.iscell)]))
+    def func():
+        cell.reverse_correlation_all(roiIndices)
+    return func
+
+
+BENCHMARKS = {'read':bench_read,
+              'CaImaging_trace':bench_CaImaging_trace,
+              'CaImaging_trace-cached':lambda filename: bench_CaImaging_trace(filename, cached=True),
+              'build_episodes':bench_build_episodes,
+              'RF_maps':bench_RF_maps,
+              'summary_pdf':bench_summary_pdf}
+
+
+######################################
+####   checks of the fast paths   ####
+######################################
+
+def reverse_correlation_per_ROI(cell, roiIndex, subquantity='dF/F', metrics='mean'):
+    """ the former per-ROI loop of "CellResponse.reverse_correlation" (float64), the reference of "check_RF_maps" """
+    from Ca_imaging.tools import compute_CaImaging_trace
+    dF = compute_CaImaging_trace(cell, subquantity, [roiIndex]).sum(axis=0)
+    t = cell.Fluorescence.timestamps[:]
+    full_img, cum_weight = np.zeros(cell.visual_stim.screen['resolution'], dtype=float).T, 0
+    for i in np.arange(cell.nwbfile.stimulus['time_start_realigned'].num_samples)[cell.Pcond]:
+        cond = (t>cell.nwbfile.stimulus['time_start_realigned'].data[i]) &\
+            (t<cell.nwbfile.stimulus['time_stop_realigned'].data[i])
+        weight = np.inf
+        if metrics == 'mean':
+            weight = np.mean(dF[cond])
+        elif np.sum(cond)>0 and (metrics=='max'):
+            weight = np.max(dF[cond])
+        if np.isfinite(weight):
+            full_img += weight*2*(cell.visual_stim.get_image(i)-.5)
+            cum_weight += weight
+    return full_img/cum_weight
+
+
+def check_RF_maps(filename, Nrois=5, tolerance=1e-4):
+    """
+    the receptive fields of all ROIs at once ("reverse_correlation_all", float32, downsampling=1)
+    against the per-ROI reference, for both metrics
+
+    returns: {'max_relative_difference':..., 'tolerance':..., 'ok':...}
+    """
+    from analysis.read_NWB import Data
+    from analysis.receptive_field_mapping import CellResponse
+    data = Data(filename, with_visual_stim=True)
+    cell = CellResponse(data, protocol_id=0)
+    roiIndices = np.arange(min([Nrois, np.sum(data.iscell)]))
+    difference = 0
+    for subquantity, metrics in [('dF/F', 'mean'), ('Deconvolved', 'max')]:
+        maps = cell.reverse_correlation_all(roiIndices, subquantity=subquantity, metrics=metrics)
+        for k, roiIndex in enumerate(roiIndices):
+            reference = reverse_correlation_per_ROI(cell, roiIndex, subquantity=subquantity, metrics=metrics)
+            difference = max([difference, np.max(np.abs(maps[k]-reference))/np.max(np.abs(reference))])
+    return {'max_relative_difference':float(difference), 'tolerance':tolerance,
+            'ok':bool(difference<tolerance)}
+
+
+CHECKS = {'RF_maps':check_RF_maps}
+
+
+def run_benchmarks(sessions=['small'],
+                   benchmarks=list(BENCHMARKS.keys()),
+                   checks=list(CHECKS.keys()),
+                   repeat=3,
+                   folder=None,
+                   modalities=SYNTHETIC_MODALITIES,
+                   Nworkers=multiprocessing.cpu_count(),
+                   verbose=True):
+    """
+    generates the synthetic sessions (see assembling/synthetic_NWB.py) and runs the benchmarks on them,
+    a failing benchmark (e.g. a missing dependency) is reported in the results, it does not stop the others
+
+    the "checks" compare the fast paths with their reference implementation on the same sessions
+
+    the trace cache (see Ca_imaging/tools.py) is moved to "folder" so that the runs do not depend on the user cache
+    """
+    from Ca_imaging.tools import TRACE_CACHE
+    folder = (folder if folder is not None else tempfile.mkdtemp())
+    pathlib.Path(folder).mkdir(parents=True, exist_ok=True)
+    TRACE_CACHE.folder = os.path.join(folder, 'CaImaging-traces')
+    TRACE_CACHE.clear()
+    results = {'date':datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S'),
+               'platform':platform.platform(),
+               'python':platform.python_version(),
+               'numpy':np.__version__,
+               'cpu_count':multiprocessing.cpu_count(),
+               'Nworkers':Nworkers,
+               'repeat':repeat,
+               'sessions':{}, 'benchmarks':{}, 'checks':{}}
+
+    for session in sessions:
+        filename = os.path.join(folder, 'synthetic-%s.nwb' % session)
+        if not os.path.isfile(filename):
+            if verbose:
+                print('=> building the "%s" synthetic session %s [...]' % (session, SESSIONS[session]))
+            build_synthetic_NWB(filename, modalities=modalities, **SESSIONS[session])
+        results['sessions'][session] = dict(SESSIONS[session], filename=filename,
+                                            size=os.path.getsize(filename))
+
+        for bench in benchmarks:
+            key = '%s/%s' % (session, bench)
+            try:
+                if bench=='summary_pdf':
+                    func = BENCHMARKS[bench](filename, Nworkers=Nworkers)
+                    results['benchmarks'][key] = measure(func, repeat=1) # too slow for repeats
+                else:
+                    func = BENCHMARKS[bench](filename)
+                    results['benchmarks'][key] = measure(func, repeat=repeat)
+            except BaseException as be:
+                print(be)
+                print(' /!\ benchmark "%s" failed /!\ ' % key)
+                results['benchmarks'][key] = {'error':str(be)}
+            if verbose:
+                print_result(key, results['benchmarks'][key])
+
+        for check in checks:
+            key = '%s/%s' % (session, check)
+            try:
+                results['checks'][key] = CHECKS[check](filename)
+            except BaseException as be:
+                print(be)
+                print(' /!\ check "%s" failed /!\ ' % key)
+                results['checks'][key] = {'error':str(be)}
+            if verbose:
+                print_check(key, results['checks'][key])
+
+    results['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # kB on linux
+    return results
+
+
+def print_result(key, result, reference=None):
+    if 'error' in result:
+        print(' - %s: failed (%s)' % (key, result['error']))
+    elif (reference is None) or ('error' in reference):
+        print(' - %s: %.3fs, peak memory: %.1fMB' % (key, result['time'], result['peak_memory']/1e6))
+    else:
+        print(' - %s: %.3fs (x%.2f), peak memory: %.1fMB (x%.2f)' % (key,
+                    result['time'], result['time']/reference['time'],
+                    result['peak_memory']/1e6, result['peak_memory']/max([1, reference['peak_memory']])))
+
+
+def print_check(key, result):
+    if 'error' in result:
+        print(' - check %s: failed (%s)' % (key, result['error']))
+    else:
+        print(' - check %s: %s (max. relative difference: %.1e, tolerance: %.0e)' % (key,
+                    ('ok' if result['ok'] else '/!\ MISMATCH /!\ '),
+                    result['max_relative_difference'], result['tolerance']))
+
+
+def save_results(results, filename):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(filename):
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def compare_results(results, reference):
+    """ prints the results with their ratio to the reference run (ratios>1 mean slower/larger) """
+    print('comparison with the run of %s:' % reference['date'])
+    for key in results['benchmarks']:
+        print_result(key, results['benchmarks'][key],
+                     reference=(reference['benchmarks'][key] if key in reference['benchmarks'] else None))
+
+
+if __name__=='__main__':
+
+    import argparse
+    parser=argparse.ArgumentParser(description="""
+    Benchmarking the analysis of synthetic NWB sessions
+    (reading, Ca-Imaging traces, episodes, receptive fields, summary pdfs)
+    """,formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-s', "--sessions", nargs='*', type=str, default=['small'], choices=list(SESSIONS.keys()))
+    parser.add_argument('-b', "--benchmarks", nargs='*', type=str, default=list(BENCHMARKS.keys()), choices=list(BENCHMARKS.keys()))
+    parser.add_argument('-k', "--checks", nargs='*', type=str, default=list(CHECKS.keys()), choices=list(CHECKS.keys()))
+    parser.add_argument('-r', "--repeat", type=int, default=3)
+    parser.add_argument('-n', "--Nworkers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('-f', "--folder", type=str, default=None, help='folder of the synthetic sessions (re-used if existing)')
+    parser.add_argument('-o', "--output", type=str, default='benchmark-%s.json' % datetime.datetime.now().strftime('%Y_%m_%d-%H-%M-%S'))
+    parser.add_argument('-c', "--compare", type=str, default='', help='json file of a previous run to compare with')
+    args = parser.parse_args()
+
+    results = run_benchmarks(sessions=args.sessions, benchmarks=args.benchmarks, checks=args.checks,
+                             repeat=args.repeat, folder=args.folder, Nworkers=args.Nworkers)
+    save_results(results, args.output)
+    print('[ok] results saved as "%s"' % args.output)
+
+    if args.compare!='':
+        compare_results(results, load_results(args.compare))
@@ -3,6 +3,7 @@ import numpy as np
 
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
 from assembling.saving import day_folder, list_dayfolder, get_files_with_extension
+from misc.folders import CACHE_FOLDER
 
 def init(self):
 
@@ -141,27 +142,104 @@ class DummyParent:
     def __init__(self):
         pass
 
-def scan_folder_for_NWBfiles(folder, verbose=True):
+class NWBIndex:
+    """
+    persistent index of the NWB files, one entry per file with:
+        subject, subject_description, display_name, date, protocols, modalities, nROIs, duration
 
-    if verbose:
-        print('inspecting the folder "%s" [...]' % folder)
+    stored as a single dictionary in "filename",
+    an entry is (re-)built only when the file size or modification time changed
+    """
+    def __init__(self, filename=os.path.join(CACHE_FOLDER, 'NWB-index.npy')):
+        self.filename, self.modified = filename, False
+        try:
+            self.entries = np.load(self.filename, allow_pickle=True).item()
+        except BaseException:
+            self.entries = {}
+
+    def get(self, fn, verbose=False):
+        stat = os.stat(fn)
+        key = os.path.abspath(fn)
+        if (key not in self.entries) or (self.entries[key]['size']!=stat.st_size) or\
+           (self.entries[key]['mtime']!=stat.st_mtime):
+            entry, success = self.build_entry(fn, verbose=verbose)
+            if not success:
+                return entry # not stored, the file is read again next time
+            self.entries[key] = entry
+            self.entries[key]['size'], self.entries[key]['mtime'] = stat.st_size, stat.st_mtime
+            self.modified = True
+        return self.entries[key]
+
+    def get_entries(self, FILES, verbose=False):
+        entries = [self.get(f, verbose=verbose) for f in FILES]
+        self.save()
+        return entries
+
+    def save(self):
+        """ written under a temporary name and then renamed: an interrupted or concurrent save never truncates the index """
+        if self.modified:
+            try:
+                pathlib.Path(os.path.dirname(self.filename)).mkdir(parents=True, exist_ok=True)
+                tmp = '%s-%i.tmp.npy' % (os.path.splitext(self.filename)[0], os.getpid())
+                np.save(tmp, self.entries)
+                os.replace(tmp, self.filename)
+                self.modified = False
+            except OSError as be:
+                print(be)
 
-    parent = DummyParent()
-    
-    FILES = get_files_with_extension(folder, extension='.nwb', recursive=True)
-    DATES = np.array([f.split(os.path.sep)[-1].split('-')[0] for f in FILES])
-    SUBJECTS = []
-    
-    for f in FILES:
+    @staticmethod
+    def build_entry(fn, verbose=False):
+        """
+        returns the entry and whether the file could be read,
+        each field is read separately (a missing field stays at its default value)
+        """
+        entry = {'subject':'N/A', 'subject_description':'N/A',
+                 'display_name':os.path.basename(fn),
+                 'date':os.path.basename(fn).split('-')[0],
+                 'protocols':[], 'modalities':[], 'nROIs':0, 'duration':0.}
+        parent = DummyParent()
         try:
-            read(parent, f, metadata_only=True)
-            SUBJECTS.append(parent.metadata['subject_ID'])
+            read(parent, fn, metadata_only=True)
         except BaseException as be:
-            SUBJECTS.append('N/A')
             if verbose:
                 print(be)
-                print('\n /!\ Pb with "%s" \n' % f)
+                print('\n /!\ Pb with "%s" \n' % fn)
+            if hasattr(parent, 'io'):
+                parent.io.close()
+            return entry, False
+
+        FIELDS = {'subject':lambda: (parent.metadata['subject_ID'] if 'subject_ID' in parent.metadata else 'N/A'),
+                  'subject_description':lambda: parent.nwbfile.subject.description,
+                  'display_name':lambda: parent.df_name,
+                  'protocols':lambda: [str(p) for p in parent.protocols],
+                  'modalities':lambda: list(parent.nwbfile.acquisition.keys())+list(parent.nwbfile.processing.keys()),
+                  'nROIs':lambda: (parent.nwbfile.processing['ophys'].data_interfaces['Fluorescence'].roi_response_series['Fluorescence'].data.shape[0]\
+                                   if 'ophys' in parent.nwbfile.processing else 0),
+                  'duration':lambda: float(parent.tlim[1]-parent.tlim[0])}
+        for key in FIELDS:
+            try:
+                entry[key] = FIELDS[key]()
+            except BaseException as be:
+                if verbose:
+                    print(be)
+                    print('\n /!\ no "%s" in "%s" \n' % (key, fn))
         parent.io.close()
+        return entry, True
+
+def scan_folder_for_NWBfiles(folder, verbose=True, index=None):
+    """
+    the file properties are taken from the persistent index (see NWBIndex),
+    only new or modified files are opened
+    """
+    if verbose:
+        print('inspecting the folder "%s" [...]' % folder)
+
+    if index is None:
+        index = NWBIndex()
+    
+    FILES = get_files_with_extension(folder, extension='.nwb', recursive=True)
+    DATES = np.array([f.split(os.path.sep)[-1].split('-')[0] for f in FILES])
+    SUBJECTS = [entry['subject'] for entry in index.get_entries(FILES, verbose=verbose)]
         
     if verbose:
         print(' -> found n=%i datafiles ' % len(FILES))
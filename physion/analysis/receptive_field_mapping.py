@@ -35,41 +35,95 @@ class CellResponse:
             self.Pcond = np.ones(self.nwbfile.stimulus['time_start_realigned'].num_samples, dtype=bool)
     
     def reverse_correlation(self, roiIndex, subquantity='dF/F',
-                            metrics='mean'):
+                            metrics='mean', downsampling=1):
+        """ receptive field of a single ROI, see "reverse_correlation_all" """
+        return self.reverse_correlation_all([roiIndex], subquantity=subquantity,
+                                            metrics=metrics, downsampling=downsampling)[0]
 
-        dF = compute_CaImaging_trace(self, subquantity, [roiIndex]).sum(axis=0) # validROI inside
+    def reverse_correlation_all(self, roiIndices=None, subquantity='dF/F',
+                                metrics='mean', episodes_per_block=20,
+                                downsampling=1):
+        """
+        receptive fields of all ROIs in a single pass over the stimulus sequence
+
+        each stimulus image is generated once and added to the maps of all ROIs
+        (weighted by their responses), returns a float32 array of shape (nROIs, Ly, Lx)
+        with the screen resolution divided by "downsampling"
+        (at full resolution, each ROI takes ~3.7MB for a 1280x720 screen)
+        """
+        if roiIndices is None:
+            roiIndices = np.arange(np.sum(self.iscell))
+        roiIndices = np.array(roiIndices, dtype=int)
+
+        dF = np.array(compute_CaImaging_trace(self, subquantity, roiIndices)) # validROI inside, all ROIs at once
         self.t = self.Fluorescence.timestamps[:]
-        
-        full_img, cum_weight = np.zeros(self.visual_stim.screen['resolution'], dtype=float).T, 0
-
-        for i in np.arange(self.nwbfile.stimulus['time_start_realigned'].num_samples)[self.Pcond]:
-            tstart = self.nwbfile.stimulus['time_start_realigned'].data[i]
-            tstop = self.nwbfile.stimulus['time_stop_realigned'].data[i]
-            cond = (self.t>tstart) & (self.t<tstop)
-            weight = np.inf
-            if metrics == 'mean':
-                weight = np.mean(dF[cond])
-            elif np.sum(cond)>0 and (metrics=='max'):
-                weight = np.max(dF[cond])
-            if np.isfinite(weight):
-                full_img += weight*2*(self.visual_stim.get_image(i)-.5)
-                cum_weight += weight
-            else:
-                print('For episode #%i in t=(%.1f, %.1f), pb in estimating the weight !' % (i, tstart, tstop) )
-                
-        return full_img/cum_weight
-
-
-def RF_analysis(FullData, roiIndex=0, verbose=True, subprotocol_id=0):
+
+        episodes = np.arange(self.nwbfile.stimulus['time_start_realigned'].num_samples)[self.Pcond]
+        tstarts = self.nwbfile.stimulus['time_start_realigned'].data[:][episodes]
+        tstops = self.nwbfile.stimulus['time_stop_realigned'].data[:][episodes]
+        weights = episode_weights(self.t, dF, tstarts, tstops, metrics=metrics)
+
+        valid = np.isfinite(weights)
+        for i in np.flatnonzero(~np.all(valid, axis=0)):
+            print('For episode #%i in t=(%.1f, %.1f), pb in estimating the weight !' % (episodes[i], tstarts[i], tstops[i]) )
+        weights[~valid] = 0
+        # only episodes with a valid weight for some ROI need their image
+        episodes, weights = episodes[np.any(valid, axis=0)], weights[:, np.any(valid, axis=0)]
+
+        shape = np.zeros(self.visual_stim.screen['resolution']).T[::downsampling,::downsampling].shape
+        full_img = np.zeros((len(roiIndices), shape[0]*shape[1]), dtype=np.float32)
+        weights = weights.astype(np.float32)
+        for i0 in range(0, len(episodes), episodes_per_block):
+            block = slice(i0, i0+episodes_per_block)
+            imgs = np.array([2*(self.visual_stim.get_image(i)[::downsampling,::downsampling]-.5).flatten()\
+                             for i in episodes[block]], dtype=np.float32)
+            full_img += np.dot(weights[:, block], imgs)
+
+        cum_weight = weights.sum(axis=1)
+        for k in np.flatnonzero(cum_weight==0):
+            print(' /!\ no valid episode for ROI #%i, its receptive field is left empty /!\ ' % (roiIndices[k]+1))
+        full_img[cum_weight!=0] /= cum_weight[cum_weight!=0][:,np.newaxis]
+        return full_img.reshape(len(roiIndices), *shape)
+
+
+def episode_weights(t, dF, tstarts, tstops, metrics='mean'):
+    """
+    response of each ROI (rows of "dF") within each episode, shape (nROIs, nEpisodes)
+
+    non-finite values flag the episodes where the weight can not be estimated
+    """
+    i1 = np.searchsorted(t, tstarts, side='right') # first sample with t>tstart
+    i2 = np.searchsorted(t, tstops, side='left') # first sample with t>=tstop
+    weights = np.full((dF.shape[0], len(tstarts)), np.inf)
+    for i in range(len(tstarts)):
+        if metrics == 'mean':
+            weights[:,i] = np.mean(dF[:, i1[i]:i2[i]], axis=1) if (i2[i]>i1[i]) else np.nan
+        elif (i2[i]>i1[i]) and (metrics=='max'):
+            weights[:,i] = np.max(dF[:, i1[i]:i2[i]], axis=1)
+    return weights
+
+
+def compute_RF_maps(FullData, roiIndices=None, verbose=True, subprotocol_id=0,
+                    subquantity='Deconvolved', metrics='max', downsampling=1):
+    """ receptive fields of all ROIs (single pass over the noise stimulus), see "reverse_correlation_all" """
     iprotocol = [i for (i,p) in enumerate(FullData.protocols) if ('noise' in p)][subprotocol_id]
     data = CellResponse(FullData, protocol_id=iprotocol,
                         quantity='CaImaging', subquantity='dF/F',
-                        roiIndex = roiIndex, verbose=verbose)
+                        roiIndex = 0, verbose=verbose)
+    return data.reverse_correlation_all(roiIndices, subquantity=subquantity, metrics=metrics,
+                                        downsampling=downsampling)
+
+    
+def RF_analysis(FullData, roiIndex=0, verbose=True, subprotocol_id=0, RF_map=None):
+    """ "RF_map" can be pre-computed for all ROIs with "compute_RF_maps" """
+    if RF_map is None:
+        RF_map = compute_RF_maps(FullData, [roiIndex], verbose=verbose, subprotocol_id=subprotocol_id)[0]
     fig, ax = plt.subplots(1, figsize=(11.4,3))
     plt.subplots_adjust(left=0.3, right=.7, top=0.85, bottom=0.15)
     ax.axis('off')
-    img = data.reverse_correlation(i, subquantity='Deconvolved', metrics='max')
-    img = gaussian_filter(img, (10,10))
+    img = RF_map
+    smoothing = 10.*img.shape[1]/FullData.visual_stim.screen['resolution'][0] # 10 screen pixels, maps can be downsampled
+    img = gaussian_filter(img, (smoothing, smoothing))
     ax.imshow(img, cmap=plt.cm.PiYG,
                vmin=-np.max(np.abs(img)), vmax=np.max(np.abs(img)))
     
@@ -1,4 +1,4 @@
-import sys, time, tempfile, os, pathlib, json, datetime, string
+import sys, time, tempfile, os, pathlib, json, datetime, string, pickle, multiprocessing
 import numpy as np
 from matplotlib.backends.backend_pdf import PdfPages
 import matplotlib.pyplot as plt
@@ -6,10 +6,11 @@ from scipy.interpolate import interp1d
 
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
 from dataviz.show_data import MultimodalData
+from analysis.read_NWB import DummyParent
 from Ca_imaging.tools import compute_CaImaging_trace
 from analysis.tools import *
 
-def raw_data_plot_settings(data, subsampling_factor=1):
+def raw_data_plot_settings(data, subsampling_factor=1, rng=np.random):
     settings = {}
     if 'Photodiode-Signal' in data.nwbfile.acquisition:
         settings['Photodiode'] = dict(fig_fraction=0.1, subsampling=10*subsampling_factor, color='grey')
@@ -21,7 +22,7 @@ def raw_data_plot_settings(data, subsampling_factor=1):
         settings['FaceMotion'] = dict(fig_fraction=2, subsampling=2*subsampling_factor)
     if 'ophys' in data.nwbfile.processing:
         settings['CaImaging'] = dict(fig_fraction=8,
-                                     roiIndices=np.random.choice(np.arange(np.sum(data.iscell)), 20, replace=True), # picking 20 random non-redundant rois
+                                     roiIndices=rng.choice(np.arange(np.sum(data.iscell)), 20, replace=True), # picking 20 random non-redundant rois
                                      quantity='CaImaging',
                                      subquantity='dF/F', vicinity_factor=1., color='green', subsampling=subsampling_factor)
         # settings['CaImagingSum'] = dict(fig_fraction=2,
@@ -264,12 +265,173 @@ def behavior_analysis_fig(data):
     return fig
 
 
+def full_data_page(data, subsampling_factor=5, Tbar=5, seed=0):
+    """ "seed" sets the random choices of the page (e.g. the ROIs shown) """
+    fig, ax = plt.subplots(1, figsize=(11.4, 5))
+    fig.subplots_adjust(top=0.8, bottom=0.05)
+    data.plot_raw_data(data.tlim,
+                       settings=raw_data_plot_settings(data, subsampling_factor=subsampling_factor,
+                                                       rng=np.random.default_rng(seed)),
+                       ax=ax, Tbar=Tbar)
+    return fig, None
+
+
+def raw_data_page(data, TLIM=[0,1], Tbar=5, seed=0):
+    """ "seed" sets the random choices of the page (e.g. the ROIs shown) """
+    fig, ax = plt.subplots(1, figsize=(11.4, 5))
+    fig.subplots_adjust(top=0.8, bottom=0.05)
+    data.plot_raw_data(TLIM, settings=raw_data_plot_settings(data, rng=np.random.default_rng(seed)),
+                       ax=ax, Tbar=Tbar)
+    # inset with time sample
+    axT = plt.axes([0.6, 0.9, 0.3, 0.05])
+    axT.axis('off')
+    axT.plot(data.tlim, [0,0], 'k-', lw=2)
+    axT.plot(TLIM, [0,0], '-', color=plt.cm.tab10(3), lw=5)
+    axT.annotate('0 ', (0,0), xycoords='data', ha='right', fontsize=9)
+    axT.annotate(' %.1fmin' % (data.tlim[1]/60.), (data.tlim[1],0), xycoords='data', fontsize=9)
+    return fig, None
+
+
+def FOV_page(data):
+    fig, AX = plt.subplots(1, 4, figsize=(11.4, 2))
+    data.show_CaImaging_FOV(key='meanImg', NL=1, cmap='viridis', ax=AX[0])
+    data.show_CaImaging_FOV(key='meanImg', NL=2, cmap='viridis', ax=AX[1])
+    data.show_CaImaging_FOV(key='meanImgE', NL=2, cmap='viridis', ax=AX[2])
+    data.show_CaImaging_FOV(key='max_proj', NL=2, cmap='viridis', ax=AX[3])
+    return fig, None
+
+
+def protocol_type(data, p):
+    return (data.metadata['Protocol-%i-Stimulus' % (p+1)] if (len(data.protocols)>1) else data.metadata['Stimulus'])
+
+
+def protocol_roi_page(data, protocol_type='', roiIndex=0, RF_map=None):
+    """ protocol-dependent analysis of a single ROI, returns (fig, (SI, responsive)) """
+    if protocol_type=='full-field-grating':
+        from analysis.orientation_direction_selectivity import orientation_selectivity_analysis
+        fig, SI, responsive = orientation_selectivity_analysis(data, roiIndex=roiIndex, verbose=False)
+    elif protocol_type=='drifting-full-field-grating':
+        from analysis.orientation_direction_selectivity import direction_selectivity_analysis
+        fig, SI, responsive = direction_selectivity_analysis(data, roiIndex=roiIndex, verbose=False)
+    elif protocol_type in ['center-grating', 'drifting-center-grating'] or ('spatial-location' in protocol_type):
+        from surround_suppression import orientation_size_selectivity_analysis
+        fig, responsive = orientation_size_selectivity_analysis(data, roiIndex=roiIndex, verbose=False)
+        SI = 0 # TO BE FILLED
+    elif 'noise' in protocol_type:
+        from receptive_field_mapping import RF_analysis
+        fig, SI, responsive = RF_analysis(data, roiIndex=roiIndex, verbose=False,
+                                          RF_map=RF_map)
+        SI = 0 # TO BE FILLED
+    return fig, (SI, responsive)
+
+
+def protocol_summary_label(protocol_type):
+    if protocol_type=='full-field-grating':
+        return 'Orient. Select. Index'
+    elif protocol_type=='drifting-full-field-grating':
+        return 'Direction Select. Index'
+    else:
+        return 'none'
+
+
+def is_analyzed_protocol(protocol_type):
+    return (protocol_type in ['full-field-grating', 'drifting-full-field-grating',
+                              'center-grating', 'drifting-center-grating']) or\
+        ('noise' in protocol_type) or ('spatial-location' in protocol_type)
+
+
+PAGES = {'metadata':lambda data: (metadata_fig(data), None),
+         'behavior':lambda data: (behavior_analysis_fig(data), None),
+         'FOV':FOV_page,
+         'full-data':full_data_page,
+         'raw-data':raw_data_page,
+         'protocol-roi':protocol_roi_page}
+
+# the pages of a single ROI, rendered by the workers (the other pages are rendered by the main process)
+ROI_PAGES = ['protocol-roi']
+
+
+class NWBArray:
+    """ in-memory stand-in for a dataset/time series of the NWB file """
+    def __init__(self, data=None, timestamps=None):
+        self.data, self.timestamps = data, timestamps
+
+    @property
+    def num_samples(self):
+        return self.data.shape[0]
+
+
+def shared_page_data(data):
+    """ the data common to all the ROI pages (sent once to each worker) """
+    return {'metadata':data.metadata, 'protocols':data.protocols, 'tlim':data.tlim,
+            'iscell':data.iscell, 'CaImaging_dt':data.CaImaging_dt,
+            'timestamps':data.Neuropil.timestamps[:],
+            'stimulus':{key:np.array(data.nwbfile.stimulus[key].data[:]) for key in data.nwbfile.stimulus.keys()},
+            'screen':(data.visual_stim.screen if data.visual_stim is not None else None)}
+
+
+class ROIPageData:
+    """
+    in-memory data of a single ROI with the episodes, built from the "shared" data of the worker
+    and the fluorescence of the ROI (sent with the page job), so that the workers never read the NWB file
+    """
+    def __init__(self, shared, roiIndex, fluorescence):
+        self.metadata, self.protocols, self.tlim = shared['metadata'], shared['protocols'], shared['tlim']
+        self.iscell, self.CaImaging_dt = shared['iscell'], shared['CaImaging_dt']
+        # "roiIndex" points to the single row of the traces (any other index is out of bounds)
+        self.validROI_indices = np.ones(np.sum(self.iscell), dtype=int)
+        self.validROI_indices[roiIndex] = 0
+        self.Fluorescence = NWBArray(np.array(fluorescence)[np.newaxis,:], shared['timestamps'])
+        self.Neuropil = NWBArray(timestamps=shared['timestamps'])
+        self.Deconvolved = None
+        self.nwbfile = DummyParent()
+        self.nwbfile.stimulus = {key:NWBArray(shared['stimulus'][key]) for key in shared['stimulus']}
+        self.visual_stim = DummyParent()
+        self.visual_stim.screen = shared['screen']
+
+
+# the shared data of the process rendering the ROI pages
+_shared = None
+
+def init_worker(shared):
+    global _shared
+    plt.switch_backend('Agg')
+    _shared = shared
+
+
+def render_page(job):
+    """ renders a ROI page and sends back the pickled figure (with the page-specific results) """
+    kind, kwargs, fluorescence = job
+    fig, result = PAGES[kind](ROIPageData(_shared, kwargs['roiIndex'], fluorescence), **kwargs)
+    output = pickle.dumps(fig)
+    plt.close(fig)
+    return output, result
+
+
 def make_sumary_pdf(filename, Nmax=1000000,
                     include=['exp', 'rois', 'raw', 'protocols'],
                     T_raw_data=60,
                     N_raw_data=5,
                     ROI_raw_data=20,
-                    Tbar_raw_data=5):
+                    Tbar_raw_data=5,
+                    Nmax_RF=None,
+                    RF_downsampling=1,
+                    Nworkers=None):
+    """
+    the NWB file is read once, by the main process:
+    the ROI pages are rendered in parallel by "Nworkers" processes (default: number of cpus),
+    each job carrying the fluorescence of its ROI (and its receptive field),
+    while the main process renders the other pages; the pdfs are written in a deterministic order
+
+    the receptive fields (noise protocols) can be limited to the first "Nmax_RF" ROIs (default: "Nmax")
+    and computed at the screen resolution divided by "RF_downsampling" to bound the memory
+    """
+
+    global _shared
+    if Nworkers is None:
+        Nworkers = multiprocessing.cpu_count()
+    if Nmax_RF is None:
+        Nmax_RF = Nmax
 
     data = MultimodalData(filename)
     data.roiIndices = np.sort(np.random.choice(np.arange(data.iscell.sum()),
@@ -280,151 +442,81 @@ def make_sumary_pdf(filename, Nmax=1000000,
     if not os.path.isdir(folder):
         os.mkdir(folder)
 
+    # list of pdfs with their pages: [pdf-name, [(page-kind, kwargs), ...]]
+    PDFS = []
     if 'exp' in include:
-        with PdfPages(os.path.join(folder, 'exp.pdf')) as pdf:
+        PDFS.append(['exp', [('metadata', {}), ('behavior', {})]])
 
-            print('writing experimental metadata ')
-            fig = metadata_fig(data)
-            pdf.savefig()  # saves the current figure into a pdf page
-            plt.close()
+    if 'rois' in include:
+        PDFS.append(['rois', [('FOV', {})]])
 
-            print('plotting behavior analysis ')
-            fig = behavior_analysis_fig(data)
-            pdf.savefig()  # saves the current figure into a pdf page
-            plt.close()
-
-    if 'exp' in include:
-        with PdfPages(os.path.join(folder, 'rois.pdf')) as pdf:
-
-            print('plotting imaging FOV ')
-            fig, AX = plt.subplots(1, 4, figsize=(11.4, 2))
-            data.show_CaImaging_FOV(key='meanImg', NL=1, cmap='viridis', ax=AX[0])
-            data.show_CaImaging_FOV(key='meanImg', NL=2, cmap='viridis', ax=AX[1])
-            data.show_CaImaging_FOV(key='meanImgE', NL=2, cmap='viridis', ax=AX[2])
-            data.show_CaImaging_FOV(key='max_proj', NL=2, cmap='viridis', ax=AX[3])
-            pdf.savefig()  # saves the current figure into a pdf page
-            plt.close()
-        
     if 'raw' in include:
-        
-        with PdfPages(os.path.join(folder, 'raw.pdf')) as pdf:
-
-            print('plotting full data view [...]')
-            fig, ax = plt.subplots(1, figsize=(11.4, 5))
-            fig.subplots_adjust(top=0.8, bottom=0.05)
-            data.plot_raw_data(data.tlim,
-                               settings=raw_data_plot_settings(data, subsampling_factor=5),
-                               ax=ax, Tbar=Tbar_raw_data)
-            pdf.savefig()  # saves the current figure into a pdf page
-            plt.close()
-            
-            # plot raw data sample
-            for t0 in np.linspace(T_raw_data, data.tlim[1], N_raw_data):
-                TLIM = [np.max([10,t0-T_raw_data]),t0]
-                print('plotting raw data sample at times ', TLIM)
-                fig, ax = plt.subplots(1, figsize=(11.4, 5))
-                fig.subplots_adjust(top=0.8, bottom=0.05)
-                data.plot_raw_data(TLIM, settings=raw_data_plot_settings(data),
-                                   ax=ax, Tbar=Tbar_raw_data)
-                # inset with time sample
-                axT = plt.axes([0.6, 0.9, 0.3, 0.05])
-                axT.axis('off')
-                axT.plot(data.tlim, [0,0], 'k-', lw=2)
-                axT.plot(TLIM, [0,0], '-', color=plt.cm.tab10(3), lw=5)
-                axT.annotate('0 ', (0,0), xycoords='data', ha='right', fontsize=9)
-                axT.annotate(' %.1fmin' % (data.tlim[1]/60.), (data.tlim[1],0), xycoords='data', fontsize=9)
-                pdf.savefig()  # saves the current figure into a pdf page
-                plt.close()
-
-    print('looping over protocols for analysis [...]')
-        
+        pages = [('full-data', dict(subsampling_factor=5, Tbar=Tbar_raw_data, seed=0))]
+        for i, t0 in enumerate(np.linspace(T_raw_data, data.tlim[1], N_raw_data)):
+            TLIM = [np.max([10,t0-T_raw_data]),t0]
+            pages.append(('raw-data', dict(TLIM=TLIM, Tbar=Tbar_raw_data, seed=i+1)))
+        PDFS.append(['raw', pages])
+
+    RF_maps = None
     if 'protocols' in include:
-        # looping over protocols
         for p, protocol in enumerate(data.protocols):
-
-            print('plotting protocol "%s" [...]' % protocol)
-            
-            with PdfPages(os.path.join(folder, '%s.pdf' % protocol)) as pdf:
-            
-                # finding protocol type
-                protocol_type = (data.metadata['Protocol-%i-Stimulus' % (p+1)] if (len(data.protocols)>1) else data.metadata['Stimulus'])
-                print(protocol_type)
-                # then protocol-dependent analysis
-
-                if protocol_type=='full-field-grating':
-                    from analysis.orientation_direction_selectivity import orientation_selectivity_analysis
-                    Nresp, SIs = 0, []
-                    for i in range(data.iscell.sum())[:Nmax]:
-                        fig, SI, responsive = orientation_selectivity_analysis(data, roiIndex=i, verbose=False)
-                        pdf.savefig()  # saves the current figure into a pdf page
-                        plt.close()
-                        if responsive:
-                            Nresp += 1
-                            SIs.append(SI)
+            ptype = protocol_type(data, p)
+            if is_analyzed_protocol(ptype):
+                NROIs = (min([Nmax, Nmax_RF]) if ('noise' in ptype) else Nmax)
+                PDFS.append([protocol, [('protocol-roi', dict(protocol_type=ptype, roiIndex=i))\
+                                        for i in range(data.iscell.sum())[:NROIs]]])
+            else:
+                PDFS.append([protocol, []])
+            if ('noise' in ptype) and (RF_maps is None):
+                from receptive_field_mapping import compute_RF_maps
+                print('computing receptive fields [...]')
+                RF_maps = compute_RF_maps(data, np.arange(data.iscell.sum())[:min([Nmax, Nmax_RF])], verbose=False,
+                                          downsampling=RF_downsampling)
+
+    def roi_jobs():
+        """ the ROI pages with their data, generated while the jobs are sent to the workers """
+        for name, pages in PDFS:
+            for kind, kwargs in pages:
+                if kind in ROI_PAGES:
+                    if 'noise' in kwargs['protocol_type']:
+                        kwargs = dict(kwargs, RF_map=RF_maps[kwargs['roiIndex']]) # only the map of the page is sent
+                    yield kind, kwargs, data.Fluorescence.data[data.validROI_indices[kwargs['roiIndex']], :]
+
+    shared, pool = (shared_page_data(data) if 'protocols' in include else None), None
+    try:
+        if Nworkers>1:
+            method = ('forkserver' if ('forkserver' in multiprocessing.get_all_start_methods()) else 'spawn')
+            pool = multiprocessing.get_context(method).Pool(Nworkers,
+                                                            initializer=init_worker, initargs=(shared,))
+            results = pool.imap(render_page, roi_jobs()) # imap keeps the page order
+        else:
+            _shared, results = shared, map(render_page, roi_jobs())
+
+        for name, pages in PDFS:
+            with PdfPages(os.path.join(folder, '%s.pdf' % name)) as pdf:
+                print('writing "%s.pdf" [...]' % name)
+                Nresp, SIs = 0, []
+                for kind, kwargs in pages:
+                    if kind in ROI_PAGES:
+                        output, result = next(results)
+                        fig = pickle.loads(output)
+                    else:
+                        fig, result = PAGES[kind](data, **kwargs)
+                    pdf.savefig(fig)  # saves the current figure into a pdf page
+                    plt.close(fig)
+                    if (result is not None) and result[1]:
+                        Nresp += 1
+                        SIs.append(result[0])
+                if len(pages)>0 and (pages[0][0]=='protocol-roi'):
                     # summary figure for this protocol
-                    fig, AX = summary_fig(Nresp, data.iscell.sum(), np.array(SIs))
-                    pdf.savefig()  # saves the current figure into a pdf page
-                    plt.close()
-
-                elif protocol_type=='drifting-full-field-grating':
-                    from analysis.orientation_direction_selectivity import direction_selectivity_analysis
-                    Nresp, SIs = 0, []
-                    for i in range(data.iscell.sum())[:Nmax]:
-                        fig, SI, responsive = direction_selectivity_analysis(data, roiIndex=i, verbose=False)
-                        pdf.savefig()  # saves the current figure into a pdf page
-                        plt.close()
-                        if responsive:
-                            Nresp += 1
-                            SIs.append(SI)
-                    fig, AX = summary_fig(Nresp, data.iscell.sum(), np.array(SIs),
-                                          label='Direction Select. Index')
-                    pdf.savefig()  # saves the current figure into a pdf page
-                    plt.close()
-
-                elif protocol_type in ['center-grating', 'drifting-center-grating']:
-                    from surround_suppression import orientation_size_selectivity_analysis
-                    Nresp, SIs = 0, []
-                    for i in range(data.iscell.sum())[:Nmax]:
-                        fig, responsive = orientation_size_selectivity_analysis(data, roiIndex=i, verbose=False)
-                        pdf.savefig()  # saves the current figure into a pdf page
-                        plt.close()
-                        if responsive:
-                            Nresp += 1
-                            SIs.append(0) # TO BE FILLED
-                    fig, AX = summary_fig(Nresp, data.iscell.sum(), np.array(SIs),
-                                          label='none')
-                    pdf.savefig()  # saves the current figure into a pdf page
-                    plt.close()
-
-                elif 'noise' in protocol_type:
-                    from receptive_field_mapping import RF_analysis
-                    Nresp, SIs = 0, []
-                    for i in range(data.iscell.sum())[:Nmax]:
-                        fig, SI, responsive = RF_analysis(data, roiIndex=i, verbose=False)
-                        pdf.savefig()  # saves the current figure into a pdf page
-                        plt.close()
-                        if responsive:
-                            Nresp += 1
-                            SIs.append(0) # TO BE FILLED
-                    fig, AX = summary_fig(Nresp, data.iscell.sum(), np.array(SIs),
-                                          label='none')
-                    pdf.savefig()  # saves the current figure into a pdf page
-                    plt.close()
-
-                elif 'spatial-location' in protocol_type:
-                    from surround_suppression import orientation_size_selectivity_analysis
-                    Nresp, SIs = 0, []
-                    for i in range(data.iscell.sum())[:Nmax]:
-                        fig, responsive = orientation_size_selectivity_analysis(data, roiIndex=i, verbose=False)
-                        pdf.savefig()  # saves the current figure into a pdf page
-                        plt.close()
-                        if responsive:
-                            Nresp += 1
-                            SIs.append(0) # TO BE FILLED
                     fig, AX = summary_fig(Nresp, data.iscell.sum(), np.array(SIs),
-                                          label='none')
+                                          label=protocol_summary_label(pages[0][1]['protocol_type']))
                     pdf.savefig()  # saves the current figure into a pdf page
                     plt.close()
+    finally:
+        if pool is not None:
+            pool.terminate() # all pages received (or a page failed)
+            pool.join()
 
     print('[ok] pdfs succesfully saved in "%s" !' % folder)
 
@@ -43,21 +43,37 @@ def resample_signal(original_signal,
     return new_t, new_signal
 
 
-def autocorrel(Signal, tmax, dt):
+def fft_correlate(a, b, lags):
+    """
+    returns sum_n a[...,n]*b[...,n+k] for the (positive and negative) lags k
+    computed with FFTs along the last axis (zero-padded, no circular wrapping)
+    """
+    nfft = 2**int(np.ceil(np.log2(a.shape[-1]+b.shape[-1])))
+    c = np.fft.irfft(np.conj(np.fft.rfft(a, nfft))*np.fft.rfft(b, nfft), nfft)
+    return c[...,np.array(lags)] # negative lags are at the end of the array
+
+def autocorrel(Signal, tmax, dt, method='fft'):
     """
     argument : Signal (np.array), tmax and dt (float)
     tmax, is the maximum length of the autocorrelation that we want to see
     returns : autocorrel (np.array), time_shift (np.array)
     take a Signal of time sampling dt, and returns its autocorrelation
      function between [0,tstop] (normalized) !!
+
+    Signal can be a set of signals, of shape (..., time), the correlation is computed along the last axis
+    method: 'fft' (default) or 'direct' (np.correlate, single signal only)
     """
     steps = int(tmax/dt) # number of steps to sum on
-    Signal2 = (Signal-Signal.mean())/Signal.std()
-    cr = np.correlate(Signal2[steps:],Signal2)/steps
-    time_shift = np.arange(len(cr))*dt
-    return cr/cr.max(), time_shift
+    Signal2 = (Signal-Signal.mean(axis=-1, keepdims=True))/Signal.std(axis=-1, keepdims=True)
+    if method=='direct':
+        cr = np.correlate(Signal2[steps:],Signal2)/steps
+    else:
+        # same as above: sum_{m>=steps} S[m]*S[m-k] for k in [0, steps]
+        cr = fft_correlate(Signal2[...,steps:], Signal2, steps-np.arange(steps+1))/steps
+    time_shift = np.arange(cr.shape[-1])*dt
+    return cr/cr.max(axis=-1, keepdims=True), time_shift
 
-def crosscorrel(Signal1, Signal2, tmax, dt):
+def crosscorrel(Signal1, Signal2, tmax, dt, method='fft'):
     """
     argument : Signal1 (np.array()), Signal2 (np.array())
     returns : np.array()
@@ -68,19 +84,49 @@ def crosscorrel(Signal1, Signal2, tmax, dt):
     when the peak is in the past (negative t_shift)
     it means that Signal2 is delayed with respect to Signal 1
     --------------------------------------------------------------
+
+    the coefficients are the Pearson correlations of the overlapping parts
+    of the two signals for each time shift (as np.corrcoef)
+
+    Signal1 and Signal2 can be sets of signals, of shapes (..., time) broadcastable together,
+    e.g. Signal1 of shape (ROIs, time) and Signal2 of shape (time,) -> CCF of shape (ROIs, lags)
+    method: 'fft' (default) or 'direct' (loop over lags with np.corrcoef, single pair only)
     """
-    if len(Signal1)!=len(Signal2):
+    if Signal1.shape[-1]!=Signal2.shape[-1]:
         print('Need two arrays of the same size !!')
         
     steps = int(tmax/dt) # number of steps to sum on
     time_shift = dt*np.concatenate([-np.arange(1, steps)[::-1], np.arange(steps)])
-    CCF = np.zeros(len(time_shift))
-    for i in np.arange(steps):
-        ccf = np.corrcoef(Signal1[:len(Signal1)-i], Signal2[i:])
-        CCF[steps-1+i] = ccf[0,1]
-    for i in np.arange(steps):
-        ccf = np.corrcoef(Signal2[:len(Signal1)-i], Signal1[i:])
-        CCF[steps-1-i] = ccf[0,1]
+
+    if method=='direct':
+        CCF = np.zeros(len(time_shift))
+        for i in np.arange(steps):
+            ccf = np.corrcoef(Signal1[:len(Signal1)-i], Signal2[i:])
+            CCF[steps-1+i] = ccf[0,1]
+        for i in np.arange(steps):
+            ccf = np.corrcoef(Signal2[:len(Signal1)-i], Signal1[i:])
+            CCF[steps-1-i] = ccf[0,1]
+        return CCF, time_shift
+
+    S1, S2 = np.broadcast_arrays(np.asarray(Signal1, dtype=np.float64),
+                                 np.asarray(Signal2, dtype=np.float64))
+    # centering (the Pearson coefficient is shift invariant, this limits round-off errors)
+    S1 = S1-S1.mean(axis=-1, keepdims=True)
+    S2 = S2-S2.mean(axis=-1, keepdims=True)
+    N, lags = S1.shape[-1], np.arange(-(steps-1), steps)
+
+    Sxy = fft_correlate(S1, S2, lags)
+    # sums over the overlapping segments: S1[a0:a1] and S2[b0:b1]
+    a0, a1 = np.clip(-lags, 0, None), N-np.clip(lags, 0, None)
+    b0, b1 = np.clip(lags, 0, None), N-np.clip(-lags, 0, None)
+    n = N-np.abs(lags)
+    def segment_sum(X, i0, i1):
+        cumsum = np.concatenate([np.zeros((*X.shape[:-1], 1)), np.cumsum(X, axis=-1)], axis=-1)
+        return cumsum[...,i1]-cumsum[...,i0]
+    Sx, Sy = segment_sum(S1, a0, a1), segment_sum(S2, b0, b1)
+    Sxx, Syy = segment_sum(S1**2, a0, a1), segment_sum(S2**2, b0, b1)
+
+    CCF = (Sxy-Sx*Sy/n)/np.sqrt((Sxx-Sx**2/n)*(Syy-Sy**2/n))
     return CCF, time_shift
 
 def autocorrel_on_NWB_quantity(Q1=None,
@@ -294,6 +294,8 @@ def build_episodes(self,
                    dt_sampling=1, # ms
                    interpolation='linear',
                    baseline_substraction=False,
+                   multi_ROI=False, # for 'CaImaging', "resp" is (episodes, ROIs, time) instead of the sum over ROIs
+                   dtype=np.float64, # dtype of "resp", e.g. np.float32 to limit memory
                    verbose=True):
 
     EPISODES = {'dt_sampling':dt_sampling,
@@ -339,7 +341,11 @@ def build_episodes(self,
     if quantity=='CaImaging':
         tfull = parent.Neuropil.timestamps[:]
         valfull = compute_CaImaging_trace(parent,
-                    parent.CaImaging_key, parent.roiIndices).sum(axis=0) # valid ROI indices inside
+                    parent.CaImaging_key, parent.roiIndices) # valid ROI indices inside
+        if multi_ROI:
+            EPISODES['roiIndices'] = np.array(parent.roiIndices)
+        else:
+            valfull = valfull.sum(axis=0)
     else:
         try:
             tfull = np.arange(parent.nwbfile.acquisition[quantity].data.shape[0])/parent.nwbfile.acquisition[quantity].rate
@@ -349,41 +355,73 @@ def build_episodes(self,
             print(30*'-')
             print(quantity, 'not recognized')
             print(30*'-')
-        
-    # adding the parameters
-    for key in parent.nwbfile.stimulus.keys():
-        EPISODES[key] = []
 
-    for iEp in np.arange(parent.nwbfile.stimulus['time_start'].num_samples)[Pcond]:
-        tstart = parent.nwbfile.stimulus['time_start_realigned'].data[iEp]
-        tstop = parent.nwbfile.stimulus['time_stop_realigned'].data[iEp]
+    iEPISODES = np.arange(parent.nwbfile.stimulus['time_start'].num_samples)[Pcond]
+    tstarts = parent.nwbfile.stimulus['time_start_realigned'].data[:][iEPISODES]
 
-        # compute time and interpolate
-        cond = (tfull>=(tstart-1.5*prestim_duration)) & (tfull<(tstop+1.5*prestim_duration)) # higher range of interpolation to avoid boundary problems
-        func = interp1d(tfull[cond]-tstart, valfull[cond],
-                        kind=interpolation)
-        try:
-            if baseline_substraction:
-                y = func(EPISODES['t'])
-                EPISODES['resp'].append(y-np.mean(y[EPISODES['t']<0]))
-            else:
+    if interpolation=='linear':
+        EPISODES['resp'], valid = interpolate_episodes(tfull, valfull, tstarts, EPISODES['t'], dtype=dtype)
+        for iEp in iEPISODES[~valid]:
+            print('Problem with episode %i, not fully inside the recording' % iEp)
+    else:
+        EPISODES['resp'], valid = [], np.zeros(len(iEPISODES), dtype=bool)
+        tstops = parent.nwbfile.stimulus['time_stop_realigned'].data[:][iEPISODES]
+        for i, iEp, tstart, tstop in zip(range(len(iEPISODES)), iEPISODES, tstarts, tstops):
+            # compute time and interpolate
+            cond = (tfull>=(tstart-1.5*prestim_duration)) & (tfull<(tstop+1.5*prestim_duration)) # higher range of interpolation to avoid boundary problems
+            try:
+                func = interp1d(tfull[cond]-tstart, valfull[...,cond],
+                                kind=interpolation)
                 EPISODES['resp'].append(func(EPISODES['t']))
-            for key in parent.nwbfile.stimulus.keys():
-                EPISODES[key].append(parent.nwbfile.stimulus[key].data[iEp])
-        except BaseException as be:
-            print('----')
-            print(be)
-            print('Problem with episode %i between (%.2f, %.2f)s' % (iEp, tstart, tstop))
+                valid[i] = True
+            except BaseException as be:
+                print('----')
+                print(be)
+                print('Problem with episode %i between (%.2f, %.2f)s' % (iEp, tstart, tstop))
+        EPISODES['resp'] = np.array(EPISODES['resp'], dtype=dtype)
+
+    if baseline_substraction and (len(EPISODES['resp'])>0):
+        EPISODES['resp'] -= EPISODES['resp'][...,EPISODES['t']<0].mean(axis=-1, keepdims=True)
 
+    # adding the parameters
     EPISODES['index_from_start'] = np.arange(len(Pcond))[Pcond]
-    EPISODES['resp'] = np.array(EPISODES['resp'])
     for key in parent.nwbfile.stimulus.keys():
-        EPISODES[key] = np.array(EPISODES[key])
+        EPISODES[key] = np.array(parent.nwbfile.stimulus[key].data[:])[iEPISODES[valid]]
     
     if verbose:
         print('[ok] episodes ready !')
         
     return EPISODES
+
+
+def interpolate_episodes(tfull, valfull, tstarts, t,
+                         dtype=np.float64,
+                         max_block_size=int(1e7)):
+    """
+    linear interpolation of the signal(s) "valfull" (time as last axis, sampled at the sorted times "tfull")
+    at the times "tstarts[i]+t" of each episode
+
+    the samples are found with a sorted-index lookup (np.searchsorted)
+    and the episodes are processed by blocks of at most "max_block_size" values
+
+    returns:
+        resp: array of shape (episodes, *valfull.shape[:-1], len(t)),
+                only the episodes fully inside the recording
+        valid: boolean array of the episodes kept
+    """
+    valid = ((tstarts+t[0])>=tfull[0]) & ((tstarts+t[-1])<=tfull[-1])
+    tstarts = tstarts[valid]
+
+    resp = np.empty((len(tstarts), *valfull.shape[:-1], len(t)), dtype=dtype)
+    block = max([1, int(max_block_size/max([1, np.prod(valfull.shape[:-1])*len(t)]))])
+    for i0 in range(0, len(tstarts), block):
+        times = tstarts[i0:i0+block,np.newaxis]+t[np.newaxis,:] # (episodes, time)
+        i1 = np.clip(np.searchsorted(tfull, times, side='right'), 1, len(tfull)-1)
+        w = (times-tfull[i1-1])/(tfull[i1]-tfull[i1-1])
+        # (..., episodes, time) -> (episodes, ..., time)
+        resp[i0:i0+block] = np.moveaxis(valfull[...,i1-1]*(1-w)+valfull[...,i1]*w, -2, 0)
+
+    return resp, valid
     
 if __name__=='__main__':
 
@@ -1,10 +1,68 @@
 import numpy as np
-import skvideo.io
-import imageio
-import os, pathlib
-import matplotlib.pylab as plt
+import os, sys, pathlib, time, multiprocessing
 from scipy.ndimage import gaussian_filter
 
+try:
+    import skvideo.io
+except ModuleNotFoundError:
+    print('"skvideo" module not found')
+try:
+    import imageio
+except ModuleNotFoundError:
+    print('"imageio" module not found')
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+from assembling.saving import FaceCamera_frames, load_FaceCamera_frame
+
+
+def tool_extension(tool, extension):
+    if tool=='numpy':
+        return '.npz' # forcing the extension in that case
+    elif extension not in ['.avi', '.mp4']:
+        print('forcing "mp4" extension')
+        return '.mp4' 
+    return extension
+
+
+def compress_func(X, filename, tool='numpy', extension='.npz'):
+    """ custom compression functions depending on the tool """
+
+    if tool=='numpy':
+        np.savez_compressed(filename+extension, X)
+            
+    elif tool=='skvideo':
+        writer = skvideo.io.FFmpegWriter(filename+extension)
+        for i in range(X.shape[0]):
+            writer.writeFrame(X[i,:,:])
+        writer.close()
+            
+    elif tool=='imageio':
+        imageio.mimwrite(filename+extension, X)
+
+
+def compress_chunk(job):
+    """
+    loads, smoothes and compresses the frames of a single chunk ("imgs-i0-i1")
+
+    memory is bounded by the chunk size
+    returns the (raw, compressed) sizes in bytes
+    """
+    imgfolder, directory, FILES, i0, i1, smoothing, tool, extension = job
+
+    X = None
+    for i, fn in enumerate(FILES):
+        x = load_FaceCamera_frame(imgfolder, fn)
+        if smoothing!=0:
+            x = gaussian_filter(x, smoothing)
+        if X is None:
+            X = np.empty((len(FILES),)+x.shape, dtype=x.dtype)
+        X[i] = x
+
+    filename = 'imgs-%i-%i' % (i0, i1)
+    compress_func(X, os.path.join(directory, filename), tool=tool, extension=extension)
+    return filename, X.nbytes, os.path.getsize(os.path.join(directory, filename+extension))
+
+
 def compress_FaceCamera(datafolder,
                         smoothing=0, # either 2, or (1, 4, 5)
                         subsampling=1,
@@ -12,75 +70,60 @@ def compress_FaceCamera(datafolder,
                         tool='numpy',
                         Nframe_per_file=1000,
                         max_file=int(1e6),
+                        Nworkers=multiprocessing.cpu_count(),
+                        output_folder=None,
                         verbose=False):
+    """
+    the chunks of "Nframe_per_file" frames are compressed in parallel by "Nworkers" processes
 
+    returns the compression statistics (throughput and compression ratio)
+    """
 
     # create directory if not existing
-    directory = os.path.join(datafolder, 'FaceCamera-compressed')
+    if output_folder is None:
+        directory = os.path.join(datafolder, 'FaceCamera-compressed')
+    else:
+        directory = output_folder
     pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
     
-    # ------------------------------------------------------------
-    # building custom compression functions depending on the tool
+    extension = tool_extension(tool, extension)
 
-    if tool=='numpy':
-        
-        extension='.npz' # forcing the extension in that case
-        def compress_func(X, filename):
-            np.savez_compressed(filename+extension, X)
-            
-    elif tool=='skvideo':
-
-        if extension not in ['.avi', '.mp4']:
-            print('forcing "mp4" extension')
-            extension = '.mp4' 
-        def compress_func(X, filename):
-            writer = skvideo.io.FFmpegWriter(filename+extension)
-            for i in range(X.shape[0]):
-                writer.writeFrame(X[i,:,:])
-            writer.close()
-            
-    elif tool=='imageio':
+    # ------------------------------------------------
+    # Now splitting the frames into chunks
 
-        if extension not in ['.avi', '.mp4']:
-            print('forcing "mp4" extension')
-            extension = '.mp4' 
-        def compress_func(X, filename):
-            imageio.mimwrite(filename+extension, X)
+    FILES = FaceCamera_frames(os.path.join(datafolder, 'FaceCamera-imgs'))[1] # time-sorted frames (files or chunks)
+    if verbose:
+        print(FILES)
 
-    # ------------------------------------------------
-    # Now looping over frames to build the compression
+    stats = {'tool':tool, 'Nframes':0, 'raw_size':0, 'compressed_size':0, 'duration':0}
 
-    FILES = sorted(os.listdir(os.path.join(datafolder, 'FaceCamera-imgs')))
-    print(FILES)
     if len(FILES)>0:
-        X, i0, i, file_count = [], 0, 0, 0
-        for i, fn in enumerate(FILES):
-            x = np.load(os.path.join(datafolder, 'FaceCamera-imgs', fn))
-            if smoothing!=0:
-                x = gaussian_filter(x, smoothing)
-            X.append(x)
-
-            if ((i+1)%Nframe_per_file)==0:
-                # we save
-                filename = 'imgs-%i-%i' % (i0, i)
-                compress_func(np.array(X), os.path.join(directory, filename))
-                # and we reinit
-                X, i0 = [], i+1
-                if verbose:
-                    print('wrote: ', filename)
-
-                file_count +=1
-
-            if file_count>=max_file:
-                break
-
-        # saving the last frames
-        if file_count<max_file:
-            filename = 'imgs-%i-%i' % (i0, i)
-            compress_func(np.array(X), os.path.join(directory, filename))
+
+        JOBS = []
+        for i0 in range(0, len(FILES), Nframe_per_file)[:max_file]:
+            i1 = min([i0+Nframe_per_file, len(FILES)])-1
+            JOBS.append((os.path.join(datafolder, 'FaceCamera-imgs'), directory,
+                         FILES[i0:i1+1], i0, i1, smoothing, tool, extension))
+
+        tstart = time.time()
+        if Nworkers>1:
+            pool = multiprocessing.Pool(Nworkers)
+            results = pool.imap(compress_chunk, JOBS)
+        else:
+            pool, results = None, map(compress_chunk, JOBS)
+
+        for job, (filename, raw_size, compressed_size) in zip(JOBS, results):
+            stats['Nframes'] += len(job[2])
+            stats['raw_size'] += raw_size
+            stats['compressed_size'] += compressed_size
             if verbose:
                 print('wrote: ', filename)
 
+        if pool is not None:
+            pool.close()
+            pool.join()
+        stats['duration'] = time.time()-tstart
+
         # saving compression metadata 
         compression_metadata = {'tool':tool,
                                 'subsampling':subsampling,
@@ -90,6 +133,20 @@ def compress_FaceCamera(datafolder,
                                 'max_file':max_file}
         np.save(os.path.join(directory, 'metadata.npy'), compression_metadata)
 
+    stats['throughput'] = stats['Nframes']/max([stats['duration'], 1e-9]) # frames/s
+    stats['compression_ratio'] = stats['raw_size']/max([stats['compressed_size'], 1])
+    if verbose:
+        print_stats(stats)
+
+    return stats
+
+
+def print_stats(stats):
+    print(' - %s: %i frames in %.1fs, %.1f frames/s, compression ratio: %.1f' % (\
+        stats['tool'], stats['Nframes'], stats['duration'],
+        stats['throughput'], stats['compression_ratio']))
+
+
 def compress_datafolder(args):
 
     compress_FaceCamera(args.datafolder,
@@ -98,6 +155,7 @@ def compress_datafolder(args):
                         smoothing=args.smoothing,
                         verbose=args.verbose,
                         Nframe_per_file=args.Nframe_per_file,
+                        Nworkers=args.Nworkers,
                         max_file=args.max_file)
     
                 
@@ -114,6 +172,9 @@ if __name__=='__main__':
     # Face Data
     parser.add_argument("--Nframe_per_file", type=int, default=1000)
     parser.add_argument("--max_file", type=int, default=100000)
+    parser.add_argument('-n', "--Nworkers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--benchmark", help="throughput and compression ratio of the different tools",
+                        action="store_true")
     # 
     parser.add_argument('-df', "--datafolder", default='./')
     parser.add_argument('-ddf', "--day_folder", default='')
@@ -121,11 +182,25 @@ if __name__=='__main__':
     parser.add_argument('-v', "--verbose", action="store_true")
     args = parser.parse_args()
 
-    import time, sys, pathlib
-    sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
     from assembling.saving import check_datafolder, list_dayfolder
     
-    if args.day_folder!='':
+    if args.benchmark:
+        import tempfile
+        for tool in ['numpy', 'skvideo', 'imageio']:
+            try:
+                with tempfile.TemporaryDirectory() as output_folder:
+                    stats = compress_FaceCamera(args.datafolder,
+                                                extension=args.extension,
+                                                tool=tool,
+                                                smoothing=args.smoothing,
+                                                Nframe_per_file=args.Nframe_per_file,
+                                                Nworkers=args.Nworkers,
+                                                max_file=args.max_file,
+                                                output_folder=output_folder)
+                print_stats(stats)
+            except BaseException as be:
+                print(' - %s: failed (%s)' % (tool, be))
+    elif args.day_folder!='':
         for df in list_dayfolder(args.day_folder):
             args.datafolder = os.path.join(args.day_folder, df)
             if os.path.isdir(os.path.join(args.datafolder, 'FaceCamera-imgs')):
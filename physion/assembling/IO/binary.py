@@ -29,6 +29,7 @@ class BinaryFile:
 
         self._index = 0
         self._can_read = True
+        self._frames = None
 
     @staticmethod
     def convert_numpy_file_to_suite2p_binary(from_filename, to_filename):
@@ -61,6 +62,7 @@ class BinaryFile:
         return np.prod(np.array(self.shape).astype(np.int64))
 
     def close(self) -> None:
+        self._frames = None # releases the memory-map
         self.read_file.close()
         if self.write_file:
             self.write_file.close()
@@ -107,6 +109,20 @@ class BinaryFile:
                 frame[:] = np.reshape(data, (self.Ly, self.Lx))
         return frames
 
+    @property
+    def frames(self) -> np.ndarray:
+        """read-only memory-mapped view of the frames (n_frames, Ly, Lx)
+
+        the map is opened once and kept until close(), slicing it only reads
+        the requested frames from disk (no copy of the full movie)
+        """
+        if self._frames is None:
+            if self.n_frames==0:
+                return np.empty((0, self.Ly, self.Lx), np.int16)
+            self._frames = np.memmap(self.read_filename, dtype=np.int16, mode='r',
+                                     shape=self.shape)
+        return self._frames
+
     @property
     def data(self) -> np.ndarray:
         with temporary_pointer(self.read_file) as f:
@@ -1,81 +1,144 @@
 import xml.etree.ElementTree as ET
 import numpy as np
+import os, re, array
 
-def bruker_xml_parser(filename):
-    """
-    function to parse the xml metadata file produced by the Prairie software
+CHANNELS = ['Ch1', 'Ch2']
 
-    TODO:
-    - find automated ways to count channels
-    """
-    mytree = ET.parse(filename)
-    root = mytree.getroot()
+def parse_settings(settings):
 
-    data = {'settings':{}, 'date':root.attrib['date']}
-    
-    settings = root[1]
+    data = {}
     for setting in settings:
         if 'value' in setting.attrib:
-            data['settings'][setting.attrib['key']] = setting.attrib['value']
+            data[setting.attrib['key']] = setting.attrib['value']
         else:
-            data['settings'][setting.attrib['key']] = {}
+            data[setting.attrib['key']] = {}
             for s in setting:
                 if s.tag == 'IndexedValue':
                     if 'description' in s.attrib:
-                        data['settings'][setting.attrib['key']][s.attrib['description']] = s.attrib['value']
+                        data[setting.attrib['key']][s.attrib['description']] = s.attrib['value']
                     else:
-                        data['settings'][setting.attrib['key']][s.attrib['index']] = s.attrib['value']
+                        data[setting.attrib['key']][s.attrib['index']] = s.attrib['value']
                 elif s.tag == 'SubindexedValues':
                     if len(list(s)) == 1:
-                        data['settings'][setting.attrib['key']][s.attrib['index']] = s[0].attrib['value']
+                        data[setting.attrib['key']][s.attrib['index']] = s[0].attrib['value']
                     else:
-                        data['settings'][setting.attrib['key']][s.attrib['index']] = {}
+                        data[setting.attrib['key']][s.attrib['index']] = {}
                         for sub in s:
-                            data['settings'][setting.attrib['key']][s.attrib['index']][sub.attrib['description']] = [sub.attrib['value']]
-    
-    frames = root[2]
-    for channel in ['Ch1', 'Ch2']:
-        data[channel] = {'relativeTime':[],
-                         'absoluteTime':[],
-                         'depth':[],
+                            data[setting.attrib['key']][s.attrib['index']][sub.attrib['description']] = [sub.attrib['value']]
+    return data
+
+
+def parse_frame(x, data):
+    """ adds the timing/files/depth of a "Frame" element to the (growing) arrays of "data" """
+    for f in x:
+        for channel in CHANNELS:
+            if f.tag == 'File' and f.attrib['channelName'] == channel:
+                data[channel]['tifFile'].append(f.attrib['filename'])
+                for key in ['relativeTime', 'absoluteTime']:
+                    data[channel][key].append(float(x.attrib[key]))
+            # depth
+            if f.tag == 'PVStateShard':
+                for d in f:
+                    if d.attrib['key']=='positionCurrent':
+                        for e in d:
+                            if e.attrib['index']=='ZAxis':
+                                for g in e:
+                                    data[channel]['depth'].append(float(g.attrib['value']))
+
+
+def last_frame_times(filename, tail_size=1000000):
+    """
+    (relativeTime, absoluteTime) of the last frame, read from the end of the file
+    """
+    with open(filename, 'rb') as f:
+        f.seek(max([0, os.path.getsize(filename)-tail_size]))
+        tail = f.read()
+    frames = re.findall(rb'<Frame\s[^>]*>', tail)
+    if len(frames)==0:
+        return None
+    return tuple(float(re.search(rb'\s%s="([^"]*)"' % key, frames[-1]).group(1))\
+                 for key in [b'relativeTime', b'absoluteTime'])
+
+
+def bruker_xml_parser(filename,
+                      header_only=False):
+    """
+    function to parse the xml metadata file produced by the Prairie software
+
+    the file is parsed incrementally (each frame element is discarded once read)
+    and the per-frame timing is returned as numpy arrays
+
+    with "header_only", the frame list is not walked, we only get the header
+    (date, settings, StartTime) and the first and last frame times:
+          'FirstFrameTime', 'LastFrameTime', 'Duration' (None if no frame)
+
+    TODO:
+    - find automated ways to count channels
+    """
+    data = {'settings':{}}
+    for channel in CHANNELS:
+        data[channel] = {'relativeTime':array.array('d'),
+                         'absoluteTime':array.array('d'),
+                         'depth':array.array('d'),
                          'tifFile':[]}
-    data['StartTime'] = frames.attrib['time']
-    
-    for x in frames:  
-        if x.tag == 'Frame':
-            for f in x:
-                for channel in ['Ch1', 'Ch2']:
-                    if f.tag == 'File' and f.attrib['channelName'] == channel:
-                        data[channel]['tifFile'].append(f.attrib['filename'])
-                        for key in ['relativeTime', 'absoluteTime']:
-                            data[channel][key].append(float(x.attrib[key]))
-                    # depth
-                    if f.tag == 'PVStateShard':
-                        for d in f:
-                            if d.attrib['key']=='positionCurrent':
-                                for e in d:
-                                    if e.attrib['index']=='ZAxis':
-                                        for g in e:
-                                            data[channel]['depth'].append(float(g.attrib['value']))
+
+    level, iroot = 0, 0 # nesting level and index of the children of the root
+    root, sequence = None, None
+    for event, elem in ET.iterparse(filename, events=('start', 'end')):
+        if event=='start':
+            level += 1
+            if level==1:
+                root = elem
+                data['date'] = elem.attrib['date']
+            elif (level==2) and (iroot==2):
+                sequence = elem
+                data['StartTime'] = elem.attrib['time']
+            continue
+
+        level -= 1
+        if level==1:
+            if iroot==1:
+                data['settings'] = parse_settings(elem)
+            elif iroot==2:
+                break # the frames are over
+            iroot += 1
+            root.clear() # the root child is not needed anymore
+        elif (level==2) and (iroot==2) and (elem.tag=='Frame'):
+            parse_frame(elem, data)
+            sequence.clear() # the frame is not needed anymore
+            if header_only:
+                break
+
+    if header_only:
+        data['FirstFrameTime'], data['LastFrameTime'], data['Duration'] = None, None, None
+        if len(data['Ch1']['absoluteTime'])>0:
+            data['FirstFrameTime'] = data['Ch1']['absoluteTime'][0]
+            last = last_frame_times(filename)
+            data['LastFrameTime'] = (last[1] if last is not None else data['FirstFrameTime'])
+            data['Duration'] = data['LastFrameTime']-data['FirstFrameTime']
+        for channel in CHANNELS:
+            del data[channel]
+        return data
 
     # translation to numpy arrays
-    for channel in ['Ch1', 'Ch2']:
+    for channel in CHANNELS:
         for key in ['relativeTime', 'absoluteTime']:
             data[channel][key] = np.array(data[channel][key], dtype=np.float64)
+        data[channel]['depth'] = list(data[channel]['depth'])
         for key in ['tifFile']:
             data[channel][key] = np.array(data[channel][key], dtype=str)
-                        
+
     return data
 
 
 if __name__=='__main__':
 
-    import sys, os, pathlib
+    import pathlib
 
     # we test it on the example file that we have in the repo:
     example_file = os.path.join(str(pathlib.Path(__file__).resolve().parents[2]),
                                 'Ca_imaging', 'Bruker_xml', 'TSeries-190620-250-00-002.xml')
-    
+
     data = bruker_xml_parser(example_file)
     print(data.keys())
     print(data['Ch1'].keys())
@@ -83,3 +146,4 @@ if __name__=='__main__':
     print(data['Ch1']['tifFile'][-10:])
     import pprint
     pprint.pprint(data['settings'])
+    pprint.pprint(bruker_xml_parser(example_file, header_only=True))
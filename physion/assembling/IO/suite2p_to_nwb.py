@@ -9,17 +9,34 @@ from pynwb.device import Device
 from pynwb.ophys import OpticalChannel
 from pynwb.ophys import TwoPhotonSeries
 from pynwb.ophys import ImageSegmentation
+from pynwb.ophys import PlaneSegmentation
 from pynwb.ophys import RoiResponseSeries
 from pynwb.ophys import Fluorescence
 from pynwb import NWBHDF5IO
+from hdmf.common.table import VectorData, VectorIndex, ElementIdentifiers
+from hdmf.data_utils import DataChunkIterator
+
+def trace_generator(save_folder, fstr, iscells):
+    """
+    yields the traces (e.g. fstr='F.npy') of the valid ROIs, plane by plane
+    """
+    for iplane, iscell in enumerate(iscells):
+        traces = np.load(os.path.join(save_folder, 'plane%i' % iplane, fstr), mmap_mode='r')
+        for roi in np.flatnonzero(iscell):
+            yield np.array(traces[roi,:])
+
 
 def add_ophys_processing_from_suite2p(save_folder, nwbfile, CaImaging_timestamps,
                                       device=None,
                                       optical_channel=None,
                                       imaging_plane=None,
-                                      image_series=None):
+                                      image_series=None,
+                                      buffer_size=100):
     """ 
     adapted from suite2p/suite2p/io/nwb.py "save_nwb" function
+
+    the ROI table is built in bulk and the traces are streamed (see "trace_generator"),
+    so that at most one plane of traces is in memory
     """
 
     plane_folders = natsorted([ f.path for f in os.scandir(save_folder) if f.is_dir() and f.name[:5]=='plane'])
@@ -71,53 +88,48 @@ def add_ophys_processing_from_suite2p(save_folder, nwbfile, CaImaging_timestamps
 
     # processing
     img_seg = ImageSegmentation()
-    ps = img_seg.create_plane_segmentation(
-        name='PlaneSegmentation',
-        description='suite2p output',
-        imaging_plane=imaging_plane,
-        reference_images=image_series
-    )
     ophys_module = nwbfile.create_processing_module(
         name='ophys', 
         description='optical physiology processed data'
     )
-    ophys_module.add(img_seg)
 
-    file_strs = ['F.npy', 'Fneu.npy', 'spks.npy']
-    traces = []
-    ncells_all = 0
+    # ROIs: masks of all planes gathered and inserted in bulk
+    iscells, masks, redcell = [], [], []
     for iplane, ops in enumerate(ops1):
-        if iplane==0:
-            iscell = np.load(os.path.join(save_folder, 'plane%i' % iplane, 'iscell.npy')).astype(bool)
-            if ops['nchannels']>1:
-                redcell = np.load(os.path.join(save_folder, 'plane%i' % iplane, 'redcell.npy'))[iscell[:,0], :]
-            for fstr in file_strs:
-                traces.append(np.load(os.path.join(save_folder, 'plane%i' % iplane, fstr))[iscell[:,0], :])
-        else:
-            iscell = np.append(iscell, np.load(os.path.join(save_folder, 'plane%i' % iplane, 'iscell.npy')), axis=0)
-            if ops['nchannels']>1:
-                redcell = np.append(redcell, np.load(os.path.join(save_folder, 'plane%i' % iplane, 'redcell.npy'))[iscell[:,0], :], axis=0)
-            for i,fstr in enumerate(file_strs):
-                traces[i] = np.append(traces[i], 
-                                      np.load(os.path.join(save_folder, 'plane%i' % iplane, fstr))[iscell[:,0], :], axis=0) 
-
-        stat = np.load(os.path.join(save_folder, 'plane%i' % iplane, 'stat.npy'), allow_pickle=True)
-        ncells = np.sum(iscell[:,0])
-        for n in np.arange(ncells):
+        plane_folder = os.path.join(save_folder, 'plane%i' % iplane)
+        iscell = np.load(os.path.join(plane_folder, 'iscell.npy')).astype(bool)
+        iscells.append(iscell[:,0])
+        if ops['nchannels']>1:
+            redcell.append(np.load(os.path.join(plane_folder, 'redcell.npy'))[iscell[:,0], :])
+        stat = np.load(os.path.join(plane_folder, 'stat.npy'), allow_pickle=True)[iscell[:,0]]
+        for roi in stat:
             if multiplane:
-                pixel_mask = np.array([stat[iscell[:,0]][n]['ypix'], stat[iscell[:,0]][n]['xpix'], 
-                                    iplane*np.ones(stat[iscell[:,0]][n]['npix']), 
-                                    stat[iscell[:,0]][n]['lam']])
-                ps.add_roi(voxel_mask=pixel_mask.T)
+                masks.append(np.array([roi['ypix'], roi['xpix'], iplane*np.ones(roi['npix']), roi['lam']]).T)
             else:
-                pixel_mask = np.array([stat[iscell[:,0]][n]['ypix'], stat[iscell[:,0]][n]['xpix'], 
-                                    stat[iscell[:,0]][n]['lam']])
-                ps.add_roi(pixel_mask=pixel_mask.T)
-        ncells_all+=ncells
+                masks.append(np.array([roi['ypix'], roi['xpix'], roi['lam']]).T)
+    ncells_all = len(masks)
+
+    mask_key = ('voxel_mask' if multiplane else 'pixel_mask')
+    mask_data = VectorData(name=mask_key,
+                           description=[c['description'] for c in PlaneSegmentation.__columns__ if c['name']==mask_key][0],
+                           data=(np.concatenate(masks) if ncells_all>0 else np.zeros((0, 4 if multiplane else 3))))
+    mask_index = VectorIndex(name=mask_key+'_index',
+                             data=list(np.cumsum([len(m) for m in masks])),
+                             target=mask_data)
+    ps = PlaneSegmentation(
+        name='PlaneSegmentation',
+        description='suite2p output',
+        imaging_plane=imaging_plane,
+        reference_images=image_series,
+        id=ElementIdentifiers(name='id', data=list(range(ncells_all))),
+        columns=[mask_data, mask_index]
+    )
+    img_seg.add_plane_segmentation(ps)
+    ophys_module.add(img_seg)
 
     # ps.add_column('iscell', 'two columns - iscell & probcell', iscell)
     if ops['nchannels']>1:
-        ps.add_column('redcell', 'two columns - redcell & probcell', redcell)
+        ps.add_column('redcell', 'two columns - redcell & probcell', np.concatenate(redcell))
 
     rt_region = ps.create_roi_table_region(
         region=list(np.arange(0, ncells_all)),
@@ -128,9 +140,14 @@ def add_ophys_processing_from_suite2p(save_folder, nwbfile, CaImaging_timestamps
     name_strs = ['Fluorescence', 'Neuropil', 'Deconvolved']
 
     for i, (fstr,nstr) in enumerate(zip(file_strs, name_strs)):
+        # the traces are streamed into the file (plane by plane, "buffer_size" ROIs at a time)
+        traces = np.load(os.path.join(save_folder, 'plane0', fstr), mmap_mode='r')
         roi_resp_series = RoiResponseSeries(
             name=nstr,
-            data=traces[i],
+            data=DataChunkIterator(data=trace_generator(save_folder, fstr, iscells),
+                                   maxshape=(ncells_all, traces.shape[1]),
+                                   dtype=traces.dtype,
+                                   buffer_size=buffer_size),
             rois=rt_region,
             unit='lumens',
             timestamps=CaImaging_timestamps) # CRITICAL TO HAVE IT HERE FOR RE-ALIGNEMENT
@@ -89,8 +89,10 @@ def add_ophys(nwbfile, args,
             dI = 1
         
         def Ca_frame_generator():
+            # streaming from the memory-mapped view, only the frames of the chunk are read
+            frames = Ca_data.frames
             for i in CA_SUBSAMPLING:
-                yield Ca_data.data[i:i+dI, :, :].mean(axis=0).astype(np.uint8)
+                yield frames[i:i+dI, :, :].mean(axis=0).astype(np.uint8)
 
         Ca_dataI = DataChunkIterator(data=Ca_frame_generator(),
                                      maxshape=(None, Ca_data.shape[1], Ca_data.shape[2]),
@@ -1,4 +1,5 @@
-import os, sys, pathlib, shutil, time, datetime, tempfile
+import os, sys, pathlib, shutil, time, datetime, tempfile, copy
+import multiprocessing
 from PIL import Image
 import numpy as np
 
@@ -8,7 +9,7 @@ from hdmf.backends.hdf5.h5_utils import H5DataIO
 from dateutil.tz import tzlocal
 
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
-from assembling.saving import get_files_with_extension, list_dayfolder, check_datafolder, get_TSeries_folders
+from assembling.saving import get_files_with_extension, list_dayfolder, check_datafolder, get_TSeries_folders, load_FaceCamera_frame
 from assembling.move_CaImaging_folders import StartTime_to_day_seconds
 from assembling.realign_from_photodiode import realign_from_photodiode
 from behavioral_monitoring.locomotion import compute_locomotion_speed
@@ -42,7 +43,7 @@ def build_NWB(args,
 
     day = metadata['filename'].split('\\')[-2].split('_')
     Time = metadata['filename'].split('\\')[-1].split('-')
-    identifier = metadata['filename'].split('\\')[-2]+'-'+metadata['filename'].split('\\')[-1]
+    identifier = build_identifier(metadata)
     start_time = datetime.datetime(int(day[0]),int(day[1]),int(day[2]),
                 int(Time[0]),int(Time[1]),int(Time[2]),tzinfo=tzlocal())
 
@@ -83,7 +84,7 @@ def build_NWB(args,
                             source_script_file_name=str(pathlib.Path(__file__).resolve()),
                             file_create_date=datetime.datetime.utcnow().replace(tzinfo=tzlocal()))
     
-    filename = os.path.join(pathlib.Path(args.datafolder).parent, '%s.nwb' % identifier)
+    filename = NWB_filename(args.datafolder, metadata=metadata)
     
     manager = pynwb.get_manager() # we need a manager to link raw and processed data
     
@@ -212,14 +213,14 @@ def build_NWB(args,
                                                             verbose=True)
 
             if ('raw_FaceCamera' in args.modalities):
-                    imgR = np.load(os.path.join(args.datafolder, 'FaceCamera-imgs', FC_FILES[0]))
+                    imgR = load_FaceCamera_frame(os.path.join(args.datafolder, 'FaceCamera-imgs'), FC_FILES[0])
 
                     FC_SUBSAMPLING = build_subsampling_from_freq(args.FaceCamera_frame_sampling,
                                                                  1./np.mean(np.diff(FC_times)), len(FC_FILES), Nmin=3)
                     def FaceCamera_frame_generator():
                         for i in FC_SUBSAMPLING:
                             try:
-                                im = np.load(os.path.join(args.datafolder, 'FaceCamera-imgs', FC_FILES[i])).astype(np.uint8).reshape(imgR.shape)
+                                im = load_FaceCamera_frame(os.path.join(args.datafolder, 'FaceCamera-imgs'), FC_FILES[i]).astype(np.uint8).reshape(imgR.shape)
                                 yield im
                             except ValueError:
                                 print('Pb in FaceCamera with frame #', i)
@@ -277,7 +278,7 @@ def build_NWB(args,
 
                 # then add the frames subsampled
                 if FC_FILES is not None:
-                    imgP = np.load(os.path.join(args.datafolder, 'FaceCamera-imgs', FC_FILES[0]))
+                    imgP = load_FaceCamera_frame(os.path.join(args.datafolder, 'FaceCamera-imgs'), FC_FILES[0])
                     x, y = np.meshgrid(np.arange(0,imgP.shape[0]), np.arange(0,imgP.shape[1]), indexing='ij')
                     cond = (x>=dataP['xmin']) & (x<=dataP['xmax']) & (y>=dataP['ymin']) & (y<=dataP['ymax'])
 
@@ -288,7 +289,7 @@ def build_NWB(args,
                     def Pupil_frame_generator():
                         for i in PUPIL_SUBSAMPLING:
                             try:
-                                im = np.load(os.path.join(args.datafolder, 'FaceCamera-imgs', FC_FILES[i])).astype(np.uint8)[cond].reshape(*new_shapeP)
+                                im = load_FaceCamera_frame(os.path.join(args.datafolder, 'FaceCamera-imgs'), FC_FILES[i]).astype(np.uint8)[cond].reshape(*new_shapeP)
                                 yield im
                             except ValueError:
                                 print('Pb in FaceCamera with frame #', i)
@@ -342,7 +343,7 @@ def build_NWB(args,
                     FACEMOTION_SUBSAMPLING = build_subsampling_from_freq(args.FaceMotion_frame_sampling,
                                                                          1./np.mean(np.diff(FC_times)), len(FC_FILES), Nmin=3)
                     
-                    imgFM = np.load(os.path.join(args.datafolder, 'FaceCamera-imgs', FC_FILES[0]))
+                    imgFM = load_FaceCamera_frame(os.path.join(args.datafolder, 'FaceCamera-imgs'), FC_FILES[0])
                     x, y = np.meshgrid(np.arange(0,imgFM.shape[0]), np.arange(0,imgFM.shape[1]), indexing='ij')
                     condF = (x>=dataF['ROI'][0]) & (x<=(dataF['ROI'][0]+dataF['ROI'][2])) &\
                         (y>=dataF['ROI'][1]) & (y<=(dataF['ROI'][1]+dataF['ROI'][3]))
@@ -353,8 +354,8 @@ def build_NWB(args,
                         for i in FACEMOTION_SUBSAMPLING:
                             i0 = np.min([i, len(FC_FILES)-2])
                             try:
-                                imgFM1 = np.load(os.path.join(args.datafolder, 'FaceCamera-imgs', FC_FILES[i0])).astype(np.uint8)[condF].reshape(*new_shapeF)
-                                imgFM2 = np.load(os.path.join(args.datafolder, 'FaceCamera-imgs', FC_FILES[i0+1])).astype(np.uint8)[condF].reshape(*new_shapeF)
+                                imgFM1 = load_FaceCamera_frame(os.path.join(args.datafolder, 'FaceCamera-imgs'), FC_FILES[i0]).astype(np.uint8)[condF].reshape(*new_shapeF)
+                                imgFM2 = load_FaceCamera_frame(os.path.join(args.datafolder, 'FaceCamera-imgs'), FC_FILES[i0+1]).astype(np.uint8)[condF].reshape(*new_shapeF)
                                 yield imgFM2-imgFM1
                             except BaseException as be:
                                 print(be)
@@ -385,7 +386,7 @@ def build_NWB(args,
             print('=> Storing Vm signal for "%s" [...]' % args.datafolder)
             
         vm = pynwb.TimeSeries(name='Vm-Signal',
-                              description='gain 1 on Multiclamp'
+                              description='gain 1 on Multiclamp',
                               data = NIdaq_data['analog'][iElectrophy],
                               starting_time=0.,
                               unit='mV',
@@ -399,7 +400,7 @@ def build_NWB(args,
             print('=> Storing LFP signal for "%s" [...]' % args.datafolder)
             
         lfp = pynwb.TimeSeries(name='LFP-Signal',
-                               description='gain 100 on Multiclamp'
+                               description='gain 100 on Multiclamp',
                                data = NIdaq_data['analog'][iElectrophy],
                                starting_time=0.,
                                unit='mV',
@@ -454,6 +455,85 @@ def build_NWB(args,
         Ca_data.close() # can be closed only after having written
 
     return filename
+
+
+def build_identifier(metadata):
+    return metadata['filename'].split('\\')[-2]+'-'+metadata['filename'].split('\\')[-1]
+
+
+def NWB_filename(datafolder, metadata=None):
+    """ the NWB file is written in the parent folder of the datafolder """
+    if metadata is None:
+        metadata = np.load(os.path.join(datafolder, 'metadata.npy'),
+                           allow_pickle=True).item()
+    return os.path.join(pathlib.Path(datafolder).parent, '%s.nwb' % build_identifier(metadata))
+
+
+def is_up_to_date(datafolder):
+    """
+    True if the NWB file exists and is newer than all the files of the datafolder
+    (first level files and sub-folders modification times)
+    """
+    try:
+        filename = NWB_filename(datafolder)
+    except BaseException:
+        return False
+    if not os.path.isfile(filename):
+        return False
+    inputs_mtime = max([entry.stat().st_mtime for entry in os.scandir(datafolder)])
+    return os.path.getmtime(filename)>inputs_mtime
+
+
+def build_NWB_job(args):
+    """ single session of the batch processing, never raises """
+    tstart = time.time()
+    try:
+        build_NWB(args)
+        return args.datafolder, 'done', time.time()-tstart, ''
+    except BaseException as be:
+        return args.datafolder, 'failed', time.time()-tstart, str(be)
+
+
+def build_NWB_batch(args, datafolders,
+                    Nworkers=1,
+                    resume=False):
+    """
+    builds the NWB files of a set of datafolders with a pool of "Nworkers" processes
+
+    - a failing session does not stop the others (reported in the summary)
+    - with "resume", the sessions whose NWB file is newer than their inputs are skipped
+    """
+    JOBS, SUMMARY = [], []
+    for datafolder in datafolders:
+        if resume and is_up_to_date(datafolder):
+            SUMMARY.append((datafolder, 'skipped', 0., 'up to date'))
+        else:
+            job_args = copy.deepcopy(args)
+            job_args.datafolder = datafolder
+            JOBS.append(job_args)
+
+    print('=> building n=%i NWB files with %i workers (%i skipped) [...]' % (len(JOBS), Nworkers, len(SUMMARY)))
+    tstart = time.time()
+    if Nworkers>1:
+        pool = multiprocessing.Pool(Nworkers)
+        results = pool.imap_unordered(build_NWB_job, JOBS)
+    else:
+        pool, results = None, map(build_NWB_job, JOBS)
+    for i, result in enumerate(results):
+        print('[%i/%i] %s -- %s in %.1fs %s' % (i+1, len(JOBS), result[0], result[1], result[2],
+                                                ('(%s)' % result[3] if result[3]!='' else '')))
+        SUMMARY.append(result)
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    print('=> batch processing done in %.1fs: %i done, %i failed, %i skipped' % (time.time()-tstart,
+            *[len([s for s in SUMMARY if s[1]==status]) for status in ['done', 'failed', 'skipped']]))
+    for datafolder, status, duration, error in SUMMARY:
+        if status=='failed':
+            print('   - failed: %s (%s)' % (datafolder, error))
+    return SUMMARY
+
     
 if __name__=='__main__':
 
@@ -482,6 +562,8 @@ if __name__=='__main__':
     parser.add_argument('-ndo', "--nidaq_only", action="store_true")
     parser.add_argument("--full", action="store_true")
     parser.add_argument("--standard", action="store_true")
+    parser.add_argument('-n', "--Nworkers", type=int, default=1, help='number of parallel processes for the batch mode (root_datafolder)')
+    parser.add_argument("--resume", action="store_true", help='batch mode: skip the datafolders whose NWB file is newer than the data')
     args = parser.parse_args()
 
     if not args.silent:
@@ -517,10 +599,5 @@ if __name__=='__main__':
         else:
             print('"%s" not a valid datafolder' % args.datafolder)
     elif args.root_datafolder!='':
-        FOLDERS = [l for l in os.listdir(args.root_datafolder) if len(l)==8]
-        for f in FOLDERS:
-            args.datafolder = os.path.join(args.root_datafolder, f)
-            try:
-                build_NWB(args)
-            except BaseException as e:
-                print(e)
+        FOLDERS = [os.path.join(args.root_datafolder, l) for l in os.listdir(args.root_datafolder) if len(l)==8]
+        build_NWB_batch(args, FOLDERS, Nworkers=args.Nworkers, resume=args.resume)
@@ -1,5 +1,6 @@
 import numpy as np
-import os, sys, pathlib
+import os, sys, pathlib, threading
+from collections import OrderedDict
 
 try:
     import skvideo.io
@@ -13,7 +14,7 @@ except ModuleNotFoundError:
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
 
 from assembling.saving import day_folder, create_day_folder, generate_filename_path,\
-    check_datafolder, get_files_with_extension
+    check_datafolder, get_files_with_extension, is_FaceCamera_chunk, FaceCamera_frames, load_FaceCamera_frame
 
 
 ##############################################
@@ -32,6 +33,92 @@ class SingleValueTimeSerie:
         self.val = signal # value
 
 
+class ChunkCache:
+    """
+    bounded (least-recently-used) cache of decoded video/npz chunks
+
+    chunks can be decoded in advance in a background thread ("prefetch"),
+    a chunk is never decoded twice while it is in the cache
+    """
+
+    def __init__(self, loader, size=3):
+        self.loader, self.size = loader, size
+        self.chunks = OrderedDict()
+        self.pending = {} # filename -> threading.Event, set when decoded
+        self.lock = threading.Lock()
+        self.Ndecoded = 0
+
+    def get(self, fn):
+        with self.lock:
+            if fn in self.chunks:
+                self.chunks.move_to_end(fn)
+                return self.chunks[fn]
+            event = self.pending.get(fn)
+            if event is None:
+                event = self.pending[fn] = threading.Event()
+                owner = True
+            else:
+                owner = False
+        if owner:
+            return self.load(fn, event)
+        event.wait()
+        with self.lock:
+            x = self.chunks.get(fn)
+        return x if (x is not None) else self.get(fn)
+
+    def load(self, fn, event):
+        try:
+            x = self.loader(fn)
+            with self.lock:
+                self.Ndecoded += 1
+                self.chunks[fn] = x
+                while len(self.chunks)>self.size:
+                    self.chunks.popitem(last=False)
+            return x
+        finally:
+            with self.lock:
+                self.pending.pop(fn, None)
+            event.set()
+
+    def prefetch(self, fn):
+        with self.lock:
+            if (fn in self.chunks) or (fn in self.pending):
+                return
+            event = self.pending[fn] = threading.Event()
+        threading.Thread(target=self.load, args=(fn, event), daemon=True).start()
+
+
+def load_npz_chunk(fn):
+    return np.load(fn)['arr_0']
+
+def load_video_chunk(fn):
+    return skvideo.io.vread(fn)[:,:,:,0]
+
+
+def nearest_index(times, t, is_sorted=True,
+                  force_previous_time=False):
+    """
+    index of the time closest to "t" (first one in case of equality)
+    or, with "force_previous_time", of the last time <= t
+    """
+    if not is_sorted:
+        if force_previous_time:
+            return np.arange(len(times))[times<=t][-1]
+        return np.argmin((t-times)**2)
+    if force_previous_time:
+        i0 = np.searchsorted(times, t, side='right')-1
+        if i0<0:
+            raise IndexError('no time before t=%s' % t)
+        return i0
+    i0 = np.searchsorted(times, t, side='left')
+    if i0==0:
+        return 0
+    elif i0==len(times):
+        return len(times)-1
+    else:
+        return (i0-1 if ((t-times[i0-1])**2<=(t-times[i0])**2) else i0)
+
+
 class ImageTimeSeries:
     
     def __init__(self, folder,
@@ -41,9 +128,12 @@ class ImageTimeSeries:
                  extension='.npy',
                  lazy_loading=True,
                  compression_metadata=None,
+                 chunk_cache_size=3,
                  t0=0):
         """
         IMAGES can be initialized
+
+        with "lazy_loading", the last "chunk_cache_size" decoded chunks are kept in memory
         """
 
         self.extension=extension
@@ -52,6 +142,9 @@ class ImageTimeSeries:
         
         FILES = sorted(get_files_with_extension(folder,
                                                 extension=extension))
+        if (extension=='.npy') and any([is_FaceCamera_chunk(f) for f in os.listdir(folder)]):
+            # frames stored by chunks (see "assembling.saving.FaceCamera_frames")
+            FILES = [os.path.join(folder, f) for f in FaceCamera_frames(folder)[1]]
 
         ### ASSOCIATING A TEMPORAL SAMPLING
         # ---------------------------------------------
@@ -91,13 +184,18 @@ class ImageTimeSeries:
 
         if lazy_loading and self.VIDS is not None:
             # we just make a map between indices and videos/frames
-            self.index_frame_map = []
+            self.index_frame_map, self.next_chunk = [], {}
+            sampled_frames = set(np.array(frame_sampling).flatten()) # constant-time membership test
             for i, fn in enumerate(self.VIDS):
                 s = fn.split('imgs-')[1].replace(extension, '').split('-')
                 i0, i1 = int(s[0]), int(s[1])
                 for i, iframe in enumerate(np.arange(i0, i1+1)):
-                    if iframe in frame_sampling:
+                    if iframe in sampled_frames:
                         self.index_frame_map.append([fn, i])
+            for fn1, fn2 in zip(self.VIDS[:-1], self.VIDS[1:]):
+                self.next_chunk[fn1] = fn2
+            self.chunks = ChunkCache(load_npz_chunk if extension=='.npz' else load_video_chunk,
+                                     size=chunk_cache_size)
         elif (self.VIDS is not None):
             print('Pre-loading the full-set of videos [...]')
             self.IMAGES = []
@@ -126,10 +224,8 @@ class ImageTimeSeries:
                    with_index=False):
 
         # finding the image index at that time
-        if force_previous_time:
-            i0 = np.arange(len(self.t))[self.t<=t][-1]
-        else:
-            i0 = np.argmin((t-self.t)**2)
+        i0 = nearest_index(self.t, t, is_sorted=self.times_are_sorted(),
+                           force_previous_time=force_previous_time)
         if verbose:
             print('found t=', self.t[i0], 'for t=', t)
             
@@ -137,19 +233,17 @@ class ImageTimeSeries:
         if self.IMAGES is not None:
             im = self.IMAGES[i0]
         elif self.BINARY_IMAGES is not None:
-            im = np.load(self.BINARY_IMAGES[i0])
-        elif self.extension=='.npz':
-            fn, index = self.index_frame_map[i0]
-            x = np.load(fn)['arr_0']
-            im = x[index,:,:]
+            im = load_FaceCamera_frame(*os.path.split(self.BINARY_IMAGES[i0]))
         else:
             # we have loaded it using the "lazy_loading" option
             fn, index = self.index_frame_map[i0]
             try:
-                x = skvideo.io.vread(fn)
-                im = x[index,:,:,0]
+                im = self.chunks.get(fn)[index,:,:]
             except MemoryError:
                 im = np.zeros((100,100))
+            if (fn in self.next_chunk) and (0<i0-getattr(self, '_last_index', -100)<=10):
+                self.chunks.prefetch(self.next_chunk[fn]) # moving forward, read-ahead for the playback
+            self._last_index = i0
             
         if with_time and with_index:
             return i0, self.t[i0], im
@@ -159,6 +253,12 @@ class ImageTimeSeries:
             return i0, im
         else:
             return im
+
+    def times_are_sorted(self):
+        """ checked once per time array (the times can be re-set, e.g. after realignement) """
+        if getattr(self, '_sorted_times', (None,))[0] is not self.t:
+            self._sorted_times = (self.t, bool(np.all(np.diff(self.t)>=0)))
+        return self._sorted_times[1]
         
 ##############################################
 ###               Screen data              ###
@@ -1,4 +1,4 @@
-import sys, time, os, pathlib, subprocess
+import sys, time, os, pathlib, subprocess, multiprocessing
 from PyQt5 import QtGui, QtWidgets, QtCore
 
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
@@ -10,11 +10,17 @@ class MainWindow(QtWidgets.QMainWindow):
     
     def __init__(self, app,
                  args=None,
-                 parent=None):
+                 parent=None,
+                 Nmax_processes=max([1, multiprocessing.cpu_count()//2])):
         """
         sampling in Hz
+
+        at most "Nmax_processes" "build_NWB.py" subprocesses run at the same time,
+        the next ones are queued
         """
         self.app = app
+        self.Nmax_processes = Nmax_processes
+        self.queued_cmds, self.processes = [], []
 
         super(MainWindow, self).__init__()
 
@@ -110,6 +116,12 @@ class MainWindow(QtWidgets.QMainWindow):
         self.gen.move(50, HEIGHT)
         
         self.folder = ''
+
+        # launching the queued subprocesses
+        self.processTimer = QtCore.QTimer()
+        self.processTimer.timeout.connect(self.check_processes)
+        self.processTimer.start(1000) # ms
+
         self.show()
 
         
@@ -148,13 +160,24 @@ class MainWindow(QtWidgets.QMainWindow):
                                               self.cbc.currentText())
     def run(self):
         if self.folder != '':
-            print(self.build_cmd())
-            p = subprocess.Popen(self.build_cmd(),
-                                 shell=True)
-            print('"%s" launched as a subprocess' % self.build_cmd())
+            self.queued_cmds.append((self.build_cmd(), time.time()))
+            print('"%s" queued (%i running, %i queued)' % (self.build_cmd(), len(self.processes), len(self.queued_cmds)))
+            self.check_processes()
         else:
             print(' /!\ Need a valid folder !  /!\ ')
 
+    def check_processes(self):
+        # finished processes
+        for p, cmd, tstart in self.processes:
+            if p.poll() is not None:
+                print('"%s" %s after %.1fs' % (cmd, ('done' if p.returncode==0 else 'FAILED'), time.time()-tstart))
+        self.processes = [(p, cmd, tstart) for p, cmd, tstart in self.processes if p.poll() is None]
+        # launching the queued ones
+        while (len(self.processes)<self.Nmax_processes) and (len(self.queued_cmds)>0):
+            cmd, _ = self.queued_cmds.pop(0)
+            self.processes.append((subprocess.Popen(cmd, shell=True), cmd, time.time()))
+            print('"%s" launched as a subprocess' % cmd)
+
     def gen_script(self):
         # launch without subsampling !!
         with open(self.script, 'a') as f:
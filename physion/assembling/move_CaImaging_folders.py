@@ -38,15 +38,15 @@ def build_Ca_filelist(folder):
     for bdf in get_TSeries_folders(folder):
         fn = get_files_with_extension(bdf, extension='.xml')[0]
         try:
-            xml = bruker_xml_parser(fn)
-            if len(xml['Ch1']['relativeTime'])>0:
+            xml = bruker_xml_parser(fn, header_only=True) # no need to walk the frames
+            if xml['FirstFrameTime'] is not None:
                 CA_FILES['date'].append(stringdatetime_to_date(xml['date']))
                 CA_FILES['Bruker_folder'].append(bdf)
                 CA_FILES['Bruker_file'].append(fn)
                 CA_FILES['StartTimeString'].append(xml['StartTime'])
                 start = StartTime_to_day_seconds(xml['StartTime'])
-                CA_FILES['StartTime'].append(start+xml['Ch1']['absoluteTime'][0])
-                CA_FILES['EndTime'].append(start+xml['Ch1']['absoluteTime'][-1])
+                CA_FILES['StartTime'].append(start+xml['FirstFrameTime'])
+                CA_FILES['EndTime'].append(start+xml['LastFrameTime'])
                 CA_FILES['protocol'].append('')
         except BaseException as e:
             print(e)
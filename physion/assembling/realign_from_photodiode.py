@@ -1,8 +1,11 @@
 import numpy as np
-import os
+import os, sys
 from scipy.signal import argrelextrema
 from scipy.ndimage.filters import gaussian_filter1d
 
+SMOOTHING_TIME = 20e-3 # smoothing of the photodiode signal for the onset detection
+ADVANCE_TIME = 15e-3 # the onset is set this time before the threshold crossing of the smoothed signal
+
 def realign_from_photodiode(signal,
                             metadata,
                             sampling_rate=None,
@@ -42,7 +45,9 @@ def realign_from_photodiode(signal,
     # looping over episodes
     i=0
     while (i<Nepisodes) and (tstart<(t[-1]-metadata['time_duration'][i])):
-        cond = (t>=tstart-1) & (t<=tstart+metadata['time_duration'][i])
+        # episode window: t>=tstart-1 and t<=tstart+duration (binary search, "t" is sorted)
+        cond = slice(np.searchsorted(t, tstart-1, side='left'),
+                     np.searchsorted(t, tstart+metadata['time_duration'][i], side='right'))
         try:
             tshift, integral, threshold = find_onset_time(t[cond]-tstart, signal[cond],
                                                           baseline=baseline, high_level=high_level)
@@ -88,8 +93,8 @@ def realign_from_photodiode(signal,
 
 
 def find_onset_time(t, photodiode_signal,
-                    smoothing_time = 20e-3,
-                    advance_time = 15e-3,
+                    smoothing_time = SMOOTHING_TIME,
+                    advance_time = ADVANCE_TIME,
                     baseline=0, high_level=1):
     """
     the threshold of integral increase corresponds to spending X-ms at half the maximum
@@ -105,18 +110,53 @@ def normalize_signal(x):
     norm, xmin = 1./(np.max(x)-np.min(x)), np.min(x)
     return norm*(x-xmin), norm, xmin
 
+def synthetic_session(Nepisodes,
+                      sampling_rate=1e3,
+                      duration=1., interstim=1.,
+                      jitter=50e-3, noise=0.05, seed=0):
+    """
+    photodiode signal and metadata of a fake session (with jittered onsets), for benchmarking
+    """
+    rng = np.random.default_rng(seed)
+    time_start = 1.+np.arange(Nepisodes)*(duration+interstim)
+    onsets = time_start+rng.uniform(0, jitter, Nepisodes)
+    t = np.arange(int((time_start[-1]+duration+interstim+1.)*sampling_rate))/sampling_rate
+    signal = rng.standard_normal(len(t))*noise
+    i1 = np.searchsorted(t, onsets)
+    i2 = np.searchsorted(t, onsets+duration)
+    pulses = np.zeros(len(t)+1)
+    np.add.at(pulses, i1, 1)
+    np.add.at(pulses, i2, -1)
+    signal += np.cumsum(pulses)[:-1]
+    metadata = {'time_start':time_start, 'time_stop':time_start+duration,
+                'time_duration':duration*np.ones(Nepisodes),
+                'presentation-prestim-period':0.}
+    return signal, metadata, onsets
+
+
 if __name__=='__main__':
 
     import matplotlib.pylab as plt
 
-    import argparse, os
+    import argparse, os, time
     parser=argparse.ArgumentParser(description="""
     Realigning from Photodiod
     """,formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('-df', "--datafolder", type=str, default='')
     parser.add_argument('-n', "--n_vis", type=int, default=5)
+    parser.add_argument("--benchmark", help="timing on synthetic sessions", action="store_true")
     args = parser.parse_args()
 
+    if args.benchmark:
+        for Nepisodes in [100, 1000, 10000]:
+            signal, metadata, onsets = synthetic_session(Nepisodes)
+            tstart = time.time()
+            success, metadata = realign_from_photodiode(signal, metadata, sampling_rate=1e3, verbose=False)
+            print(' - %i episodes (%.1e samples): %.2fs, success=%s, max. onset error: %.1fms' % (\
+                Nepisodes, len(signal), time.time()-tstart, success,
+                1e3*np.max(np.abs(metadata['time_start_realigned']+ADVANCE_TIME-onsets[:len(metadata['time_start_realigned'])]))))
+        sys.exit()
+
     data = np.load(os.path.join(args.datafolder, 'NIdaq.npy'), allow_pickle=True).item()['analog'][0]
     metadata = np.load(os.path.join(args.datafolder, 'metadata.npy'), allow_pickle=True).item()
     VisualStim = np.load(os.path.join(args.datafolder, 'visual-stim.npy'), allow_pickle=True).item()
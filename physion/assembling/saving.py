@@ -1,4 +1,4 @@
-import datetime, os, string, pathlib, json, tempfile
+import datetime, os, string, pathlib, json, tempfile, functools
 import numpy as np
 
 def day_folder(root_folder):
@@ -114,8 +114,8 @@ def insure_ordered_frame_names(df):
                           os.path.join(df,'screen-frames', fn.replace('frame', 'frame'+'0'*(nmax-n0))))
 
 def insure_ordered_FaceCamera_picture_names(df):
-    # insuring nice order of screen frames
-    filenames = os.listdir(os.path.join(df,'FaceCamera-imgs'))
+    # insuring nice order of screen frames (one-file-per-frame layout, the chunks are left untouched)
+    filenames = [fn for fn in os.listdir(os.path.join(df,'FaceCamera-imgs')) if fn.endswith('.npy')]
     if len(filenames)>0:
         nmax = np.max(np.array([len(fn) for fn in filenames]))
         for fn in filenames:
@@ -125,6 +125,47 @@ def insure_ordered_FaceCamera_picture_names(df):
                           os.path.join(df,'FaceCamera-imgs','0'*(nmax-n0)+fn))
                 
 
+def is_FaceCamera_chunk(fn):
+    return fn.startswith('chunk-') and fn.endswith('.npz')
+
+
+def FaceCamera_frames(imgfolder):
+    """
+    time-sorted (times, FILES) of the frames of a "FaceCamera-imgs" folder
+
+    the frames are either one "<timestamp>.npy" file per frame or stored by chunks
+    ("chunk-XXXXXX.npz", see hardware_control/FLIRcamera/recording.py), in which case
+    the reference is "chunk-XXXXXX.npz:<frame index in the chunk>"
+
+    the frames are read with "load_FaceCamera_frame", the folder is never modified
+    """
+    times, FILES = [], []
+    for fn in os.listdir(imgfolder):
+        if fn.endswith('.npy'):
+            times.append(float(fn.replace('.npy', '')))
+            FILES.append(fn)
+        elif is_FaceCamera_chunk(fn):
+            chunk_times = np.load(os.path.join(imgfolder, fn))['times'] # only this member is read
+            times += list(chunk_times)
+            FILES += ['%s:%i' % (fn, i) for i in range(len(chunk_times))]
+    isorted = np.argsort(times)
+    return np.array(times, dtype=np.float64)[isorted], np.array(FILES)[isorted]
+
+
+@functools.lru_cache(maxsize=2)
+def load_FaceCamera_chunk(filename):
+    """ the last chunks are kept in memory, frames are read in sequence in general """
+    return np.load(filename)['imgs']
+
+
+def load_FaceCamera_frame(imgfolder, FILE):
+    """ frame from its reference in "FILES" (see "FaceCamera_frames") """
+    if ':' in FILE:
+        fn, index = FILE.split(':')
+        return load_FaceCamera_chunk(os.path.join(imgfolder, fn))[int(index)]
+    return np.load(os.path.join(imgfolder, FILE))
+
+
 def from_folder_to_datetime(folder):
 
     s = folder.split(os.path.sep)[-2:]
@@ -210,8 +251,8 @@ def check_datafolder(df,
             metadata['VisualStim'] = False
 
         if metadata['FaceCamera'] and os.path.isdir(os.path.join(df,'FaceCamera-imgs')):
-            # insuring nice order of FaceCamera images
-            filenames = os.listdir(os.path.join(df,'FaceCamera-imgs'))
+            # insuring nice order of FaceCamera images (one-file-per-frame layout, the chunks are left untouched)
+            filenames = [fn for fn in os.listdir(os.path.join(df,'FaceCamera-imgs')) if fn.endswith('.npy')]
             if len(filenames)>0:
                 nmax = np.max(np.array([len(fn) for fn in filenames]))
                 for fn in filenames:
@@ -0,0 +1,277 @@
+import os, sys, pathlib, datetime, tempfile, shutil
+import numpy as np
+from scipy.ndimage import gaussian_filter1d
+from scipy.signal import lfilter
+
+import pynwb
+from dateutil.tz import tzlocal
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+from assembling.IO.suite2p_to_nwb import add_ophys_processing_from_suite2p
+
+SYNTHETIC_MODALITIES = ['VisualStim', 'Locomotion', 'Pupil', 'FaceMotion', 'processed_CaImaging']
+
+# the stimulation protocol of the synthetic sessions (see exp/protocols/Pakan-et-al-static.json)
+PROTOCOL = {'protocol':'Pakan-et-al-static',
+            'Presentation':'Randomized-Sequence',
+            'Stimulus':'full-field-grating',
+            'Screen':'Dell-2020',
+            'presentation-prestim-period':4.,
+            'presentation-poststim-period':4.,
+            'presentation-prestim-screen':0,
+            'presentation-poststim-screen':0,
+            'presentation-interstim-screen':0,
+            'starting-index':0,
+            'shuffling-seed':1,
+            'angle-1':0., 'angle-2':135., 'N-angle':4,
+            'spatial-freq-1':0.03, 'spatial-freq-2':0.03, 'N-spatial-freq':0,
+            'contrast-1':0.98, 'contrast-2':0.98, 'N-contrast':0}
+
+
+def synthetic_stimulation(duration, Nepisodes):
+    """
+    the "Randomized-Sequence" of gratings fitting "Nepisodes" in the session "duration"
+    (same sequence than "init_experiment" in visual_stim/psychopy_code/stimuli.py)
+    """
+    metadata = dict(PROTOCOL)
+    period = (duration-metadata['presentation-prestim-period']-metadata['presentation-poststim-period'])/Nepisodes
+    metadata['presentation-duration'] = period/2.
+    metadata['presentation-interstim-period'] = period/2.
+    metadata['N-repeat'] = int(np.ceil(Nepisodes/metadata['N-angle']))
+
+    angles = np.linspace(metadata['angle-1'], metadata['angle-2'], metadata['N-angle'])
+    index_no_repeat = np.arange(metadata['N-angle'])
+    np.random.seed(metadata['shuffling-seed'])
+    np.random.shuffle(index_no_repeat)
+    index = np.concatenate([index_no_repeat for r in range(metadata['N-repeat'])])[:Nepisodes]
+
+    time_start = metadata['presentation-prestim-period']+np.arange(Nepisodes)*period
+    VisualStim = {'index':index,
+                  'angle':angles[index],
+                  'spatial-freq':metadata['spatial-freq-2']*np.ones(Nepisodes),
+                  'contrast':metadata['contrast-2']*np.ones(Nepisodes),
+                  'time_start':time_start,
+                  'time_stop':time_start+metadata['presentation-duration'],
+                  'time_duration':metadata['presentation-duration']*np.ones(Nepisodes),
+                  'interstim':metadata['presentation-interstim-period']*np.ones(Nepisodes),
+                  'frame_run_type':np.array(['static' for i in range(Nepisodes)])}
+    return metadata, VisualStim
+
+
+def smooth_noise(N, smoothing, mean=0., std=1.):
+    """ gaussian noise low-pass filtered over "smoothing" samples """
+    x = gaussian_filter1d(np.random.randn(N), smoothing)
+    return mean+std*x/x.std()
+
+
+def write_synthetic_suite2p(folder, CaImaging_timestamps, VisualStim,
+                            Nrois=100, Ly=256, Lx=256, roi_radius=5,
+                            block_size=100):
+    """
+    a fake suite2p output ("plane0" folder with ops/stat/iscell/F/Fneu/spks)
+
+    the ROIs fire Poisson spikes, with an orientation-tuned increase of the rate during the stimuli,
+    the traces are generated and written by blocks of "block_size" ROIs (no full copy in memory)
+    """
+    plane_folder = os.path.join(folder, 'plane0')
+    pathlib.Path(plane_folder).mkdir(parents=True, exist_ok=True)
+    dt = CaImaging_timestamps[1]-CaImaging_timestamps[0]
+    T = len(CaImaging_timestamps)
+
+    # masks
+    y, x = np.meshgrid(np.arange(-roi_radius, roi_radius+1), np.arange(-roi_radius, roi_radius+1), indexing='ij')
+    disk = (x**2+y**2)<=roi_radius**2
+    centers = np.random.randint(roi_radius, min([Ly, Lx])-roi_radius, size=(Nrois, 2))
+    stat, meanImg = [], np.zeros((Ly, Lx), dtype=np.float32)
+    for cy, cx in centers:
+        ypix, xpix = (cy+y[disk]).astype(np.int32), (cx+x[disk]).astype(np.int32)
+        stat.append({'ypix':ypix, 'xpix':xpix, 'npix':len(ypix),
+                     'lam':np.ones(len(ypix), dtype=np.float32)/len(ypix), 'med':[cy, cx]})
+        meanImg[ypix, xpix] += 1.
+    meanImg += 0.2*np.random.rand(Ly, Lx).astype(np.float32)
+    np.save(os.path.join(plane_folder, 'stat.npy'), np.array(stat, dtype=object), allow_pickle=True)
+    np.save(os.path.join(plane_folder, 'iscell.npy'), np.array([np.ones(Nrois), np.ones(Nrois)]).T)
+    np.save(os.path.join(plane_folder, 'ops.npy'),
+            {'fs':1./dt, 'nplanes':1, 'nchannels':1, 'Ly':Ly, 'Lx':Lx,
+             'xrange':[0, Lx], 'yrange':[0, Ly],
+             'meanImg':meanImg, 'meanImgE':meanImg/meanImg.max(),
+             'Vcorr':meanImg/meanImg.max(), 'max_proj':meanImg}, allow_pickle=True)
+
+    # stimulus-evoked rate increase, per orientation
+    angles = np.unique(VisualStim['angle'])
+    stim_index = np.zeros(T, dtype=int) # 0: no stim, i+1: angle[i]
+    i1 = np.searchsorted(CaImaging_timestamps, VisualStim['time_start_realigned'])
+    i2 = np.searchsorted(CaImaging_timestamps, VisualStim['time_stop_realigned'])
+    for a, ia in zip(VisualStim['angle'], range(len(i1))):
+        stim_index[i1[ia]:i2[ia]] = 1+np.flatnonzero(angles==a)[0]
+
+    F = np.lib.format.open_memmap(os.path.join(plane_folder, 'F.npy'), mode='w+', dtype=np.float32, shape=(Nrois, T))
+    Fneu = np.lib.format.open_memmap(os.path.join(plane_folder, 'Fneu.npy'), mode='w+', dtype=np.float32, shape=(Nrois, T))
+    spks = np.lib.format.open_memmap(os.path.join(plane_folder, 'spks.npy'), mode='w+', dtype=np.float32, shape=(Nrois, T))
+    decay = np.exp(-dt/1.) # 1s calcium decay
+    for r1 in range(0, Nrois, block_size):
+        r2 = min([r1+block_size, Nrois])
+        # orientation tuning (with a fraction of non-responsive ROIs)
+        gain = 2.*(np.random.rand(r2-r1)>0.3)*np.random.rand(r2-r1)
+        tuning = np.exp(np.cos(np.pi/180.*2*(angles[np.newaxis,:]-\
+                               np.random.choice(angles, r2-r1)[:,np.newaxis]))-1)
+        rates = 0.5*np.ones((r2-r1, T))
+        rates[:, stim_index>0] += gain[:,np.newaxis]*tuning[:, stim_index[stim_index>0]-1]
+        spikes = np.random.poisson(rates*dt).astype(np.float32)
+        calcium = lfilter([1.], [1., -decay], spikes, axis=-1)
+        neuropil = 200.*(1+0.1*np.random.randn(r2-r1, T))
+        F[r1:r2,:] = 300.+0.7*neuropil+100.*calcium+10.*np.random.randn(r2-r1, T)
+        Fneu[r1:r2,:] = neuropil
+        spks[r1:r2,:] = spikes
+    for array in [F, Fneu, spks]:
+        array.flush()
+    del F, Fneu, spks
+
+
+def build_synthetic_NWB(filename,
+                        duration=600.,
+                        Nrois=100,
+                        Nepisodes=100,
+                        modalities=SYNTHETIC_MODALITIES,
+                        CaImaging_freq=30.,
+                        running_sampling=50.,
+                        photodiode_sampling=1000.,
+                        FaceCamera_freq=20.,
+                        seed=0,
+                        verbose=False):
+    """
+    writes a synthetic NWB session with the layout of "build_NWB.py",
+    of "duration" seconds with "Nrois" ROIs and "Nepisodes" grating episodes,
+
+    modalities in: 'VisualStim', 'Locomotion', 'Pupil', 'FaceMotion', 'processed_CaImaging'
+    (the ophys data go through "add_ophys_processing_from_suite2p" with a fake suite2p output)
+
+    -> for benchmarking (see analysis/benchmark.py)
+    """
+    tstart = datetime.datetime.now()
+
+    metadata, VisualStim = synthetic_stimulation(duration, Nepisodes)
+    np.random.seed(seed) # after the shuffling of the protocol sequence
+    metadata.update({'subject_ID':'synthetic', 'notes':'synthetic session (duration=%.0fs, Nrois=%i, Nepisodes=%i)' % (duration, Nrois, Nepisodes),
+                     'experimenter':'Unknown', 'lab':'Unknown', 'institution':'Unknown',
+                     'subject_props':{'subject_id':'synthetic', 'species':'Unknown', 'sex':'Unknown',
+                                      'genotype':'Unknown', 'description':'synthetic session', 'date_of_birth':'1988_4_24'},
+                     'VisualStim':('VisualStim' in modalities), 'Locomotion':('Locomotion' in modalities),
+                     'FaceCamera':(('Pupil' in modalities) or ('FaceMotion' in modalities)),
+                     'CaImaging':('processed_CaImaging' in modalities),
+                     'NIdaq-acquisition-frequency':photodiode_sampling})
+    # realigned times: onsets delayed by a small jitter
+    VisualStim['time_start_realigned'] = VisualStim['time_start']+np.random.uniform(0, 50e-3, Nepisodes)
+    VisualStim['time_stop_realigned'] = VisualStim['time_start_realigned']+VisualStim['time_duration']
+
+    nwbfile = pynwb.NWBFile(identifier='synthetic-%s' % tstart.strftime('%Y_%m_%d-%H-%M-%S'),
+                            session_description=str(metadata),
+                            experiment_description=metadata['protocol'],
+                            experimenter=metadata['experimenter'],
+                            lab=metadata['lab'],
+                            institution=metadata['institution'],
+                            notes=metadata['notes'],
+                            session_start_time=tstart.replace(tzinfo=tzlocal()),
+                            subject=pynwb.file.Subject(description='synthetic session', subject_id='synthetic',
+                                                       species='Unknown', sex='Unknown', genotype='Unknown',
+                                                       date_of_birth=datetime.datetime(1988,4,24,tzinfo=tzlocal())),
+                            file_create_date=datetime.datetime.utcnow().replace(tzinfo=tzlocal()))
+
+    if 'Locomotion' in modalities:
+        speed = np.clip(smooth_noise(int(duration*running_sampling), 2.*running_sampling, mean=0., std=3.), 0, None)
+        nwbfile.add_acquisition(pynwb.TimeSeries(name='Running-Speed', data=speed,
+                                                 starting_time=0., unit='cm/s', rate=running_sampling))
+
+    if 'VisualStim' in modalities:
+        t = np.arange(int(duration*photodiode_sampling))/photodiode_sampling
+        pulses = np.zeros(len(t)+1)
+        np.add.at(pulses, np.searchsorted(t, VisualStim['time_start_realigned']), 1)
+        np.add.at(pulses, np.searchsorted(t, VisualStim['time_stop_realigned']), -1)
+        Psignal = np.cumsum(pulses)[:-1]+0.05*np.random.randn(len(t))
+        nwbfile.add_acquisition(pynwb.TimeSeries(name='Photodiode-Signal', data=Psignal,
+                                                 starting_time=0., unit='[current]', rate=photodiode_sampling))
+        timestamps = VisualStim['time_start_realigned']
+        for key in VisualStim:
+            nwbfile.add_stimulus(pynwb.TimeSeries(name=key, data=VisualStim[key],
+                                                  unit=('seconds' if 'realigned' in key else 'NA'),
+                                                  timestamps=timestamps))
+
+    FC_times = np.arange(int(duration*FaceCamera_freq))/FaceCamera_freq
+    if 'Pupil' in modalities:
+        pupil_module = nwbfile.create_processing_module(name='Pupil',
+                description='processed quantities of Pupil dynamics,\n'+\
+                            ' pupil ROI: (xmin,xmax,ymin,ymax)=(0,100,0,100)\n pix_to_mm=0.100')
+        for key, mean, std in zip(['cx', 'cy', 'sx', 'sy', 'angle'], [5., 5., 1., 1., 0.], [0.2, 0.2, 0.2, 0.2, 0.1]):
+            pupil_module.add(pynwb.TimeSeries(name=key, data=smooth_noise(len(FC_times), FaceCamera_freq, mean=mean, std=std),
+                                              unit='seconds', timestamps=FC_times))
+        pupil_module.add(pynwb.TimeSeries(name='blinking', data=np.zeros(len(FC_times)),
+                                          unit='seconds', timestamps=FC_times))
+
+    if 'FaceMotion' in modalities:
+        faceMotion_module = nwbfile.create_processing_module(name='FaceMotion',
+                description='face motion dynamics,\n facemotion ROI: (x0,dx,y0,dy)=(0,100,0,100)\n')
+        faceMotion_module.add(pynwb.TimeSeries(name='face-motion',
+                                               data=np.abs(smooth_noise(len(FC_times), FaceCamera_freq/2., mean=0., std=1.)),
+                                               unit='seconds', timestamps=FC_times))
+
+    suite2p_folder = None
+    if 'processed_CaImaging' in modalities:
+        if verbose:
+            print('=> generating the Ca-Imaging data of %i ROIs [...]' % Nrois)
+        suite2p_folder = tempfile.mkdtemp()
+        CaImaging_timestamps = np.arange(int(duration*CaImaging_freq))/CaImaging_freq+0.5/CaImaging_freq
+        write_synthetic_suite2p(suite2p_folder, CaImaging_timestamps, VisualStim, Nrois=Nrois)
+        # same devices and (placeholder) imaging series than "add_ophys" without raw data
+        device = pynwb.ophys.Device('Imaging device (synthetic)')
+        nwbfile.add_device(device)
+        optical_channel = pynwb.ophys.OpticalChannel('excitation_channel 1', 'Excitation 1', 920.)
+        imaging_plane = nwbfile.create_imaging_plane('my_imgpln', optical_channel,
+                                                     description='Depth=0.0[um]',
+                                                     device=device,
+                                                     excitation_lambda=920.,
+                                                     imaging_rate=CaImaging_freq,
+                                                     indicator='GCamp',
+                                                     location='V1',
+                                                     grid_spacing=(1., 1.))
+        image_series = pynwb.ophys.TwoPhotonSeries(name='CaImaging-TimeSeries',
+                                                   dimension=[2],
+                                                   data = np.ones((2,2,2)),
+                                                   imaging_plane=imaging_plane,
+                                                   unit='s',
+                                                   timestamps = 1.*np.arange(2))
+        nwbfile.add_acquisition(image_series)
+        add_ophys_processing_from_suite2p(suite2p_folder, nwbfile, CaImaging_timestamps,
+                                          device=device,
+                                          optical_channel=optical_channel,
+                                          imaging_plane=imaging_plane,
+                                          image_series=image_series)
+
+    if verbose:
+        print('=> writing "%s" [...]' % filename)
+    io = pynwb.NWBHDF5IO(filename, mode='w')
+    io.write(nwbfile)
+    io.close()
+
+    if suite2p_folder is not None:
+        shutil.rmtree(suite2p_folder)
+    return filename
+
+
+if __name__=='__main__':
+
+    import argparse, time
+    parser=argparse.ArgumentParser(description="""
+    Building a synthetic NWB session (for benchmarking)
+    """,formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-f', "--filename", type=str, default=os.path.join(tempfile.gettempdir(), 'synthetic.nwb'))
+    parser.add_argument('-d', "--duration", type=float, default=600., help='session duration (s)')
+    parser.add_argument('-nr', "--Nrois", type=int, default=100)
+    parser.add_argument('-ne', "--Nepisodes", type=int, default=100)
+    parser.add_argument('-m', "--modalities", nargs='*', type=str, default=SYNTHETIC_MODALITIES)
+    parser.add_argument('-s', "--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    tstart = time.time()
+    build_synthetic_NWB(args.filename, duration=args.duration, Nrois=args.Nrois, Nepisodes=args.Nepisodes,
+                        modalities=args.modalities, seed=args.seed, verbose=True)
+    print('[ok] "%s" written in %.1fs (%.1fMB)' % (args.filename, time.time()-tstart, os.path.getsize(args.filename)/1e6))
@@ -3,7 +3,7 @@ import numpy as np
 
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
 from physion.assembling.IO.bruker_xml_parser import bruker_xml_parser
-from physion.assembling.saving import get_files_with_extension, get_TSeries_folders
+from physion.assembling.saving import get_files_with_extension, get_TSeries_folders, FaceCamera_frames, load_FaceCamera_frame
 from physion.analysis.read_NWB import read as read_NWB
 
 def build_subsampling_from_freq(subsampled_freq=1.,
@@ -26,14 +26,14 @@ def build_subsampling_from_freq(subsampled_freq=1.,
 
 
 def load_FaceCamera_data(imgfolder, t0=0, verbose=True):
-
-    file_list = [f for f in os.listdir(imgfolder) if f.endswith('.npy')]
-    _times = np.array([float(f.replace('.npy', '')) for f in file_list])
-    _isorted = np.argsort(_times)
-    times = _times[_isorted]-t0
-    FILES = np.array(file_list)[_isorted]
+    """
+    frames are read with "load_FaceCamera_frame(imgfolder, FILES[i])"
+    (one-file-per-frame or chunked layout, see "assembling.saving.FaceCamera_frames")
+    """
+    _times, FILES = FaceCamera_frames(imgfolder)
+    times = _times-t0
     nframes = len(times)
-    Lx, Ly = np.load(os.path.join(imgfolder, FILES[0])).shape
+    Lx, Ly = load_FaceCamera_frame(imgfolder, FILES[0]).shape
     if verbose:
         print('Sampling frequency: %.1f Hz  (datafile: %s)' % (1./np.diff(times).mean(), imgfolder))
     return times, FILES, nframes, Lx, Ly
@@ -73,15 +73,15 @@ def build_Ca_filelist(folder):
     for bdf in get_TSeries_folders(folder):
         fn = get_files_with_extension(bdf, extension='.xml')[0]
         try:
-            xml = bruker_xml_parser(fn)
-            if len(xml['Ch1']['relativeTime'])>0:
+            xml = bruker_xml_parser(fn, header_only=True) # no need to walk the frames
+            if xml['FirstFrameTime'] is not None:
                 CA_FILES['date'].append(stringdatetime_to_date(xml['date']))
                 CA_FILES['Bruker_folder'].append(bdf)
                 CA_FILES['Bruker_file'].append(fn)
                 CA_FILES['StartTimeString'].append(xml['StartTime'])
                 start = StartTime_to_day_seconds(xml['StartTime'])
-                CA_FILES['StartTime'].append(start+xml['Ch1']['absoluteTime'][0])
-                CA_FILES['EndTime'].append(start+xml['Ch1']['absoluteTime'][-1])
+                CA_FILES['StartTime'].append(start+xml['FirstFrameTime'])
+                CA_FILES['EndTime'].append(start+xml['LastFrameTime'])
                 CA_FILES['protocol'].append('')
         except BaseException as e:
             print(e)
@@ -9,7 +9,7 @@ from dataviz import plots
 from analysis.trial_averaging import TrialAverageWindow
 from analysis.make_figures import FiguresWindow
 from analysis.behavioral_modulation import BehavioralModWindow
-from analysis.read_NWB import read as read_NWB
+from analysis.read_NWB import read as read_NWB, NWBIndex
 from misc.folders import FOLDERS
 from misc import guiparts
 from visual_stim.psychopy_code.stimuli import build_stim # we'll load it without psychopy
@@ -189,6 +189,7 @@ class MainWindow(guiparts.NewWindow):
         self.CaImaging_key = 'Fluorescence'
 
         self.FILES_PER_DAY, self.FILES_PER_SUBJECT, self.SUBJECTS = {}, {}, {}
+        self.NWB_index = NWBIndex() # persistent index of the NWB files properties
         
         self.minView = False
         self.showwindow()
@@ -332,11 +333,9 @@ class MainWindow(guiparts.NewWindow):
         FILES = get_files_with_extension(FOLDERS[self.fbox.currentText()],
                                          extension='.nwb', recursive=True)
 
-        SUBJECTS, DISPLAY_NAMES = [], []
-        for fn in FILES:
-            infos = self.preload_datafolder(fn)
-            SUBJECTS.append(infos['subject'])
-            DISPLAY_NAMES.append(infos['display_name'])
+        entries = self.NWB_index.get_entries(FILES) # only new/modified files are opened
+        SUBJECTS = [e['subject_description'] for e in entries]
+        DISPLAY_NAMES = [e['display_name'] for e in entries]
 
         self.SUBJECTS = {}
         for s in np.unique(SUBJECTS):
@@ -393,15 +392,14 @@ class MainWindow(guiparts.NewWindow):
         self.pCaimg.setImage(np.ones((50,50))*100)
         if len(self.list_protocol)>0:
             self.dbox.addItem(' ...' +70*' '+'(select a data-folder) ')
-            for fn in self.list_protocol:
-                self.dbox.addItem(self.preload_datafolder(fn)['display_name'])
+            for entry in self.NWB_index.get_entries(self.list_protocol):
+                self.dbox.addItem(entry['display_name'])
                 
     def preload_datafolder(self, fn):
-        read_NWB(self, fn, metadata_only=True)
-        infos = {'display_name' : self.df_name,
-                 'subject': self.nwbfile.subject.description}
-        self.io.close()
-        return infos
+        entry = self.NWB_index.get(fn)
+        self.NWB_index.save()
+        return {'display_name':entry['display_name'],
+                'subject':entry['subject_description']}
 
     def add_datafolder_annotation(self):
         info = 20*'-'+'\n'
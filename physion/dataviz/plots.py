@@ -58,7 +58,7 @@ def raw_data_plot(self, tzoom,
         
         if hasattr(self, 'FaceCameraFrameLevel'):
             self.plot.removeItem(self.FaceCameraFrameLevel)
-        self.FaceCameraFrameLevel = self.plot.plot(self.nwbfile.acquisition['FaceCamera'].timestamps[i0]*np.ones(2),
+        self.FaceCameraFrameLevel = self.plot.plot(get_timestamps(self.nwbfile.acquisition['FaceCamera'])[0][i0]*np.ones(2),
                                                    [0, y.max()], pen=pg.mkPen(color=self.settings['colors']['FaceMotion']), linewidth=0.5)
 
     if 'FaceMotion' in self.nwbfile.acquisition:
@@ -67,9 +67,9 @@ def raw_data_plot(self, tzoom,
         self.pFacemotionimg.setImage(self.nwbfile.acquisition['FaceMotion'].data[i0])
         if hasattr(self, 'FacemotionFrameLevel'):
             self.plot.removeItem(self.FacemotionFrameLevel)
-        self.FacemotionFrameLevel = self.plot.plot(self.nwbfile.acquisition['FaceMotion'].timestamps[i0]*np.ones(2),
+        self.FacemotionFrameLevel = self.plot.plot(get_timestamps(self.nwbfile.acquisition['FaceMotion'])[0][i0]*np.ones(2),
                                                    [0, y.max()], pen=pg.mkPen(color=self.settings['colors']['FaceMotion']), linewidth=0.5)
-        t_facemotion_frame = self.nwbfile.acquisition['FaceMotion'].timestamps[i0]
+        t_facemotion_frame = get_timestamps(self.nwbfile.acquisition['FaceMotion'])[0][i0]
         
     else:
         t_facemotion_frame = None
@@ -78,7 +78,7 @@ def raw_data_plot(self, tzoom,
 
         i1, i2 = convert_times_to_indices(*self.tzoom, self.nwbfile.processing['FaceMotion'].data_interfaces['face-motion'])
 
-        t = self.nwbfile.processing['FaceMotion'].data_interfaces['face-motion'].timestamps[i1:i2]
+        t = get_timestamps(self.nwbfile.processing['FaceMotion'].data_interfaces['face-motion'])[0][i1:i2]
         
         y = scale_and_position(self, self.nwbfile.processing['FaceMotion'].data_interfaces['face-motion'].data[i1:i2],
                                i=iplot)
@@ -96,9 +96,9 @@ def raw_data_plot(self, tzoom,
         self.pPupilimg.setImage(255*(1-np.exp(-img/0.2)))
         if hasattr(self, 'PupilFrameLevel'):
             self.plot.removeItem(self.PupilFrameLevel)
-        self.PupilFrameLevel = self.plot.plot(self.nwbfile.acquisition['Pupil'].timestamps[i0]*np.ones(2),
+        self.PupilFrameLevel = self.plot.plot(get_timestamps(self.nwbfile.acquisition['Pupil'])[0][i0]*np.ones(2),
                                               [0, y.max()], pen=pg.mkPen(color=self.settings['colors']['Pupil']), linewidth=0.5)
-        t_pupil_frame = self.nwbfile.acquisition['Pupil'].timestamps[i0]
+        t_pupil_frame = get_timestamps(self.nwbfile.acquisition['Pupil'])[0][i0]
     else:
         t_pupil_frame = None
         
@@ -106,7 +106,7 @@ def raw_data_plot(self, tzoom,
 
         i1, i2 = convert_times_to_indices(*self.tzoom, self.nwbfile.processing['Pupil'].data_interfaces['cx'])
 
-        t = self.nwbfile.processing['Pupil'].data_interfaces['sx'].timestamps[i1:i2]
+        t = get_timestamps(self.nwbfile.processing['Pupil'].data_interfaces['sx'])[0][i1:i2]
         
         y = scale_and_position(self,
                                np.max([self.nwbfile.processing['Pupil'].data_interfaces['sx'].data[i1:i2],
@@ -194,7 +194,7 @@ def raw_data_plot(self, tzoom,
         # self.pCaimg.setImage(self.nwbfile.acquisition['CaImaging-TimeSeries'].data[i0,:,:]) # REMOVE NOW, MAYBE REINTRODUCE
         if hasattr(self, 'CaFrameLevel'):
             self.plot.removeItem(self.CaFrameLevel)
-        self.CaFrameLevel = self.plot.plot(self.nwbfile.acquisition['CaImaging-TimeSeries'].timestamps[i0]*np.ones(2), [0, y.max()],
+        self.CaFrameLevel = self.plot.plot(get_timestamps(self.nwbfile.acquisition['CaImaging-TimeSeries'])[0][i0]*np.ones(2), [0, y.max()],
                                            pen=pg.mkPen(color=self.settings['colors']['CaImaging']), linewidth=0.5)
         
     if ('ophys' in self.nwbfile.processing) and with_roi:
@@ -221,7 +221,7 @@ def raw_data_plot(self, tzoom,
             isampling = np.arange(i1,i2)
         else:
             isampling = np.unique(np.linspace(i1, i2, self.settings['Npoints'], dtype=int))
-        tt = np.array(self.Neuropil.timestamps[:])[isampling]
+        tt = get_timestamps(self.Neuropil)[0][isampling]
 
         if self.roiPick.text()=='sum' or (len(self.roiIndices)==1):
             y = scale_and_position(self, compute_CaImaging_trace(self, self.CaImaging_key, self.roiIndices).sum(axis=0)[isampling], i=iplot) # valid ROIs inside
@@ -72,7 +72,7 @@ class MultimodalData(Data):
     def add_FaceMotion(self, tlim, ax,
                        fig_fraction_start=0., fig_fraction=1., subsampling=2, color=ge.purple, name='facemotion'):
         i1, i2 = convert_times_to_indices(*tlim, self.nwbfile.processing['FaceMotion'].data_interfaces['face-motion'])
-        t = self.nwbfile.processing['FaceMotion'].data_interfaces['face-motion'].timestamps[i1:i2]
+        t = get_timestamps(self.nwbfile.processing['FaceMotion'].data_interfaces['face-motion'])[0][i1:i2]
         motion = self.nwbfile.processing['FaceMotion'].data_interfaces['face-motion'].data[i1:i2]
         x, y = t[::subsampling], motion[::subsampling]
         scale_range = (y.max()-y.min())
@@ -86,7 +86,7 @@ class MultimodalData(Data):
                   Pbar = 0.5, # scale bar in mm
                   color='red', name='pupil diam.'):
         i1, i2 = convert_times_to_indices(*tlim, self.nwbfile.processing['Pupil'].data_interfaces['cx'])
-        t = self.nwbfile.processing['Pupil'].data_interfaces['sx'].timestamps[i1:i2]
+        t = get_timestamps(self.nwbfile.processing['Pupil'].data_interfaces['sx'])[0][i1:i2]
         diameter = 2*np.max([self.nwbfile.processing['Pupil'].data_interfaces['sx'].data[i1:i2],
                            self.nwbfile.processing['Pupil'].data_interfaces['sy'].data[i1:i2]], axis=0)
         x, y = t[::subsampling], diameter[::subsampling]
@@ -110,7 +110,7 @@ class MultimodalData(Data):
         dF = compute_CaImaging_trace(self, subquantity, roiIndices) # validROI indices inside !!
         i1 = convert_time_to_index(tlim[0], self.Neuropil, axis=1)
         i2 = convert_time_to_index(tlim[1], self.Neuropil, axis=1)
-        tt = np.array(self.Neuropil.timestamps[:])[np.arange(i1,i2)][::subsampling]
+        tt = get_timestamps(self.Neuropil)[0][np.arange(i1,i2)][::subsampling]
         if vicinity_factor>1:
             ymax_factor = fig_fraction*(1-1./vicinity_factor)
         else:
@@ -139,7 +139,7 @@ class MultimodalData(Data):
                          name='Sum [Ca]'):
         i1 = convert_time_to_index(tlim[0], self.Neuropil, axis=1)
         i2 = convert_time_to_index(tlim[1], self.Neuropil, axis=1)
-        tt = np.array(self.Neuropil.timestamps[:])[np.arange(i1,i2)][::subsampling]
+        tt = get_timestamps(self.Neuropil)[0][np.arange(i1,i2)][::subsampling]
         y = compute_CaImaging_trace(self, subquantity, np.arange(np.sum(self.iscell))).sum(axis=0)[np.arange(i1,i2)][::subsampling]
         ax.plot(tt, (y-y.min())/(y.max()-y.min())*fig_fraction+fig_fraction_start, color=color)
         ax.annotate(name, (tlim[0], fig_fraction/2.+fig_fraction_start), color=color,
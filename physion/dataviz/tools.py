@@ -1,3 +1,4 @@
+import weakref
 import numpy as np
 
 #########################
@@ -32,13 +33,35 @@ def shift(self, i):
     return self.settings['blank-space']*i+\
         np.sum(np.power(self.settings['increase-factor'], np.arange(i)))
 
+# timestamps of the NWB timeseries, read once per timeseries (and released with it)
+TIMESTAMPS = weakref.WeakKeyDictionary()
+
+def get_timestamps(nwb_quantity):
+    """
+    returns the (in-memory) timestamps of a NWB timeseries, and whether they are sorted
+    """
+    if nwb_quantity not in TIMESTAMPS:
+        timestamps = np.array(nwb_quantity.timestamps[:])
+        TIMESTAMPS[nwb_quantity] = (timestamps, bool(np.all(np.diff(timestamps)>=0)))
+    return TIMESTAMPS[nwb_quantity]
+
+def timestamps_range(t1, t2, nwb_quantity):
+    """
+    first and last index of the timestamps within [t1, t2] (empty range if i1>i2)
+    """
+    timestamps, is_sorted = get_timestamps(nwb_quantity)
+    if is_sorted:
+        # binary search
+        return np.searchsorted(timestamps, t1, side='left'),\
+            np.searchsorted(timestamps, t2, side='right')-1
+    else:
+        indices = np.flatnonzero((timestamps>=t1) & (timestamps<=t2))
+        return (indices[0], indices[-1]) if len(indices)>0 else (1, 0)
+
 def convert_time_to_index(time, nwb_quantity, axis=0):
     if nwb_quantity.timestamps is not None:
-        cond = nwb_quantity.timestamps[:]>=time
-        if np.sum(cond)>0:
-            return np.arange(nwb_quantity.timestamps.shape[0])[cond][0]
-        else:
-            return nwb_quantity.timestamps.shape[0]-1
+        i1, i2 = timestamps_range(time, np.inf, nwb_quantity)
+        return (i1 if (i2>=i1) else len(get_timestamps(nwb_quantity)[0])-1)
     elif nwb_quantity.starting_time is not None:
         t = time-nwb_quantity.starting_time
         dt = 1./nwb_quantity.rate
@@ -49,9 +72,9 @@ def convert_time_to_index(time, nwb_quantity, axis=0):
 
 def convert_times_to_indices(t1, t2, nwb_quantity, axis=0):
     if nwb_quantity.timestamps is not None:
-        cond = (nwb_quantity.timestamps[:]>=t1) & (nwb_quantity.timestamps[:]<=t2)
-        if np.sum(cond)>0:
-            return np.arange(nwb_quantity.timestamps.shape[0])[cond][np.array([0,-1])]
+        i1, i2 = timestamps_range(t1, t2, nwb_quantity)
+        if i2>=i1:
+            return np.array([i1, i2])
         else:
             return (0, nwb_quantity.timestamps.shape[axis]-1)
     elif nwb_quantity.starting_time is not None:
@@ -60,7 +83,7 @@ def convert_times_to_indices(t1, t2, nwb_quantity, axis=0):
         imax = nwb_quantity.data.shape[axis]-1 # maybe shift to -1 to handle images
         return (max([1, min([int(T1/dt), imax-1])]), max([1, min([int(T2/dt), imax-1])]))
     else:
-        return (0, imax)
+        return (0, nwb_quantity.data.shape[axis]-1)
 
 def extract_from_times(t1, t2, nwb_quantity, axis=0):
     
@@ -68,13 +91,15 @@ def extract_from_times(t1, t2, nwb_quantity, axis=0):
     
     if nwb_quantity.timestamps is not None:
         
-        cond = (nwb_quantity.timestamps[:]>=t1) & (nwb_quantity.timestamps[:]<=t2)
-        if np.sum(cond)>0:
-            indices = np.arange(nwb_quantity.timestamps.shape[axis])[cond]
-            times = nwb_quantity.timestamps[cond]
+        timestamps, is_sorted = get_timestamps(nwb_quantity)
+        if is_sorted:
+            i1, i2 = timestamps_range(t1, t2, nwb_quantity)
+            indices = np.arange(i1, i2+1)
         else:
-            ii, indices = np.argmin((nwb_quantity.timestamps[:]-t1)**2), [ii]
-            times = [nwb_quantity.timestamps[ii]]
+            indices = np.flatnonzero((timestamps>=t1) & (timestamps<=t2))
+        if len(indices)==0:
+            indices = [np.argmin((timestamps-t1)**2)]
+        times = timestamps[indices]
             
     elif nwb_quantity.starting_time is not None:
         
@@ -9,6 +9,7 @@ from misc.folders import FOLDERS, python_path
 from misc.style import set_dark_style, set_app_icon
 from misc.guiparts import NewWindow, Slider
 from assembling.tools import load_FaceCamera_data
+from assembling.saving import load_FaceCamera_frame
 from facemotion import roi, process
 
 class MainWindow(NewWindow):
@@ -327,8 +328,8 @@ class MainWindow(NewWindow):
 
         if self.FILES is not None:
             # full image 
-            self.fullimg = np.load(os.path.join(self.imgfolder,
-                                                self.FILES[self.cframe]))
+            self.fullimg = load_FaceCamera_frame(self.imgfolder,
+                                                 self.FILES[self.cframe])
             self.pimg.setImage(self.fullimg)
 
 
@@ -338,8 +339,8 @@ class MainWindow(NewWindow):
                 process.set_ROI_area(self)
 
                 if self.motionCheckBox.isChecked():
-                    self.fullimg2 = np.load(os.path.join(self.imgfolder,
-                                                         self.FILES[self.cframe+1]))
+                    self.fullimg2 = load_FaceCamera_frame(self.imgfolder,
+                                                          self.FILES[self.cframe+1])
                     
                     self.img = self.fullimg2[self.zoom_cond].reshape(self.Nx, self.Ny)-\
                         self.fullimg[self.zoom_cond].reshape(self.Nx, self.Ny)
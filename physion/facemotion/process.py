@@ -7,6 +7,7 @@ sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
 from misc.progressBar import printProgressBar
 from assembling.dataset import Dataset
 from assembling.tools import load_FaceCamera_data
+from assembling.saving import load_FaceCamera_frame
 from pupil.outliers import replace_outliers
 from pupil import roi
 
@@ -26,7 +27,7 @@ def set_ROI_area(cls,
     if roi_coords is not None:
 
         mx, my, sx, sy = roi_coords
-        fullimg = np.load(os.path.join(cls.imgfolder, cls.FILES[0]))
+        fullimg = load_FaceCamera_frame(cls.imgfolder, cls.FILES[0])
         
         cls.fullx, cls.fully = np.meshgrid(np.arange(fullimg.shape[0]),
                                              np.arange(fullimg.shape[1]),
@@ -53,6 +54,13 @@ def set_ROI_area(cls,
         print('need to provide coords or to create ROI !!')
 
 
+def load_ROI_frame(cls, frame):
+    """ ROI pixels (flattened) of a single frame """
+    fullimg = load_FaceCamera_frame(cls.imgfolder,
+                                    cls.FILES[frame])
+    return np.array(fullimg[cls.zoom_cond], dtype=float)
+
+
 def load_ROI_data(cls, iframe1=0, iframe2=100,
                   time_subsampling=1,
                   flatten=True):
@@ -63,24 +71,33 @@ def load_ROI_data(cls, iframe1=0, iframe2=100,
         DATA = np.zeros((iframe2-iframe1, cls.Nx, cls.Ny))
     
     for frame in np.arange(iframe1, iframe2):
-        fullimg = np.load(os.path.join(cls.imgfolder,
-                                       cls.FILES[frame]))
         if flatten:
-            DATA[frame-iframe1,:] = fullimg[cls.zoom_cond]
+            DATA[frame-iframe1,:] = load_ROI_frame(cls, frame)
             # spatial subsampling in zoom cond
         else:
-            DATA[frame-iframe1,:,:] = fullimg[cls.zoom_cond].reshape(cls.Nx, cls.Ny)
+            DATA[frame-iframe1,:,:] = load_ROI_frame(cls, frame).reshape(cls.Nx, cls.Ny)
     
     return DATA
     
 
+def stream_motion(cls, frames, Nframe_per_chunk=1000):
+    """
+    generator of the motion frames (differences between successive "frames"), by chunks
+
+    each frame is loaded only once, so that memory is bounded by "Nframe_per_chunk"
+    """
+    previous = load_ROI_frame(cls, frames[0])
+    for i1 in range(1, len(frames), Nframe_per_chunk):
+        imgs = np.array([load_ROI_frame(cls, frame) for frame in frames[i1:i1+Nframe_per_chunk]])
+        yield np.diff(np.concatenate([[previous], imgs]), axis=0)
+        previous = imgs[-1]
 
 
 def compute_motion(cls,
                    time_subsampling=5,
                    with_ProgressBar=False):
     """
-
+    motion energy between each sampled frame and the next one, in a single pass over the frames
     """
     frames = np.arange(cls.nframes)[::time_subsampling]
     motion = np.zeros(len(frames)-1)
@@ -88,14 +105,18 @@ def compute_motion(cls,
     if with_ProgressBar:
         printProgressBar(0, cls.nframes)
 
+    loaded = {} # ROI data by frame index, kept while a next pair can use it: each frame is loaded once, for any subsampling
     for i, frame in enumerate(frames[:-1]):
         try:
-            imgs = load_ROI_data(cls, frame, frame+2, flatten=True)
-            motion[i] = np.mean(np.diff(imgs,axis=0)**2)
+            for f in [frame, frame+1]:
+                if f not in loaded:
+                    loaded[f] = load_ROI_frame(cls, f)
+            motion[i] = np.mean((loaded[frame+1]-loaded[frame])**2)
         except ValueError:
             print('problem with frame #', frame)
             pass # TO BE REMOVED !!
-        
+        loaded = {f:img for f, img in loaded.items() if f>=frames[i+1]}
+
         if with_ProgressBar and (i%20==0):
             printProgressBar(frame, cls.nframes)
         
@@ -128,31 +149,47 @@ def compute_SVD(cls,
                 Nframe_per_chunk=1000,
                 spatial_subsampling=4,
                 time_subsampling=1,
-                nmin_pc=250):
+                nmin_pc=250,
+                n_components=100):
     """
-    IN PROGRESS
-    
     adapted from facemap:
     see: https://github.com/MouseLand/facemap
 
     compute the SVD over frames in chunks, combine the chunks and take a mega-SVD
 
+    the motion frames are streamed from disk, so that the memory use is bounded by
+    "Nframe_per_chunk" (and by the number of components kept), not by the recording length
+
     nmin_pc # <- how many PCs to keep in each chunk
 
+    returns U (temporal components), Sv, V (spatial components)
     """
-    Nframe_per_chunk = min(Nframe_per_chunk, cls.nframes)
-    nsegs = int(np.floor(cls.nframes / Nframe_per_chunk)+1)
-
-    n_PCs = min(nmin_pc, Nframe_per_chunk-1)
-    
-    nsegs = 1 # TROUBLESHOOTING
-    for n in range(nsegs):
-        i1 = n*Nframe_per_chunk
-        i2 = min(cls.nframes, (n+1)*Nframe_per_chunk)
-        motion = np.diff(load_ROI_data(cls, i1, i2,
-                                       flatten=True), axis=0)
-        avgMot = np.mean(motion, axis=0)
-        U, Sv, V = svdecon(motion-avgMot)
+    frames = np.arange(cls.nframes)[::time_subsampling]
+    Nmotion = len(frames)-1
+
+    # average motion (the sum of successive differences telescopes)
+    avgMot = (load_ROI_frame(cls, frames[-1])-load_ROI_frame(cls, frames[0]))/Nmotion
+
+    # 1) spatial components: SVD of each chunk, combined (and re-compressed) along the way
+    components = None
+    for motion in stream_motion(cls, frames, Nframe_per_chunk=Nframe_per_chunk):
+        if motion.shape[0]<2:
+            continue
+        _, Sv, V = svdecon(motion-avgMot, k=min([nmin_pc, min(motion.shape)-1]))
+        components = (V*Sv if components is None else np.concatenate([components, V*Sv], axis=1))
+        if components.shape[1]>4*nmin_pc:
+            U, Sv, _ = np.linalg.svd(components, full_matrices=False)
+            components = U[:,:nmin_pc]*Sv[:nmin_pc]
+
+    # mega-SVD
+    V, _, _ = np.linalg.svd(components, full_matrices=False)
+    V = V[:,:n_components]
+
+    # 2) temporal components: projection of the motion frames on the spatial components
+    U = np.concatenate([(motion-avgMot) @ V for motion in stream_motion(cls, frames,
+                                                                        Nframe_per_chunk=Nframe_per_chunk)])
+    Sv = np.sqrt((U**2).sum(axis=0)/Nmotion)
+    U = U/(U**2).sum(axis=0)**.5
 
     return U, Sv, V
         
@@ -1,5 +1,7 @@
 import imageio, os, sys, time, pathlib
 import numpy as np
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from assembling.saving import FaceCamera_frames, load_FaceCamera_frame
 
 def create_video_folder(data_folder):
     pathlib.Path(os.path.join(data_folder, 'FaceCamera-videos')).mkdir(parents=True, exist_ok=True)
@@ -19,19 +21,18 @@ def export_to_video(data_folder,
     times = np.load(os.path.join(data_folder, 'FaceCamera-times.npy'))
     t0 = np.load(os.path.join(data_folder, 'NIdaq.start.npy'))[0]
     
-    n, n0, nvideo = i0, 0, 0
+    n, n0, nvideo = i0, i0, 0
 
-    file_list = os.listdir(os.path.join(data_folder, 'FaceCamera-imgs'))
-    print(np.sort(file_list))
-    for i in range(i0, n_frame_max):
-        if os.path.isfile(os.path.join(data_folder, 'FaceCamera-imgs', '%i.npy' % i)):
-            n=i
-            if n>n0 and ((n-n0)%frames_per_video)==0:
-                print(os.path.join(data_folder, 'FaceCamera-videos', '%i-%i.%s' % (n0, n, video_format)), 'converted !')
-                imageio.mimwrite(os.path.join(data_folder, 'FaceCamera-videos', '%i-%i.%s' % (n0, n, video_format)), np.array(imgs))
-
-                imgs = []
-            imgs.append(np.load(os.path.join(data_folder, 'FaceCamera-imgs', '%i.npy' % i)))
+    # time-sorted frames, one file per frame or by chunks (see "assembling.saving.FaceCamera_frames")
+    imgfolder = os.path.join(data_folder, 'FaceCamera-imgs')
+    FILES = FaceCamera_frames(imgfolder)[1]
+    for i in range(i0, min([n_frame_max, len(FILES)])):
+        n=i
+        if n>n0 and ((n-n0)%frames_per_video)==0:
+            print(os.path.join(data_folder, 'FaceCamera-videos', '%i-%i.%s' % (n0, n, video_format)), 'converted !')
+            imageio.mimwrite(os.path.join(data_folder, 'FaceCamera-videos', '%i-%i.%s' % (n0, n, video_format)), np.array(imgs))
+            imgs, n0 = [], n
+        imgs.append(load_FaceCamera_frame(imgfolder, FILES[i]))
         
     imageio.mimwrite(os.path.join(data_folder, 'FaceCamera-videos', '%i-%i.%s' % (n0, n, video_format)), np.array(imgs))
     print(os.path.join(data_folder, 'FaceCamera-videos', '%i-%i.%s' % (n0, i, video_format)), 'converted !')
@@ -1,12 +1,17 @@
 """
 
 """
-import simple_pyspin, time, sys, os
+import time, sys, os, queue, threading
 from skimage.io import imsave
 import numpy as np
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parents[2]))
 from assembling.saving import last_datafolder_in_dayfolder, day_folder
+try:
+    import simple_pyspin
+except ModuleNotFoundError:
+    # only the synthetic camera can be used
+    simple_pyspin = None
 
 os.environ["KMP_DUPLICATE_LIB_OK"]="TRUE"
 desktop_png = os.path.join(os.path.expanduser("~/Desktop"), 'FaceCamera.png')
@@ -19,15 +24,115 @@ class stop_func: # dummy version of the multiprocessing.Event class
     def is_set(self):
         return self.stop
     
+
+class SyntheticCamera:
+    """
+    mimics the "simple_pyspin.Camera" interface with random frames
+    delivered at a fixed rate (to stress-test the recording pipeline)
+    """
+    def __init__(self, frame_rate=20., shape=(480, 640)):
+        self.AcquisitionFrameRate = frame_rate
+        self.shape = shape
+        self.frame = np.random.randint(0, 255, size=shape, dtype=np.uint8)
+
+    def init(self):
+        pass
+
+    def start(self):
+        self.tnext = time.time()
+
+    def stop(self):
+        pass
+
+    def get_array(self):
+        self.tnext += 1./self.AcquisitionFrameRate
+        time.sleep(max([0, self.tnext-time.time()]))
+        return np.roll(self.frame, int(1e3*self.tnext)%self.shape[1], axis=1)
+
+
+class FrameWriter:
+    """
+    background thread writing the frames from a bounded queue
+
+    frames are stored by chunks in "chunk-XXXXXX.npz" files (keys: "imgs" and "times"),
+    a timestamp index is written as "FaceCamera-index.npy" in the parent folder when closing
+    (the frames are read in place, see "assembling.saving.FaceCamera_frames")
+
+    when the queue is full, the frame is dropped and counted in "dropped_frames"
+    """
+    def __init__(self, folder,
+                 chunk_size=100,
+                 queue_size=500):
+
+        self.folder, self.chunk_size = folder, chunk_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped_frames, self.written_frames, self.max_queue_depth = 0, 0, 0
+        self.index = {'times':[], 'chunk':[], 'frame':[]}
+        self.Nchunks = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def put(self, image, Time):
+        try:
+            self.queue.put_nowait((image, Time))
+            self.max_queue_depth = max([self.max_queue_depth, self.queue.qsize()])
+        except queue.Full:
+            self.dropped_frames += 1
+
+    def write_chunk(self, imgs, times):
+        ichunk, self.Nchunks = self.Nchunks, self.Nchunks+1
+        np.savez(os.path.join(self.folder, 'chunk-%06i.npz' % ichunk),
+                 imgs=np.array(imgs), times=np.array(times))
+        self.index['times'] += times
+        self.index['chunk'] += [ichunk for t in times]
+        self.index['frame'] += list(range(len(times)))
+        self.written_frames += len(times)
+
+    def run(self):
+        imgs, times = [], []
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            imgs.append(item[0])
+            times.append(item[1])
+            if len(imgs)==self.chunk_size:
+                self.write_chunk(imgs, times)
+                imgs, times = [], []
+        if len(imgs)>0:
+            self.write_chunk(imgs, times)
+
+    def close(self):
+        self.queue.put(None) # blocking, we wait for the queue to be processed
+        self.thread.join()
+        np.save(os.path.join(os.path.dirname(self.folder), 'FaceCamera-index.npy'),
+                {k:np.array(self.index[k]) for k in self.index})
+
+    def print_summary(self):
+        print('FaceCamera -- written frames: %i, dropped frames: %i, max. queue depth: %i/%i' % (\
+                self.written_frames, self.dropped_frames, self.max_queue_depth, self.queue.maxsize))
+
+
 class CameraAcquisition:
 
     def __init__(self,
                  settings={'frame_rate':20.}):
         
         self.times, self.running = [], False
+        self.writer = None
         self.init_camera(settings)
 
     def init_camera(self, settings):
+
+        self.settings = settings
+
+        if ('synthetic' in settings) and settings['synthetic']:
+            self.cam = SyntheticCamera(frame_rate=settings['frame_rate'])
+            return
         
         self.cam = simple_pyspin.Camera()
         self.cam.init()
@@ -61,6 +166,8 @@ class CameraAcquisition:
 
 
     def save_sample_on_desktop(self):
+        if isinstance(self.cam, SyntheticCamera):
+            return
         ### SAVING A SAMPLE ON THE DESKTOP
         print('saving a sample image as:', desktop_png)
         imsave(desktop_png, np.array(self.cam.get_array()))
@@ -78,26 +185,36 @@ class CameraAcquisition:
                 # reinitialize recording
                 self.imgs_folder = os.path.join(folder.get(), 'FaceCamera-imgs')
                 Path(self.imgs_folder).mkdir(parents=True, exist_ok=True)
+                self.writer = FrameWriter(self.imgs_folder,
+                                          chunk_size=(self.settings['chunk_size'] if 'chunk_size' in self.settings else 100),
+                                          queue_size=(self.settings['queue_size'] if 'queue_size' in self.settings else 500))
             elif self.running and not run_flag.is_set(): # running and we need to stop
                 self.running=False
                 print('FaceCamera -- effective sampling frequency: %.1f Hz ' % (1./np.mean(np.diff(self.times))))
+                self.close_writer()
                 self.save_sample_on_desktop()
                 
 
             # after the update
             if self.running:
                 image, Time = self.cam.get_array().astype(np.uint8), time.time()
-                np.save(os.path.join(self.imgs_folder, '%s.npy' % Time), image)
-                # imsave(os.path.join(self.imgs_folder, '%s.png' % Time), np.array(image).astype(np.uint8)) # TOO SLOW
+                self.writer.put(image, Time) # the writer thread saves the frames
                 self.times.append(Time)
 
         if len(self.times)>0:
             print('FaceCamera -- effective sampling frequency: %.1f Hz ' % (1./np.mean(np.diff(self.times))))
+            self.close_writer()
             self.save_sample_on_desktop()
         
         self.running=False
         self.cam.stop()
 
+    def close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer.print_summary()
+            self.writer = None
+
 def launch_FaceCamera(run_flag, quit_flag, datafolder,
                       settings={'frame_rate':20.}):
     camera = CameraAcquisition(settings=settings)
@@ -112,6 +229,19 @@ if __name__=='__main__':
 
     import multiprocessing
     from ctypes import c_char_p
+
+    if 'synthetic' in sys.argv:
+        # stress test of the recording pipeline with a synthetic camera
+        folder = multiprocessing.Manager().Value(c_char_p,
+                        str(os.path.join(os.path.expanduser('~'), 'DATA', 'synthetic')))
+        for frame_rate in [20., 100., 500.]:
+            run, quit_event = stop_func(), stop_func()
+            camera = CameraAcquisition(settings={'frame_rate':frame_rate, 'synthetic':True})
+            run.set()
+            threading.Timer(T, quit_event.set).start() # quit after T seconds
+            print('\n- synthetic camera at %.0f Hz' % frame_rate)
+            camera.rec_and_check(run, quit_event, folder)
+        sys.exit()
     
     run = multiprocessing.Event()
     quit_event = multiprocessing.Event()
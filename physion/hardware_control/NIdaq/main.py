@@ -1,16 +1,22 @@
-import nidaqmx, time
+import time, threading, io
 import numpy as np
 
-from nidaqmx.utils import flatten_channel_string
-from nidaqmx.constants import Edge, WAIT_INFINITELY
-from nidaqmx.stream_readers import (
-    AnalogSingleChannelReader, AnalogMultiChannelReader, DigitalMultiChannelReader)
-from nidaqmx.stream_writers import (
-    AnalogSingleChannelWriter, AnalogMultiChannelWriter)
-
 import sys, os, pathlib
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
-from hardware_control.NIdaq.config import find_x_series_devices, find_m_series_devices, get_analog_input_channels, get_digital_input_channels, get_analog_output_channels
+
+try:
+    import nidaqmx
+    from nidaqmx.utils import flatten_channel_string
+    from nidaqmx.constants import Edge, WAIT_INFINITELY
+    from nidaqmx.stream_readers import (
+        AnalogSingleChannelReader, AnalogMultiChannelReader, DigitalMultiChannelReader)
+    from nidaqmx.stream_writers import (
+        AnalogSingleChannelWriter, AnalogMultiChannelWriter)
+    from hardware_control.NIdaq.config import find_x_series_devices, find_m_series_devices, get_analog_input_channels, get_digital_input_channels, get_analog_output_channels
+except ModuleNotFoundError:
+    # only the simulated acquisition can be used
+    print('"nidaqmx" module not found')
+    WAIT_INFINITELY = -1.0 # value of nidaqmx.constants.WAIT_INFINITELY
 
 class Acquisition:
 
@@ -24,7 +30,19 @@ class Acquisition:
                  device=None,
                  outputs=None,
                  output_steps=[], # should be a set of dictionaries, output_steps=[{'channel':0, 'onset': 2.3, 'duration': 1., 'value':5}]
+                 memory_time=10.,
+                 stream_chunk_time=1.,
+                 simulated=False,
                  verbose=False):
+        """
+        the data are kept in memory in preallocated ring buffers covering the last
+        "memory_time" seconds, the full recording is streamed to disk by chunks
+        of "stream_chunk_time" seconds, flushed at least every "stream_chunk_time"
+        seconds (see "stream_filenames" and "load_streamed_data")
+
+        "simulated=True" generates random data without any NI device
+        (to benchmark the acquisition loop)
+        """
         
         self.running, self.data_saved = False, False
 
@@ -35,20 +53,32 @@ class Acquisition:
         self.Nchannel_analog_in = Nchannel_analog_in
         self.Nchannel_digital_in = Nchannel_digital_in
         self.filename = filename
-        self.select_device()
+        self.simulated = simulated
+        if self.simulated:
+            self.device = None
+        else:
+            self.select_device()
 
         # preparing input channels
+        # ring buffers of a fixed size (multiple of the buffer size)
+        self.ring_size = self.buffer_size*max([1, int(np.ceil(memory_time/buffer_time))])
+        self.Nsamples = 0 # number of acquired samples
         # - analog:
-        self.analog_data = np.zeros((Nchannel_analog_in, 1), dtype=np.float64)
-        if self.Nchannel_analog_in>0:
+        self.analog_data = np.zeros((Nchannel_analog_in, self.ring_size), dtype=np.float64)
+        self.analog_buffer = np.zeros((Nchannel_analog_in, self.buffer_size), dtype=np.float64)
+        if (self.Nchannel_analog_in>0) and not self.simulated:
             self.analog_input_channels = get_analog_input_channels(self.device)[:Nchannel_analog_in]
         # - digital:
-        self.digital_data = np.zeros((1, 1), dtype=np.uint32)
-        if self.Nchannel_digital_in>0:
+        self.digital_data = np.zeros((1, self.ring_size), dtype=np.uint32)
+        self.digital_buffer = np.zeros((1, self.buffer_size), dtype=np.uint32)
+        if (self.Nchannel_digital_in>0) and not self.simulated:
             self.digital_input_channels = get_digital_input_channels(self.device)[:Nchannel_digital_in]
+        self.stream_files, self.stream_chunk_time, self.last_flush = None, stream_chunk_time, 0
 
         # preparing output channels
-        if outputs is not None: # used as a flag for output or not
+        if (outputs is not None) and self.simulated:
+            pass
+        elif outputs is not None: # used as a flag for output or not
             self.output_channels = get_analog_output_channels(self.device)[:outputs.shape[0]]
         elif len(output_steps)>0:
             Nchannel = max([d['channel'] for d in output_steps])+1
@@ -62,11 +92,50 @@ class Acquisition:
             for step in output_steps:
                 cond = (t>step['onset']) & (t<=step['onset']+step['duration'])
                 outputs[step['channel']][cond] = step['value']
-            self.output_channels = get_analog_output_channels(self.device)[:outputs.shape[0]]
+            if not self.simulated:
+                self.output_channels = get_analog_output_channels(self.device)[:outputs.shape[0]]
         self.outputs = outputs      
+
+    def open_stream_files(self):
+        """
+        raw binary files appended by chunks (file buffer of "stream_chunk_time" seconds of data),
+        so that a crash loses at most the last "stream_chunk_time" seconds
+        """
+        if self.filename is not None:
+            self.stream_files = {}
+            for key, N, ring in zip(['analog', 'digital'],
+                                    [self.Nchannel_analog_in, self.Nchannel_digital_in],
+                                    [self.analog_data, self.digital_data]):
+                if N>0:
+                    chunk = int(self.stream_chunk_time/self.dt)*ring.shape[0]*ring.itemsize # bytes
+                    self.stream_files[key] = open(stream_filenames(self.filename)[key], 'wb',
+                                                  buffering=max([chunk, io.DEFAULT_BUFFER_SIZE]))
+            self.last_flush = time.time()
+            np.save(stream_filenames(self.filename)['header'],
+                    {'Nchannel_analog_in':self.Nchannel_analog_in,
+                     'Nchannel_digital_in':self.Nchannel_digital_in,
+                     'dt':self.dt})
+
+    def flush_stream_files(self):
+        if self.stream_files is not None:
+            for f in self.stream_files.values():
+                f.flush()
+        self.last_flush = time.time()
+
+    def close_stream_files(self):
+        if self.stream_files is not None:
+            for f in self.stream_files.values():
+                f.close()
+            self.stream_files = None
             
     def launch(self):
 
+        self.open_stream_files()
+
+        if self.simulated:
+            self.launch_simulated()
+            return
+
         if self.outputs is not None:
             self.write_task = nidaqmx.Task()
 
@@ -145,7 +214,10 @@ class Acquisition:
         
         nidaqmx has weird behaviors sometimes... :(
         """
-        if self.running:
+        if self.running and self.simulated:
+            self.running = False
+            self.simulation_thread.join()
+        elif self.running:
             if self.Nchannel_digital_in>0:
                 self.read_digital_task.close()
             if self.Nchannel_analog_in>0:
@@ -158,30 +230,90 @@ class Acquisition:
             if self.data_saved:
                 print('[ok] NIdaq data already saved as: %s ' % self.filename)
             else:
-                np.save(self.filename,
-                        {'analog':self.analog_data[:,1:],
-                         'digital':self.digital_data[:,1:]})
+                self.close_stream_files()
+                np.save(self.filename, load_streamed_data(self.filename))
+                for fn in stream_filenames(self.filename).values():
+                    if os.path.isfile(fn):
+                        os.remove(fn)
                 print('[ok] NIdaq data saved as: %s ' % self.filename)
             self.data_saved = True
             
         self.running = False
+
+    def store(self, ring, buffer, key):
+        """
+        copy the buffer in the ring (at the current sample position)
+        and append it to the stream file (written by chunks, see "open_stream_files")
+        """
+        i0 = self.Nsamples % self.ring_size
+        n = min([buffer.shape[1], self.ring_size-i0])
+        ring[:,i0:i0+n] = buffer[:,:n]
+        ring[:,:buffer.shape[1]-n] = buffer[:,n:]
+        if (self.stream_files is not None) and (key in self.stream_files):
+            self.stream_files[key].write(buffer.T.tobytes())
+            if (time.time()-self.last_flush)>=self.stream_chunk_time:
+                self.flush_stream_files()
+
+    def get_buffers(self, num_samples):
+        if num_samples!=self.analog_buffer.shape[1]:
+            # should not happen (callback every "buffer_size" samples)
+            self.analog_buffer = np.zeros((self.Nchannel_analog_in, num_samples), dtype=np.float64)
+            self.digital_buffer = np.zeros((1, num_samples), dtype=np.uint32)
+        return self.analog_buffer, self.digital_buffer
         
     def reading_task_callback(self, task_idx, event_type, num_samples, callback_data=None):
         if self.running:
+            analog_buffer, digital_buffer = self.get_buffers(num_samples)
             if self.Nchannel_analog_in>0:
-                analog_buffer = np.zeros((self.Nchannel_analog_in, num_samples), dtype=np.float64)
                 self.analog_reader.read_many_sample(analog_buffer, num_samples, timeout=WAIT_INFINITELY)
-                self.analog_data = np.append(self.analog_data, analog_buffer, axis=1)
+                self.store(self.analog_data, analog_buffer, 'analog')
             
             if self.Nchannel_digital_in>0:
-                digital_buffer = np.zeros((1, num_samples), dtype=np.uint32)
                 self.digital_reader.read_many_sample_port_uint32(digital_buffer,
                                                              num_samples, timeout=WAIT_INFINITELY)
-                self.digital_data = np.append(self.digital_data, digital_buffer, axis=1)
+                self.store(self.digital_data, digital_buffer, 'digital')
+            self.Nsamples += num_samples
         else:
             self.close()
         return 0  # needed for this callback to be well defined (see nidaqmx doc).
 
+    def get_last_samples(self, N):
+        """
+        returns the last N samples from the ring buffers (N <= ring_size)
+        """
+        N = min([N, self.ring_size, self.Nsamples])
+        indices = np.arange(self.Nsamples-N, self.Nsamples) % self.ring_size
+        return self.analog_data[:,indices], self.digital_data[:,indices]
+
+    # ----------------------------------------------- #
+    #         simulated device (no hardware)          #
+    # ----------------------------------------------- #
+
+    def launch_simulated(self):
+        """
+        fake readers filled with random data and a thread triggering the
+        callback every "buffer_size" samples (real-time pace)
+        """
+        self.analog_reader = SimulatedReader()
+        self.digital_reader = SimulatedReader()
+        self.callback_durations = []
+        if self.filename is not None:
+            np.save(self.filename.replace('.npy', '.start.npy'),
+                    np.ones(1)*time.time()) # saving the time stamp of the start !
+        self.running, self.data_saved = True, False
+        self.simulation_thread = threading.Thread(target=self.simulation_loop)
+        self.simulation_thread.start()
+
+    def simulation_loop(self, realtime=True):
+        tstart, iEvent = time.time(), 0
+        Nmax = int(self.max_time/self.dt)
+        while self.running and ((iEvent+1)*self.buffer_size<=Nmax):
+            if realtime:
+                time.sleep(max([0, tstart+(iEvent+1)*self.buffer_size*self.dt-time.time()]))
+            t0 = time.perf_counter()
+            self.reading_task_callback(0, None, self.buffer_size)
+            self.callback_durations.append(time.perf_counter()-t0)
+            iEvent += 1
 
     def select_device(self):
         success = False
@@ -200,8 +332,64 @@ class Acquisition:
         if not success:
             print('Neither M-series nor X-series NI DAQ card found')
 
-        
+
+class SimulatedReader:
+    """ mimics the nidaqmx stream readers """
+
+    def read_many_sample(self, data, number_of_samples_per_channel, timeout=None):
+        data[:] = np.random.randn(*data.shape)
+        return number_of_samples_per_channel
+
+    def read_many_sample_port_uint32(self, data, number_of_samples_per_channel, timeout=None):
+        data[:] = np.random.randint(0, 4, size=data.shape)
+        return number_of_samples_per_channel
+
+
+def stream_filenames(filename):
+    return {'analog':filename.replace('.npy', '.analog.bin'),
+            'digital':filename.replace('.npy', '.digital.bin'),
+            'header':filename.replace('.npy', '.stream.npy')}
+
+
+def load_streamed_data(filename):
+    """
+    rebuilds the {'analog', 'digital'} data (format of "NIdaq.npy")
+    from the stream files, e.g. to recover data after a crash
+    """
+    header = np.load(stream_filenames(filename)['header'], allow_pickle=True).item()
+    data = {'analog':np.zeros((header['Nchannel_analog_in'], 0), dtype=np.float64),
+            'digital':np.zeros((1, 0), dtype=np.uint32)}
+    for key, N, dtype in zip(['analog', 'digital'],
+                             [header['Nchannel_analog_in'], min([1, header['Nchannel_digital_in']])],
+                             [np.float64, np.uint32]):
+        fn = stream_filenames(filename)[key]
+        if (N>0) and os.path.isfile(fn):
+            d = np.fromfile(fn, dtype=dtype)
+            data[key] = d[:N*(len(d)//N)].reshape(-1, N).T
+    return data
+
+
 if __name__=='__main__':
+
+    if 'simulated' in sys.argv:
+        # benchmark of the acquisition loop without hardware
+        for dt in [1e-3, 1e-4, 2e-5]:
+            acq = Acquisition(dt=dt,
+                              Nchannel_analog_in=3,
+                              Nchannel_digital_in=2,
+                              max_time=3,
+                              buffer_time=0.1,
+                              simulated=True,
+                              filename=os.path.join(os.path.expanduser('~'), 'NIdaq-simulated.npy'))
+            acq.launch()
+            acq.simulation_thread.join()
+            acq.close()
+            durations = 1e3*np.array(acq.callback_durations)
+            print('acq. freq. %.0fkHz, %i callbacks: %.2f+/-%.2f ms (first 10%%: %.2fms, last 10%%: %.2fms) ' % (\
+                    1e-3/dt, len(durations), durations.mean(), durations.std(),
+                    durations[:len(durations)//10+1].mean(), durations[-len(durations)//10-1:].mean()))
+        sys.exit()
+
     acq = Acquisition(dt=1e-3,
                       Nchannel_analog_in=0,
                       Nchannel_digital_in=2,
@@ -212,9 +400,11 @@ if __name__=='__main__':
     while (time.time()-tstart)<3.:
         pass
     # acq.running=False
+    acq.flush_stream_files()
+    data = load_streamed_data(acq.filename) # data streamed so far (as when recovering after a crash)
     acq.close()
-    print(acq.analog_data)
-    print(np.array(acq.digital_data)[0,-100:])
+    print(data['analog'])
+    print(data['digital'][0,-100:])
     # print(acq.digital_data.shape)
     # np.save('data.npy', acq.analog_data)
     # from datavyz import ge
@@ -0,0 +1,108 @@
+import os, pathlib
+import numpy as np
+
+
+def file_stat(filename):
+    """ os.stat, with zero size/time for a file removed meanwhile (e.g. evicted by another process) """
+    try:
+        return os.stat(filename)
+    except FileNotFoundError:
+        return os.stat_result((0,)*10)
+
+
+class FileCache:
+    """
+    on-disk cache of arrays, one ".npy" file per key in "folder", read back as memory-maps ("mmap_mode")
+
+    the least recently used files are evicted when the total size exceeds "max_size" (bytes),
+    a memory-mapped file stays readable on POSIX systems (a failed removal is skipped otherwise)
+
+    files are written under a temporary name and then renamed, so that concurrent
+    processes never read a partially written file, and a file evicted (or being written)
+    by another process is a cache miss, not an error
+    """
+    def __init__(self, folder, max_size, mmap_mode='r', name='cache'):
+        self.folder, self.max_size, self.mmap_mode, self.name = folder, max_size, mmap_mode, name
+        self.hits, self.misses = 0, 0
+
+    def filename(self, key):
+        return os.path.join(self.folder, '%s.npy' % key)
+
+    def is_cached(self, key):
+        return os.path.isfile(self.filename(key))
+
+    def get(self, key):
+        try:
+            os.utime(self.filename(key)) # for the "least recently used" eviction
+            array = np.load(self.filename(key), mmap_mode=self.mmap_mode)
+            self.hits += 1
+            return array
+        except FileNotFoundError: # not cached, or evicted by another process
+            self.misses += 1
+            return None
+
+    def set(self, key, array, dtype=None):
+        """
+        stores "array" (or any sequence with a length, written element by element) in "dtype" (default: its own),
+        returns the memory-mapped array (None if the cache could not be written)
+        """
+        try:
+            pathlib.Path(self.folder).mkdir(parents=True, exist_ok=True)
+            tmp = os.path.join(self.folder, '%s-%i.tmp.npy' % (key, os.getpid()))
+            if isinstance(array, np.ndarray):
+                np.save(tmp, (array if dtype is None else array.astype(dtype)))
+            else:
+                output = None
+                for i, element in enumerate(array):
+                    if output is None:
+                        output = np.lib.format.open_memmap(tmp, mode='w+',
+                                                           dtype=(dtype if dtype is not None else np.asarray(element).dtype),
+                                                           shape=(len(array),)+np.shape(element))
+                    output[i] = element
+                output.flush()
+                del output
+            os.replace(tmp, self.filename(key))
+            self.evict()
+        except OSError as be:
+            print(be)
+            print(' /!\ unable to write the %s in "%s" /!\ ' % (self.name, self.folder))
+            return None
+        try:
+            return np.load(self.filename(key), mmap_mode=self.mmap_mode)
+        except FileNotFoundError: # already evicted by another process
+            return None
+
+    def files(self):
+        """ cached files, from the least to the most recently used """
+        if not os.path.isdir(self.folder):
+            return []
+        files = [os.path.join(self.folder, f) for f in os.listdir(self.folder)\
+                 if f.endswith('.npy') and not f.endswith('.tmp.npy')]
+        return sorted(files, key=lambda f: file_stat(f).st_mtime)
+
+    def size(self):
+        return int(np.sum([file_stat(f).st_size for f in self.files()]))
+
+    def evict(self):
+        files = self.files()
+        size = self.size()
+        for f in files[:-1]:
+            if size<=self.max_size:
+                break
+            try:
+                fsize = file_stat(f).st_size
+                os.remove(f)
+                size -= fsize
+            except OSError: # e.g. memory-mapped by another process (Windows), or already evicted
+                pass
+
+    def clear(self):
+        for f in self.files():
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {'hits':self.hits, 'misses':self.misses,
+                'files':len(self.files()), 'size':self.size()}
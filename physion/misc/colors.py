@@ -2,15 +2,15 @@ import numpy as np
 # from matplotlib.cm import hsv, viridis, viridis_r, copper, copper_r, cool, jet,\
 #     PiYG, binary, binary_r, bone, Pastel1, Pastel2, Paired, Accent, Dark2, Set1, Set2,\
 #     Set3, tab10, tab20, tab20b, tab20c
-from matplotlib.cm import hsv
 from PyQt5 import QtGui, QtCore
-import pyqtgraph as pg
 
 
 def build_colors_from_array(array,
                             discretization=10,
                             cmap='hsv'):
 
+    from matplotlib.cm import hsv # imported here, not needed for the palette
+
     if discretization<len(array):
         discretization = len(array)
     Niter = int(len(array)/discretization)
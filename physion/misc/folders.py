@@ -3,6 +3,12 @@ import os
 python_path = os.path.join(os.path.expanduser('~'), 'miniconda3', 'envs', 'physion', 'bin', 'python')
 python_path_suite2p_env = os.path.join(os.path.expanduser('~'), 'miniconda3', 'envs', 'suite2p', 'bin', 'python')
 
+# on-disk caches of derived data (traces, indexes, stimulus frames, ...)
+CACHE_FOLDER = os.path.join(os.path.expanduser('~'), '.physion', 'cache')
+# maximum size (bytes) of the least-recently-used caches in CACHE_FOLDER (see misc/cache.py)
+CACHE_MAX_SIZE = {'CaImaging-traces':2e9, # derived Ca-Imaging traces (Ca_imaging/tools.py)
+                  'stimulus-frames':5e9} # rendered stimulus frames, only with "frame-cache":true in the protocol (visual_stim/psychopy_code/stimuli.py)
+
 FOLDERS = {
     '~/DATA':os.path.join(os.path.expanduser('~'), 'DATA'),
     '~/UNPROCESSED':os.path.join(os.path.expanduser('~'), 'UNPROCESSED')
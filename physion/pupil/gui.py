@@ -9,6 +9,7 @@ from pupil import process, roi
 from misc.folders import FOLDERS, python_path
 from misc.guiparts import NewWindow, Slider
 from assembling.tools import load_FaceCamera_data
+from assembling.saving import load_FaceCamera_frame
 
 class MainWindow(NewWindow):
     
@@ -457,8 +458,8 @@ class MainWindow(NewWindow):
 
         if self.FILES is not None:
             # full image 
-            self.fullimg = np.load(os.path.join(self.imgfolder,
-                                                self.FILES[self.cframe]))
+            self.fullimg = load_FaceCamera_frame(self.imgfolder,
+                                                 self.FILES[self.cframe])
             self.pimg.setImage(self.fullimg)
 
             # zoomed image
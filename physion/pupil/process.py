@@ -1,4 +1,4 @@
-import sys, os, pathlib, time
+import sys, os, pathlib, time, multiprocessing
 import numpy as np
 from scipy import optimize
 from scipy.ndimage import gaussian_filter
@@ -7,6 +7,7 @@ from scipy.interpolate import interp1d
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
 from misc.progressBar import printProgressBar
 from assembling.tools import load_FaceCamera_data
+from assembling.saving import load_FaceCamera_frame
 from pupil.outliers import replace_outliers
 from pupil import roi
 import matplotlib.pylab as plt
@@ -138,12 +139,49 @@ def perform_fit(cls,
     
 
 
+class FitState:
+    """
+    picklable copy of the fit properties (set by "init_fit_area")
+    sent once to each worker process of the parallel loop
+    """
+    def __init__(self, cls):
+        for key in ['imgfolder', 'FILES', 'zoom_cond', 'Nx', 'Ny', 'fit_area', 'x', 'y']:
+            setattr(self, key, getattr(cls, key))
+
+_worker_state = None # fit state of the worker process
+
+def init_worker(state):
+    global _worker_state
+    _worker_state = state
+
+def fit_frames(args):
+    """ fit of a set of frames by a worker process """
+    frames, gaussian_smoothing, saturation, reflectors = args
+    output = []
+    for _worker_state.cframe in frames:
+        preprocess(_worker_state,
+                   gaussian_smoothing=gaussian_smoothing,
+                   saturation=saturation,
+                   with_reinit=False)
+        coords, _, res = perform_fit(_worker_state,
+                                     saturation=saturation,
+                                     reflectors=reflectors)
+        output.append((_worker_state.cframe, coords, res))
+    return output
+
+
 def perform_loop(parent,
                  subsampling=1000,
                  gaussian_smoothing=0,
                  saturation=100,
                  reflectors=[],
+                 Nworkers=1,
+                 frames_per_job=50,
                  with_ProgressBar=False):
+    """
+    "Nworkers>1" distributes the frames over a pool of processes
+    (frames are fitted independently, the output is the same as the serial loop)
+    """
 
     temp = {} # temporary data in case of subsampling
     for key in ['frame', 'cx', 'cy', 'sx', 'sy', 'residual', 'angle']:
@@ -152,7 +190,25 @@ def perform_loop(parent,
     if with_ProgressBar:
         printProgressBar(0, parent.nframes)
 
-    for parent.cframe in list(range(parent.nframes-1)[::subsampling])+[parent.nframes-1]:
+    FRAMES = list(range(parent.nframes-1)[::subsampling])+[parent.nframes-1]
+
+    if Nworkers>1:
+        jobs = [(FRAMES[i:i+frames_per_job], gaussian_smoothing, saturation, reflectors)\
+                for i in range(0, len(FRAMES), frames_per_job)]
+        with multiprocessing.Pool(Nworkers,
+                                  initializer=init_worker,
+                                  initargs=(FitState(parent),)) as pool:
+            for output in pool.imap(fit_frames, jobs): # imap keeps the order
+                for frame, coords, res in output:
+                    temp['frame'].append(frame)
+                    temp['residual'].append(res)
+                    for key, val in zip(['cx', 'cy', 'sx', 'sy', 'angle'], coords):
+                        temp[key].append(val)
+                if with_ProgressBar:
+                    printProgressBar(temp['frame'][-1], parent.nframes)
+        FRAMES = [] # done
+
+    for parent.cframe in FRAMES:
         # preprocess image
         img = preprocess(parent,
                          gaussian_smoothing=gaussian_smoothing,
@@ -199,7 +255,7 @@ def init_fit_area(cls,
                   blanks=[]):
 
     if fullimg is None:
-        fullimg = np.load(os.path.join(cls.imgfolder,cls.FILES[0]))
+        fullimg = load_FaceCamera_frame(cls.imgfolder, cls.FILES[0])
 
     cls.fullx, cls.fully = np.meshgrid(np.arange(fullimg.shape[0]),
                                        np.arange(fullimg.shape[1]),
@@ -252,11 +308,11 @@ def preprocess(cls, with_reinit=True,
 
     if (img is None):
         try:
-            img = np.load(os.path.join(cls.imgfolder, cls.FILES[cls.cframe]))
+            img = load_FaceCamera_frame(cls.imgfolder, cls.FILES[cls.cframe])
         except ValueError:
             print(' /!\ Problem with frame #%i: %s' % (cls.cframe, cls.FILES[cls.cframe]))
             print(' replaced with #%i ' % (cls.cframe-1))
-            img = np.load(os.path.join(cls.imgfolder, cls.FILES[cls.cframe-1]))
+            img = load_FaceCamera_frame(cls.imgfolder, cls.FILES[cls.cframe-1])
             
     else:
         img = img.copy()
@@ -335,6 +391,7 @@ if __name__=='__main__':
     # parser.add_argument("--saturation", type=float, default=75)
     parser.add_argument("--maxiter", type=int, default=100)
     parser.add_argument('-s', "--subsampling", type=int, default=1)
+    parser.add_argument('-n', "--Nworkers", type=int, default=1, help='number of worker processes for the fit')
     # parser.add_argument("--gaussian_smoothing", type=float, default=0)
     # parser.add_argument("--ellipse", type=float, default=[], nargs=)
     # parser.add_argument("--gaussian_smoothing", type=float, default=0)
@@ -342,6 +399,7 @@ if __name__=='__main__':
     # parser.add_argument('-f', "--saving_filename", default='pupil-data.npy')
     parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
     parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--benchmark", action="store_true", help='fit speed on a synthetic movie, for different numbers of workers')
     parser.add_argument('-rf', "--root_datafolder", type=str, default=os.path.join(os.path.expanduser('~'), 'DATA'))
     parser.add_argument('-d', "--day", type=str, default=datetime.datetime.today().strftime('%Y_%m_%d'))
     parser.add_argument('-t', "--time", type=str, default='')
@@ -352,7 +410,31 @@ if __name__=='__main__':
         args.datafolder = os.path.join(args.root_datafolder, args.day,
                                        args.time)
 
-    if args.debug:
+    if args.benchmark:
+        """
+        synthetic movie of a moving dark ellipse on a bright background
+        """
+        import tempfile
+        args.imgfolder = tempfile.mkdtemp()
+        Nframes, Lx, Ly = 1000, 200, 240
+        x, y = np.meshgrid(np.arange(Lx), np.arange(Ly), indexing='ij')
+        for i in range(Nframes):
+            img = 200+20*np.random.randn(Lx, Ly)
+            img[inside_ellipse_cond(x, y, 100+10*np.sin(i/30.), 120, 40+10*np.cos(i/50.), 30, 0.3)] = 20
+            np.save(os.path.join(args.imgfolder, '%i.npy' % i), img.astype(np.uint8))
+        args.times, args.FILES, args.nframes, args.Lx, args.Ly = np.arange(Nframes), ['%i.npy' % i for i in range(Nframes)], Nframes, Lx, Ly
+        init_fit_area(args, ellipse=[100, 120, 120, 100, 0])
+        for Nworkers in [1, 2, 4, 8, 16]:
+            if Nworkers<=multiprocessing.cpu_count():
+                tstart = time.time()
+                temp = perform_loop(args, subsampling=1, saturation=100, Nworkers=Nworkers)
+                print(' - Nworkers=%i, %.1f frames/s' % (Nworkers, Nframes/(time.time()-tstart)))
+                if Nworkers==1:
+                    serial = temp
+                else:
+                    print('   same output as serial loop: ', np.all([np.allclose(serial[key], temp[key]) for key in temp]))
+
+    elif args.debug:
         """
         snippet of code to design/debug the fitting algorithm
         
@@ -366,7 +448,7 @@ if __name__=='__main__':
         args.bROI = []
         load_folder(args)
 
-        args.fullimg = np.rot90(np.load(os.path.join(args.imgfolder, args.FILES[0])), k=3)
+        args.fullimg = np.rot90(load_FaceCamera_frame(args.imgfolder, args.FILES[0]), k=3)
         init_fit_area(args,
                       ellipse=args.data['ROIellipse'],
                       blanks=(args.data['blanks'] if 'blanks' in args.data else None))
@@ -408,6 +490,7 @@ if __name__=='__main__':
                                 gaussian_smoothing=args.data['gaussian_smoothing'],
                                 saturation=args.data['ROIsaturation'],
                                 reflectors=(args.data['reflectors'] if 'reflectors'  in args.data else []),
+                                Nworkers=args.Nworkers,
                                 with_ProgressBar=args.verbose)
             temp['t'] = args.times[np.array(temp['frame'])]
             for key in temp:
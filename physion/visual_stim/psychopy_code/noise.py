@@ -1,4 +1,5 @@
 import numpy as np
+from collections import OrderedDict
 
 def from_time_to_array_index(self, t):
     if self.stimulus_params['static'] and (t<=self.t0):
@@ -8,6 +9,57 @@ def from_time_to_array_index(self, t):
     else:
         return int(np.round(t*self.SCREEN['refresh_rate'],0))
 
+
+def square_slices(axis, starts, square_size):
+    """
+    pixel range [i1, i2) of each square along one (sorted) screen axis,
+    i.e. the pixels satisfying: start <= axis < start+square_size
+    """
+    return np.searchsorted(axis, starts, side='left'),\
+        np.searchsorted(axis, starts+square_size, side='left')
+
+
+def paint_squares(array, xaxis, yaxis, Nx, Ny, square_size,
+                  Loc, Val, grid_shift, contrast=1.):
+    """
+    draws the squares of indices "Loc" with values "contrast*Val" on the array
+
+    squares are painted in the order of "Loc" (later ones overwriting earlier ones)
+    each square only touches its own pixel block, so the cost scales with the grid size
+    """
+    # square edges along each axis, computed as in the square-by-square masks
+    x1, x2 = square_slices(xaxis, np.arange(int(Nx))*square_size-grid_shift, square_size)
+    y1, y2 = square_slices(yaxis, np.arange(int(Ny)+1)*square_size-grid_shift, square_size)
+    for r, v in zip(Loc, Val):
+        ix, iy = int(r % Nx), int(r / Nx)
+        array[x1[ix]:x2[ix], y1[iy]:y2[iy]] = contrast*v
+    return array
+
+
+class frame_cache:
+    """
+    bounded (least-recently-used) cache of the frames of a noise generator
+    """
+
+    def __init__(self, size=100):
+        self.size = size
+        self.frames = OrderedDict()
+
+    def get(self, index, func):
+        if index in self.frames:
+            self.frames.move_to_end(index)
+            return self.frames[index]
+        frame = func(index)
+        if self.size>0:
+            frame.setflags(write=False) # shared between calls
+            self.frames[index] = frame
+            while len(self.frames)>self.size:
+                self.frames.popitem(last=False)
+        return frame
+
+    def clear(self):
+        self.frames.clear()
+
 class sparse_noise_generator:
 
     def __init__(self,
@@ -22,7 +74,8 @@ class sparse_noise_generator:
                  contrast=1.,
                  noise_mean_refresh_time=0.3,
                  noise_rdm_jitter_refresh_time=0.15,
-                 seed=0):
+                 seed=0,
+                 cache_size=100):
 
         self.seed = int(seed)
     
@@ -49,10 +102,16 @@ class sparse_noise_generator:
         self.events = np.concatenate([[0], events[events<duration], [duration]]) # restrict to stim
         self.durations = np.diff(self.events)
         
-        self.x, self.y = np.meshgrid(np.linspace(0, width_deg, int(self.pix[0])),
-                                     np.linspace(0, height_deg, int(self.pix[1])), indexing='ij')
+        # screen coordinates (the frame is separable in x and y)
+        self.xaxis = np.linspace(0, width_deg, int(self.pix[0]))
+        self.yaxis = np.linspace(0, height_deg, int(self.pix[1]))
+
+        self.cache = frame_cache(cache_size)
 
     def get_frame(self, index):
+        return self.cache.get(index, self.build_frame)
+
+    def build_frame(self, index):
 
         np.random.seed(int(1000*self.seed+index)) # here, in case something else messes up with numpy seed
         
@@ -61,12 +120,9 @@ class sparse_noise_generator:
         Val = np.random.choice([-1, 1], int(self.sparseness*self.Ntot_square)) # either white or black
         grid_shift = np.random.uniform()*self.square_size # so that the square do not always fall on the same grid
         
-        for r, v in zip(Loc, Val):
-            x0, y0 = (r % self.Nx)*self.square_size-grid_shift, int(r / self.Nx)*self.square_size-grid_shift
-            cond = (self.x>=x0) & (self.x<x0+self.square_size) & (self.y>=y0) & (self.y<y0+self.square_size)
-            array[:,:][cond] = self.contrast*v
-            
-        return array
+        return paint_squares(array, self.xaxis, self.yaxis,
+                             self.Nx, self.Ny, self.square_size,
+                             Loc, Val, grid_shift, contrast=self.contrast)
 
 
 class dense_noise_generator:
@@ -81,7 +137,8 @@ class dense_noise_generator:
                  contrast=1.,
                  noise_mean_refresh_time=0.3,
                  noise_rdm_jitter_refresh_time=0.15,
-                 seed=0):
+                 seed=0,
+                 cache_size=100):
 
         self.seed = int(seed)
     
@@ -106,10 +163,16 @@ class dense_noise_generator:
         self.events = np.concatenate([[0], events[events<duration], [duration]]) # restrict to stim
         self.durations = np.diff(self.events)
         
-        self.x, self.y = np.meshgrid(np.linspace(0, width_deg, int(self.pix[0])),
-                                     np.linspace(0, height_deg, int(self.pix[1])), indexing='ij')
+        # screen coordinates (the frame is separable in x and y)
+        self.xaxis = np.linspace(0, width_deg, int(self.pix[0]))
+        self.yaxis = np.linspace(0, height_deg, int(self.pix[1]))
+
+        self.cache = frame_cache(cache_size)
 
     def get_frame(self, index):
+        return self.cache.get(index, self.build_frame)
+
+    def build_frame(self, index):
 
         np.random.seed(int(1000*self.seed+index)) # here, in case something else messes up with numpy seed
 
@@ -119,12 +182,9 @@ class dense_noise_generator:
         
         array = np.zeros((int(self.pix[0]), int(self.pix[1])))
         
-        for r, v in zip(Loc, Val):
-            x0, y0 = (r % self.Nx)*self.square_size-grid_shift, int(r / self.Nx)*self.square_size-grid_shift
-            cond = (self.x>=x0) & (self.x<x0+self.square_size) & (self.y>=y0) & (self.y<y0+self.square_size)
-            array[:,:][cond] = self.contrast*v
-            
-        return array
+        return paint_squares(array, self.xaxis, self.yaxis,
+                             self.Nx, self.Ny, self.square_size,
+                             Loc, Val, grid_shift, contrast=self.contrast)
     
 
         
@@ -2,7 +2,7 @@
 N.B. there is a mix of "grey screen" corresponding to bg-color=0 and bg-color=0.5 (see in individual protocols) TO BE FIXED
 """
 import numpy as np
-import itertools, os, sys, pathlib, time, json
+import itertools, os, sys, pathlib, time, json, queue, threading, hashlib
 try:
     from psychopy import visual, core, event, clock, monitors # We actually do it below so that we can use the code without psychopy
 except ModuleNotFoundError:
@@ -12,6 +12,9 @@ sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
 from screens import SCREENS
 from psychopy_code.noise import sparse_noise_generator, dense_noise_generator
 from psychopy_code.preprocess_NI import load, img_after_hist_normalization, adapt_to_screen_resolution
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from misc.folders import CACHE_FOLDER, CACHE_MAX_SIZE
+from misc.cache import FileCache
 
 def build_stim(protocol, no_psychopy=False):
     """
@@ -72,6 +75,110 @@ def stop_signal(parent):
         return False
 
 
+class lazy_frames:
+    """
+    frames of an "images_sequence" episode, computed only when accessed: frames[i] = func(i)
+    """
+    def __init__(self, func, N):
+        self.func, self.N = func, N
+
+    def __len__(self):
+        return self.N
+
+    def __getitem__(self, i):
+        return self.func(i)
+
+    def __iter__(self):
+        return (self.func(i) for i in range(self.N))
+
+
+class frame_stream:
+    """
+    prepares the frames of an "images_sequence" episode in a background thread,
+    at most "lookahead" frames ahead of display (bounded queue), so that memory
+    does not depend on the sequence length
+
+    the frames are requested in increasing order with "get(i)" (frames not displayed in time are skipped),
+    the time spent waiting on the preparation is stored in "waits",
+    an exception raised in the preparation is raised again by "get"
+    """
+    def __init__(self, frames, transform=None, lookahead=10):
+        self.frames, self.transform = frames, transform
+        self.queue = queue.Queue(maxsize=lookahead)
+        self.i, self.frame, self.waits = -1, None, []
+        self.stop_flag, self.error = False, None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            for i in range(len(self.frames)):
+                frame = self.frames[i]
+                if self.transform is not None:
+                    frame = self.transform(frame)
+                if not self.put((i, frame)):
+                    return
+        except BaseException as be:
+            self.put((None, be))
+            return
+        self.put((None, None)) # end of the sequence
+
+    def put(self, item):
+        """ blocking put that "close" can interrupt (returns False then) """
+        while not self.stop_flag:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, i):
+        if self.error is not None:
+            raise self.error
+        if i>self.i:
+            tstart = time.time()
+            while self.i<i:
+                j, frame = self.queue.get()
+                if j is None:
+                    self.error = (frame if frame is not None else\
+                                  IndexError('frame %i requested in a sequence of %i frames' % (i, len(self.frames))))
+                    raise self.error
+                self.i, self.frame = j, frame
+            self.waits.append(time.time()-tstart)
+        return self.frame
+
+    def close(self):
+        self.stop_flag = True
+        self.thread.join()
+
+
+class stimulus_frames_cache(FileCache):
+    """
+    on-disk cache of rendered frame sequences of the "images_sequence" episodes (see misc/cache.py)
+
+    one ".npy" file per episode, keyed by the stimulus parameters of the episode and the screen geometry
+    (so the seeds only enter through the parameters that they generate), stored in the dtype of the
+    rendered frames (so that cached and rendered frames are identical) and read back as memory-maps
+
+    opt-in: only used by the protocols with "frame-cache":true
+    """
+    def __init__(self, folder=os.path.join(CACHE_FOLDER, 'stimulus-frames'),
+                 max_size=CACHE_MAX_SIZE['stimulus-frames'], dtype=None):
+        super().__init__(folder, max_size, mmap_mode='r', name='stimulus frames cache')
+        self.dtype = dtype
+
+    def key(self, params, screen):
+        geometry = [screen[k] for k in ['resolution', 'width', 'distance_from_eye']]
+        return hashlib.sha1(json.dumps([params, geometry], sort_keys=True, default=float).encode()).hexdigest()
+
+    def set(self, key, frames):
+        """ writes the frames one by one (any sequence with a length), returns the memory-mapped array """
+        return super().set(key, frames, dtype=self.dtype)
+
+FRAMES_CACHE = stimulus_frames_cache()
+
+
 class visual_stim:
 
     def __init__(self, protocol, demo=False, store_frame=False):
@@ -83,6 +190,14 @@ class visual_stim:
             self.store_frame = bool(protocol['store_frame'])
 
         self.screen = SCREENS[self.protocol['Screen']]
+        self.k, self.gamma = self.screen['gamma_correction']['k'], self.screen['gamma_correction']['gamma']
+
+        # number of frames of the "images_sequence" episodes prepared ahead of display
+        self.lookahead = (int(protocol['frame-lookahead']) if 'frame-lookahead' in protocol else 10)
+        self.streams = {}
+
+        # on-disk cache of the rendered frame sequences (see "stimulus_frames_cache"), "frame-cache":true to enable it
+        self.frames_cache = (FRAMES_CACHE if (('frame-cache' in protocol) and protocol['frame-cache']) else None)
 
         # we can initialize the angle
         self.x, self.z = self.angle_meshgrid()
@@ -100,8 +215,6 @@ class visual_stim:
                 self.screen['fullscreen'] = False
                 self.protocol['movie_refresh_freq'] = 5.
 
-            self.k, self.gamma = self.screen['gamma_correction']['k'], self.screen['gamma_correction']['gamma']
-
             self.win = visual.Window(self.screen['resolution'], monitor=self.monitor,
                                      screen=self.screen['screen_id'], fullscr=self.screen['fullscreen'],
                                      units='pix',
@@ -381,24 +494,86 @@ class visual_stim:
 
     #####################################################
     # adding a run purely define by an array (time, x, y), see e.g. sparse_noise initialization
+    def prepare_sequence(self, index):
+        """ starts the preparation of the frames of the episode (e.g. during the interstim) """
+        if index not in self.streams:
+            time_indices, frames = self.get_frames_sequence(index, lazy=True)
+            self.streams[index] = (time_indices,
+                                   frame_stream(frames, transform=self.gamma_corrected_lum, lookahead=self.lookahead))
+        return self.streams[index]
+
     def single_array_sequence_presentation(self, parent, index):
-        time_indices, frames = self.get_frames_sequence(index)
-        FRAMES = []
-        for frame in frames:
-            FRAMES.append(visual.ImageStim(self.win,
-                                           image=self.gamma_corrected_lum(frame),
-                                           units='pix', size=self.win.size))
-        start = clock.getTime()
-        while ((clock.getTime()-start)<(self.experiment['time_duration'][index])) and not parent.stop_flag:
-            iframe = int((clock.getTime()-start)*self.frame_refresh)
-            FRAMES[time_indices[iframe]].draw()
-            self.add_monitoring_signal(clock.getTime(), start)
-            try:
-                self.win.flip()
-            except AttributeError:
-                pass
+        time_indices, stream = self.prepare_sequence(index)
+        try:
+            ishown = time_indices[0]
+            pattern = visual.ImageStim(self.win, image=stream.get(ishown),
+                                       units='pix', size=self.win.size)
+            start = clock.getTime()
+            while ((clock.getTime()-start)<(self.experiment['time_duration'][index])) and not parent.stop_flag:
+                iframe = int((clock.getTime()-start)*self.frame_refresh)
+                if time_indices[iframe]!=ishown:
+                    ishown = time_indices[iframe]
+                    pattern.image = stream.get(ishown)
+                pattern.draw()
+                self.add_monitoring_signal(clock.getTime(), start)
+                try:
+                    self.win.flip()
+                except AttributeError:
+                    pass
+        finally:
+            stream.close()
+            del self.streams[index]
 
 
+    def sequence_preparation_latency(self, index, prestart=0.):
+        """
+        headless measure (works with "no-window") of the frame preparation of an "images_sequence" episode:
+        the preparation is started "prestart" seconds before the episode (as during the interstim)
+        and the frames are requested at the display rate, as in "single_array_sequence_presentation"
+
+        returns the waiting time for the first frame ('latency'), the total and maximum waiting
+        time during the episode and the memory of the look-ahead buffer
+        """
+        time_indices, stream = self.prepare_sequence(index)
+        time.sleep(prestart)
+        try:
+            start = time.time()
+            for iframe in range(int(self.experiment['time_duration'][index]*self.frame_refresh)):
+                time.sleep(max([0, start+iframe/self.frame_refresh-time.time()]))
+                stream.get(time_indices[iframe])
+        finally:
+            stream.close()
+            del self.streams[index]
+        return {'latency':stream.waits[0], 'total_wait':np.sum(stream.waits), 'max_wait':np.max(stream.waits[1:]+[0]),
+                'Nframes':len(stream.frames), 'buffer_size':self.lookahead*stream.frame.nbytes}
+
+    def frames_cache_key(self, index):
+        """ key of the episode in the frames cache, None for stimuli without cached frames """
+        return None
+
+    def precompute_frames(self, verbose=True):
+        """
+        renders the frames of the "images_sequence" episodes in the frames cache (see "stimulus_frames_cache"),
+        e.g. before the experiment, so that building them again is a memory-map of the cached file
+        """
+        if self.frames_cache is None:
+            print(' /!\ the frames cache is disabled for this protocol ("frame-cache":true to enable it) /!\ ')
+            return
+        KEYS = {}
+        for i, run_type in enumerate(self.experiment['frame_run_type']):
+            key = self.frames_cache_key(i)
+            if (run_type=='images_sequence') and (key is not None):
+                KEYS[i] = key
+                if not self.frames_cache.is_cached(key):
+                    tstart = time.time()
+                    self.get_frames_sequence(i)
+                    if verbose:
+                        print(' - episode #%i rendered in %.2fs' % (i, time.time()-tstart))
+        Nevicted = np.sum([not self.frames_cache.is_cached(key) for key in KEYS.values()])
+        if Nevicted>0:
+            print(' /!\ %i episodes were evicted from the frames cache, increase its "max_size" (%.1fGB) /!\ ' % (\
+                Nevicted, self.frames_cache.max_size/1e9))
+
     def single_episode_run(self, parent, index):
         
         if self.experiment['frame_run_type'][index]=='drifting':
@@ -416,15 +591,25 @@ class visual_stim:
 
         
     ## FINAL RUN FUNCTION
+    def close_streams(self):
+        """ stops the frame preparation of the episodes not presented (e.g. stimulation stopped) """
+        for index in list(self.streams.keys()):
+            self.streams.pop(index)[1].close()
+
     def run(self, parent):
         self.start_screen(parent)
-        for i in range(len(self.experiment['index'])):
-            if stop_signal(parent):
-                break
-            print('Running protocol of index %i/%i' % (i+1, len(self.experiment['index'])))
-            self.single_episode_run(parent, i)
-            if i<(len(self.experiment['index'])-1):
-                self.inter_screen(parent, duration=self.experiment['interstim'][i], color=self.experiment['interstim-screen'][i])
+        try:
+            for i in range(len(self.experiment['index'])):
+                if stop_signal(parent):
+                    break
+                print('Running protocol of index %i/%i' % (i+1, len(self.experiment['index'])))
+                self.single_episode_run(parent, i)
+                if i<(len(self.experiment['index'])-1):
+                    if self.experiment['frame_run_type'][i+1]=='images_sequence':
+                        self.prepare_sequence(i+1) # frames prepared during the interstim
+                    self.inter_screen(parent, duration=self.experiment['interstim'][i], color=self.experiment['interstim-screen'][i])
+        finally:
+            self.close_streams()
         self.end_screen(parent)
         if not parent.stop_flag and hasattr(parent, 'statusBar'):
             parent.statusBar.showMessage('stimulation over !')
@@ -553,6 +738,8 @@ class multiprotocol(visual_stim):
                 for key in protocol:
                     if ('Protocol-%i-'%i in key):
                         subprotocol[key.replace('Protocol-%i-'%i, '')] = protocol[key]
+                if 'NI-bank-cache' in protocol:
+                    subprotocol['NI-bank-cache'] = protocol['NI-bank-cache']
                 self.STIM.append(build_stim(subprotocol, no_psychopy=no_psychopy))
                 i+=1
         else:
@@ -564,6 +751,8 @@ class multiprotocol(visual_stim):
                     subprotocol = json.load(fp)
                     subprotocol['Screen'] = protocol['Screen']
                     subprotocol['no-window'] = True
+                    if 'NI-bank-cache' in protocol:
+                        subprotocol['NI-bank-cache'] = protocol['NI-bank-cache']
                     self.STIM.append(build_stim(subprotocol, no_psychopy=no_psychopy))
                     for key, val in subprotocol.items():
                         protocol['Protocol-%i-%s'%(i,key)] = val
@@ -608,8 +797,10 @@ class multiprotocol(visual_stim):
         return self.STIM[self.experiment['protocol_id'][index]].get_frame(index, parent=self)
     def get_patterns(self, index):
         return self.STIM[self.experiment['protocol_id'][index]].get_patterns(index, parent=self)
-    def get_frames_sequence(self, index):
-        return self.STIM[self.experiment['protocol_id'][index]].get_frames_sequence(index, parent=self)
+    def get_frames_sequence(self, index, lazy=False):
+        return self.STIM[self.experiment['protocol_id'][index]].get_frames_sequence(index, parent=self, lazy=lazy)
+    def frames_cache_key(self, index):
+        return self.STIM[self.experiment['protocol_id'][index]].frames_cache_key(index, parent=self)
     def get_image(self, episode, time_from_episode_start=0, parent=None):
         return self.STIM[self.experiment['protocol_id'][episode]].get_image(episode, time_from_episode_start=time_from_episode_start, parent=self)
 
@@ -1055,13 +1246,36 @@ class gaussian_blobs(visual_stim):
                                 run_type='images_sequence')
         
             
-    def get_frames_sequence(self, index, parent=None):
+    def blob_timing(self, index, parent=None):
+        """ frame indices of the blob appearance: itstart, Nblob """
+        cls = (parent if parent is not None else self)
+        interval = cls.experiment['time_stop'][index]-cls.experiment['time_start'][index]
+        t0, sT = cls.experiment['center-time'][index], cls.experiment['extent-time'][index]
+        itstart = np.max([0, int((t0-cls.protocol['appearance_threshold']*sT)*cls.protocol['movie_refresh_freq'])])
+        itend = np.min([int(interval*cls.protocol['movie_refresh_freq']),
+                        int((t0+cls.protocol['appearance_threshold']*sT)*cls.protocol['movie_refresh_freq'])])
+        return itstart, max([0, itend-itstart])
+
+    def frames_cache_key(self, index, parent=None):
+        cls = (parent if parent is not None else self)
+        if cls.frames_cache is None:
+            return None
+        params = {key:cls.experiment[key][index] for key in\
+                  ['x-center', 'y-center', 'radius','center-time', 'extent-time', 'contrast', 'bg-color']}
+        params['Stimulus'] = 'gaussian-blobs'
+        params['blob_timing'] = self.blob_timing(index, parent=parent)
+        params['movie_refresh_freq'] = cls.protocol['movie_refresh_freq']
+        return cls.frames_cache.key(params, self.screen)
+
+    def get_frames_sequence(self, index, parent=None, lazy=False):
         """
-        Generator creating a random number of chunks (but at most max_chunks) of length chunk_length containing
-        random samples of sin([0, 2pi]).
+        frames of the blob appearance: [background, frames in +/- appearance_threshold*extent-time, background]
+        with "lazy", the frames are computed only when accessed (see "lazy_frames")
+
+        the frames are read from the frames cache when available (memory-map),
+        otherwise the non-lazy build also writes them in the cache
         """
         cls = (parent if parent is not None else self)
-        bg = np.ones(cls.screen['resolution'])*cls.experiment['bg-color'][index]
         interval = cls.experiment['time_stop'][index]-cls.experiment['time_start'][index]
 
         contrast = cls.experiment['contrast'][index]
@@ -1070,24 +1284,37 @@ class gaussian_blobs(visual_stim):
         bg_color = cls.experiment['bg-color'][index]
         
         t0, sT = cls.experiment['center-time'][index], cls.experiment['extent-time'][index]
-        itstart = np.max([0, int((t0-cls.protocol['appearance_threshold']*sT)*cls.protocol['movie_refresh_freq'])])
-        itend = np.min([int(interval*cls.protocol['movie_refresh_freq']),
-                        int((t0+cls.protocol['appearance_threshold']*sT)*cls.protocol['movie_refresh_freq'])])
-
-        times, FRAMES = np.zeros(int(1.2*interval*cls.protocol['movie_refresh_freq']), dtype=int), []
-        # the pre-time
-        FRAMES.append(2*bg_color-1.+0.*self.x)
-        times[:itstart] = 0
-        for iframe, it in enumerate(np.arange(itstart, itend)):
-            img = 2*(np.exp(-((self.x-xcenter)**2+(self.z-zcenter)**2)/2./radius**2)*\
-                     contrast*np.exp(-(it/cls.protocol['movie_refresh_freq']-t0)**2/2./sT**2)+bg_color)-1.
-            FRAMES.append(img)
-            times[it] = iframe
-        # the post-time
-        FRAMES.append(2*bg_color-1.+0.*self.x)
-        times[itend:] = len(FRAMES)-1
-            
-        return times, FRAMES
+        itstart, Nblob = self.blob_timing(index, parent=parent)
+
+        times = np.zeros(int(1.2*interval*cls.protocol['movie_refresh_freq']), dtype=int)
+        times[:itstart] = 0 # the pre-time
+        times[itstart:itstart+Nblob] = 1+np.arange(Nblob)
+        times[itstart+Nblob:] = Nblob+1 # the post-time
+
+        key = self.frames_cache_key(index, parent=parent)
+        if key is not None:
+            FRAMES = cls.frames_cache.get(key)
+            if FRAMES is not None:
+                return times, FRAMES
+
+        blob = None # the spatial profile, computed once for the episode
+        def frame(i):
+            nonlocal blob
+            if (i==0) or (i==Nblob+1):
+                return 2*bg_color-1.+0.*self.x
+            if blob is None:
+                blob = np.exp(-((self.x-xcenter)**2+(self.z-zcenter)**2)/2./radius**2)
+            it = itstart+i-1
+            return 2*(blob*contrast*np.exp(-(it/cls.protocol['movie_refresh_freq']-t0)**2/2./sT**2)+bg_color)-1.
+
+        FRAMES = lazy_frames(frame, Nblob+2)
+        if lazy:
+            return times, FRAMES
+        elif key is not None:
+            CACHED = cls.frames_cache.set(key, FRAMES)
+            if CACHED is not None:
+                return times, CACHED
+        return times, list(FRAMES)
 
     def get_image(self, episode, time_from_episode_start=0, parent=None):
         cls = (parent if parent is not None else self)
@@ -1104,26 +1331,65 @@ class gaussian_blobs(visual_stim):
 #####################################################
 
 NI_directory = os.path.join(str(pathlib.Path(__file__).resolve().parents[1]), 'NI_bank')
-        
+
+NI_BANKS = {} # preprocessed image banks of the process, per screen resolution
+
+def load_NI_bank(screen, folder=os.path.join(CACHE_FOLDER, 'NI-bank')):
+    """
+    images of the NI_bank adapted to the screen resolution and histogram-normalized (in [-1,1]),
+    the order of the files defines the 'Image-ID'
+
+    the bank is preprocessed once per process (and screen resolution), and stored in "folder"
+    (None to disable it) so that the next processes read it back as a memory-map
+    """
+    filenames = os.listdir(NI_directory)
+    identity = [[f, os.path.getsize(os.path.join(NI_directory, f)), os.path.getmtime(os.path.join(NI_directory, f))]\
+                for f in filenames]
+    key = hashlib.sha1(json.dumps([identity, [int(r) for r in screen['resolution']]]).encode()).hexdigest()
+
+    if key not in NI_BANKS:
+        fn = (os.path.join(folder, '%s.npy' % key) if folder is not None else None)
+        if (fn is not None) and os.path.isfile(fn):
+            NI_BANKS[key] = np.load(fn, mmap_mode='r')
+        else:
+            NIarray = np.array([2*img_after_hist_normalization(\
+                        adapt_to_screen_resolution(load(os.path.join(NI_directory, f)), screen))-1. for f in filenames])
+            NIarray.setflags(write=False) # shared between the stimuli
+            if fn is not None:
+                try:
+                    pathlib.Path(folder).mkdir(parents=True, exist_ok=True)
+                    tmp = os.path.join(folder, '%s-%i.tmp.npy' % (key, os.getpid()))
+                    np.save(tmp, NIarray)
+                    os.replace(tmp, fn)
+                except OSError as be:
+                    print(be)
+                    print(' /!\ unable to store the natural images bank in "%s" /!\ ' % folder)
+            NI_BANKS[key] = NIarray
+    return NI_BANKS[key]
+
+
+def NI_bank_folder(protocol):
+    """ folder storing the preprocessed bank (see "load_NI_bank"), None with "NI-bank-cache":false in the protocol """
+    if ('NI-bank-cache' in protocol) and not protocol['NI-bank-cache']:
+        return None
+    return os.path.join(CACHE_FOLDER, 'NI-bank')
+
+
 class natural_image(visual_stim):
 
     def __init__(self, protocol):
         super().__init__(protocol)
         super().init_experiment(protocol, ['Image-ID'], run_type='image')
-        self.NIarray = []
-        for filename in os.listdir(NI_directory):
-            img = load(os.path.join(NI_directory, filename))
-            new_img = adapt_to_screen_resolution(img, self.screen)
-            self.NIarray.append(2*img_after_hist_normalization(new_img)-1.)
+        self.NIarray = load_NI_bank(self.screen, folder=NI_bank_folder(protocol))
 
     def get_frame(self, index, parent=None):
         cls = (parent if parent is not None else self)
-        return cls.NIarray[int(cls.experiment['Image-ID'][index])]
+        return self.NIarray[int(cls.experiment['Image-ID'][index])]
                        
 
     def get_image(self, episode, time_from_episode_start=0, parent=None):
         cls = (parent if parent is not None else self)
-        return cls.NIarray[int(cls.experiment['Image-ID'][index])]
+        return self.NIarray[int(cls.experiment['Image-ID'][episode])]
             
 #####################################################
 ##  --    WITH VIRTUAL SCENE EXPLORATION    --- #####
@@ -1174,11 +1440,7 @@ class natural_image_vse(visual_stim):
         self.frame_refresh = protocol['movie_refresh_freq']
 
         # initializing set of NI
-        self.NIarray = []
-        for filename in os.listdir(NI_directory):
-            img = load(os.path.join(NI_directory, filename))
-            new_img = adapt_to_screen_resolution(img, self.screen)
-            self.NIarray.append(2*img_after_hist_normalization(new_img)-1.)
+        self.NIarray = load_NI_bank(self.screen, folder=NI_bank_folder(protocol))
 
 
     def compute_shifted_image(self, img, ix, iy):
@@ -1206,7 +1468,8 @@ class natural_image_vse(visual_stim):
             return int(cls.experiment['VSE-seed'][index])
 
         
-    def get_frames_sequence(self, index, parent=None):
+    def get_frames_sequence(self, index, parent=None, lazy=False):
+        """ with "lazy", the shifted images are computed only when accessed (see "lazy_frames") """
         cls = (parent if parent is not None else self)
         seed = self.get_seed(index, parent=cls)
 
@@ -1219,14 +1482,15 @@ class natural_image_vse(visual_stim):
         img = self.NIarray[int(cls.experiment['Image-ID'][index])]
             
         interval = cls.experiment['time_stop'][index]-cls.experiment['time_start'][index]
-        times, FRAMES = np.zeros(int(1.2*interval*cls.protocol['movie_refresh_freq']), dtype=int), []
+        times = np.zeros(int(1.2*interval*cls.protocol['movie_refresh_freq']), dtype=int)
         Times = np.arange(int(1.2*interval*cls.protocol['movie_refresh_freq']))/cls.protocol['movie_refresh_freq']
 
         for i, t in enumerate(vse['t']):
-            FRAMES.append(self.compute_shifted_image(img, int(vse['x'][i]), int(vse['y'][i])))
             times[Times>=t] = int(i)
-            
-        return times, FRAMES
+
+        FRAMES = lazy_frames(lambda i: self.compute_shifted_image(img, int(vse['x'][i]), int(vse['y'][i])),
+                             len(vse['t']))
+        return times, (FRAMES if lazy else list(FRAMES))
 
     def get_image(self, episode, time_from_episode_start=0, parent=None):
         cls = (parent if parent is not None else self)
@@ -1308,12 +1572,51 @@ class dense_noise(visual_stim):
 
 if __name__=='__main__':
 
-    import json, tempfile
+    import json, tempfile, argparse
     from pathlib import Path
+
+    parser=argparse.ArgumentParser(description="""
+    Visual stimulation
+    """,formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("protocol", type=str, nargs='?', default='physion/exp/protocols/multiprotocols-demo.json')
+    parser.add_argument("--latency", action="store_true",
+                        help='headless measure of the frame preparation of the "images_sequence" episodes')
+    parser.add_argument('-n', "--Nepisodes", type=int, default=3)
+    parser.add_argument('-l', "--lookahead", type=int, default=10)
+    parser.add_argument("--precompute", action="store_true",
+                        help='renders the "images_sequence" episodes in the frames cache (then used by "--latency")')
+    args = parser.parse_args()
     
-    with open('physion/exp/protocols/multiprotocols-demo.json', 'r') as fp:
+    with open(args.protocol, 'r') as fp:
         protocol = json.load(fp)
 
+    if args.precompute:
+        protocol['no-window'], protocol['frame-cache'] = True, True
+        stim = build_stim(protocol, no_psychopy=True)
+        tstart = time.time()
+        stim.precompute_frames()
+        print('frames rendered in %.1fs, cache: %s' % (time.time()-tstart, stim.frames_cache.stats()))
+        if not args.latency:
+            sys.exit()
+
+    if args.latency:
+        protocol['no-window'], protocol['frame-lookahead'] = True, args.lookahead
+        protocol['frame-cache'] = args.precompute # otherwise the full build would fill the cache
+        stim = build_stim(protocol, no_psychopy=True)
+        episodes = [i for i, run_type in enumerate(stim.experiment['frame_run_type']) if run_type=='images_sequence']
+        for i in episodes[:args.Nepisodes]:
+            # former behavior: all frames built before the episode
+            tstart = time.time()
+            FRAMES = [stim.gamma_corrected_lum(frame) for frame in stim.get_frames_sequence(i)[1]]
+            print('episode #%i, %i frames, full build: %.2fs, %.1fMB' % (i, len(FRAMES), time.time()-tstart,
+                                                                          np.sum([f.nbytes for f in FRAMES])/1e6))
+            del FRAMES
+            for prestart in [0, stim.experiment['interstim'][i]]:
+                res = stim.sequence_preparation_latency(i, prestart=prestart)
+                print('   - streamed (prepared %.1fs ahead): latency %.1fms, total wait %.1fms, max wait %.1fms, buffer %.1fMB' % (\
+                    prestart, 1e3*res['latency'], 1e3*res['total_wait'], 1e3*res['max_wait'], res['buffer_size']/1e6))
+        sys.exit()
+
     class df:
         def __init__(self):
             pass